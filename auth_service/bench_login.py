@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Login throughput benchmark against a local MySQL stand-in.
+
+The stand-in is a shared in-memory SQLite database behind a DB-API shim that
+speaks MySQLdb's %s paramstyle and adds configurable connect / query latency,
+so the cost of opening a connection per request can be compared with the pool
+and the user cache without a MySQL server:
+
+    python3 bench_login.py --threads 16 --requests 2000 --connect-ms 5 --query-ms 1
+"""
+import argparse, sqlite3, statistics, threading, time, base64
+from contextlib import contextmanager
+
+import server
+from db import ConnectionPool
+from cache import TTLCache
+
+DB_URI = "file:auth_bench?mode=memory&cache=shared"
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.queries = 0
+
+    def add(self, connects=0, queries=0):
+        with self.lock:
+            self.connects += connects
+            self.queries += queries
+
+
+class StandInCursor:
+    def __init__(self, cursor, stats, query_s):
+        self._cursor = cursor
+        self._stats = stats
+        self._query_s = query_s
+
+    def execute(self, query, args=()):
+        self._stats.add(queries=1)
+        if self._query_s:
+            time.sleep(self._query_s)
+        return self._cursor.execute(query.replace("%s", "?"), args)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+
+class StandInConnection:
+    def __init__(self, stats, connect_s, query_s):
+        stats.add(connects=1)
+        if connect_s:
+            time.sleep(connect_s)
+        self._conn = sqlite3.connect(DB_URI, uri=True, check_same_thread=False)
+        self._stats = stats
+        self._query_s = query_s
+
+    def cursor(self):
+        return StandInCursor(self._conn.cursor(), self._stats, self._query_s)
+
+    def close(self):
+        self._conn.close()
+
+
+class OneShot:
+    """A connection per request, which is what flask_mysqldb did"""
+
+    def __init__(self, connect):
+        self._connect = connect
+
+    @contextmanager
+    def connection(self):
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+
+def seed(n_users):
+    # Keep one connection open for the lifetime of the benchmark, a shared
+    # in-memory SQLite database disappears with its last connection
+    keeper = sqlite3.connect(DB_URI, uri=True, check_same_thread=False)
+    keeper.execute("DROP TABLE IF EXISTS users")
+    keeper.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT UNIQUE NOT NULL, password TEXT NOT NULL)")
+    keeper.executemany(
+        "INSERT INTO users (email, password) VALUES (?, ?)",
+        [(f"user{i}@example.com", "password") for i in range(n_users)],
+    )
+    keeper.commit()
+    return keeper
+
+
+def run(label, pool, cache, args):
+    server.pool = pool
+    server.users = cache
+    latencies = []
+    lock = threading.Lock()
+    per_thread = args.requests // args.threads
+
+    def worker(tid):
+        client = server.app.test_client()
+        local = []
+        for i in range(per_thread):
+            user = f"user{(tid * per_thread + i) % args.users}@example.com"
+            auth = base64.b64encode(f"{user}:password".encode()).decode()
+            t0 = time.perf_counter()
+            rv = client.post("/login", headers={"Authorization": f"Basic {auth}"})
+            local.append(time.perf_counter() - t0)
+            if rv.status_code != 200:
+                raise RuntimeError(f"login failed: {rv.status_code} {rv.data!r}")
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in range(args.threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    print(
+        f"{label:<18} {len(latencies) / elapsed:>9.0f} logins/s   "
+        f"p50 {p(0.50):6.2f}ms  p99 {p(0.99):6.2f}ms  mean {statistics.mean(latencies) * 1000:6.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200, help="distinct accounts logging in")
+    parser.add_argument("--connect-ms", type=float, default=5, help="simulated connection setup cost")
+    parser.add_argument("--query-ms", type=float, default=1, help="simulated query round trip")
+    parser.add_argument("--pool-size", type=int, default=10)
+    args = parser.parse_args()
+
+    server.logger.disabled = True
+    keeper = seed(args.users)
+
+    scenarios = [
+        ("connection/request", lambda c: OneShot(c), lambda: TTLCache(ttl=0)),
+        ("pool", lambda c: ConnectionPool(c, size=args.pool_size), lambda: TTLCache(ttl=0)),
+        ("pool + cache", lambda c: ConnectionPool(c, size=args.pool_size), lambda: TTLCache()),
+    ]
+    print(f"{args.requests} logins, {args.threads} threads, {args.users} users, "
+          f"connect {args.connect_ms}ms, query {args.query_ms}ms\n")
+    for label, make_pool, make_cache in scenarios:
+        stats = Stats()
+        connect = lambda: StandInConnection(stats, args.connect_ms / 1000, args.query_ms / 1000)
+        run(label, make_pool(connect), make_cache(), args)
+        print(f"{'':<18} {stats.connects} connections opened, {stats.queries} queries")
+
+    keeper.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import os, queue, threading, time, logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = int(os.getenv('MYSQL_POOL_SIZE', '10'))
+# Seconds to wait for a free connection before giving up
+POOL_TIMEOUT = float(os.getenv('MYSQL_POOL_TIMEOUT', '5'))
+# Connections older than this are closed and replaced, ahead of MySQL's wait_timeout
+POOL_RECYCLE = float(os.getenv('MYSQL_POOL_RECYCLE', '3600'))
+# Connections idle for longer than this are health checked before being handed out
+POOL_PING_AFTER = float(os.getenv('MYSQL_POOL_PING_AFTER', '30'))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class _Pooled:
+    __slots__ = ('conn', 'created', 'last_used')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created = self.last_used = time.monotonic()
+
+
+class ConnectionPool:
+    """
+    A bounded pool of DB-API connections shared by every request in the process.
+
+    At most `size` connections are open at once; callers beyond that wait up to
+    `timeout` seconds for one to be returned. Connections are opened lazily, so
+    the pool is safe to create before gunicorn forks its workers.
+    """
+
+    def __init__(self, connect, size=POOL_SIZE, timeout=POOL_TIMEOUT, recycle=POOL_RECYCLE, ping_after=POOL_PING_AFTER):
+        self._connect = connect
+        self._timeout = timeout
+        self._recycle = recycle
+        self._ping_after = ping_after
+        self._slots = threading.BoundedSemaphore(size)
+        # LIFO so the most recently used (warmest) connection is reused first
+        self._idle = queue.LifoQueue()
+
+    @contextmanager
+    def connection(self):
+        if not self._slots.acquire(timeout=self._timeout):
+            raise PoolTimeout(f"no database connection available within {self._timeout}s")
+
+        pooled = None
+        try:
+            pooled = self._checkout()
+            yield pooled.conn
+        except Exception:
+            # The connection may be in an unknown state, don't hand it to anyone else
+            if pooled:
+                self._close(pooled)
+                pooled = None
+            raise
+        finally:
+            if pooled:
+                pooled.last_used = time.monotonic()
+                self._idle.put(pooled)
+            self._slots.release()
+
+    def _checkout(self) -> _Pooled:
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                return _Pooled(self._connect())
+
+            now = time.monotonic()
+            if now - pooled.created > self._recycle:
+                self._close(pooled)
+                continue
+            if now - pooled.last_used > self._ping_after and not self._healthy(pooled):
+                self._close(pooled)
+                continue
+            return pooled
+
+    def _healthy(self, pooled: _Pooled) -> bool:
+        try:
+            cursor = pooled.conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception as e:
+            logger.warning("Discarding dead database connection: %s", e)
+            return False
+
+    def _close(self, pooled: _Pooled):
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    def close(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
@@ -14,3 +14,11 @@ CREATE TABLE users (
 
 
 INSERT INTO users (email, password) VALUES ('piush@gmail.com', 'password');
+
+-- Revoked token ids; version orders revocations so verifiers can sync incrementally
+CREATE TABLE revoked_tokens (
+    version BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    jti CHAR(32) NOT NULL UNIQUE,
+    expires_at DATETIME NOT NULL,
+    INDEX idx_expires_at (expires_at)
+);
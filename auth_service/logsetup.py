@@ -0,0 +1,160 @@
+"""
+Logging setup shared by the services.
+
+Records are handed to a bounded in-memory queue and formatted and written by
+a background thread, so a request never waits on stdout. The message and any
+traceback are rendered in the caller before the record is queued, so the log
+shows arguments as they were at the call and not after later mutation; pass
+arguments (logger.info("user %s", email)) rather than pre-formatting
+f-strings, so records below the level are never rendered at all.
+DEBUG records can be sampled to keep verbose loggers affordable.
+
+This module is copied verbatim into each service; keep the copies in sync.
+"""
+import atexit, json, logging, os, queue, random, sys, threading, time
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+# Per-logger overrides, e.g. "auth.access=DEBUG,pika=WARNING"
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+# "json" for one JSON object per line, "text" for humans
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+# Fraction of DEBUG records kept; INFO and above are never sampled
+LOG_DEBUG_SAMPLE = float(os.environ.get("LOG_DEBUG_SAMPLE", "1"))
+# Records dropped rather than blocking the caller once this many are waiting
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+
+# Attributes every LogRecord has; anything else was passed through `extra=` and is emitted as a field
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+# Renders tracebacks in AsyncHandler.prepare, the same way logging.Formatter would later
+_EXC_FORMATTER = logging.Formatter()
+
+
+class JSONFormatter(logging.Formatter):
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        out = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for k, v in vars(record).items():
+            if k not in _RESERVED:
+                out[k] = v
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, default=str)
+
+
+class SampleFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class AsyncHandler(logging.Handler):
+    """
+    Queues records for a writer thread instead of writing them inline.
+
+    The thread is started lazily per process, as gunicorn forks workers after
+    the app (and its logging) has been set up in the master.
+    """
+
+    def __init__(self, target: logging.Handler, maxsize: int = LOG_QUEUE_SIZE):
+        super().__init__()
+        self.target = target
+        self.queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    threading.Thread(target=self._run, name="log-writer", daemon=True).start()
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        """
+        Render the message and traceback now, as logging.handlers.QueueHandler
+        does: the arguments may be mutated, and the exception's frames freed,
+        by the time the writer thread gets to the record.
+        """
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _EXC_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            try:
+                if self.dropped:
+                    dropped, self.dropped = self.dropped, 0
+                    self.target.handle(logging.makeLogRecord({
+                        "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                        "msg": "Log queue full, dropped %d record(s)", "args": (dropped,),
+                    }))
+                self.target.handle(record)
+            finally:
+                self.queue.task_done()
+
+    def flush(self, timeout: float = 2):
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline and self._pid == os.getpid():
+            time.sleep(0.01)
+        try:
+            self.target.flush()
+        except (OSError, ValueError):
+            # The stream is already closed at interpreter exit, as logging.shutdown() allows for
+            pass
+
+
+def configure(service: str) -> logging.Logger:
+    """Install the async handler on the root logger; returns the service's logger"""
+    stream = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JSONFormatter(service))
+    else:
+        stream.setFormatter(logging.Formatter(f"%(asctime)s - {service} - %(name)s - %(levelname)s - %(message)s"))
+
+    handler = AsyncHandler(stream)
+    if LOG_DEBUG_SAMPLE < 1:
+        handler.addFilter(SampleFilter(LOG_DEBUG_SAMPLE))
+
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL.upper())
+
+    for pair in filter(None, (p.strip() for p in LOG_LEVELS.split(","))):
+        name, _, level = pair.partition("=")
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+    atexit.register(handler.flush)
+    return logging.getLogger(service)
+
+
+def flush():
+    """Write out queued records, e.g. before os._exit() which skips atexit"""
+    for h in logging.getLogger().handlers:
+        h.flush()
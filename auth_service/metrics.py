@@ -0,0 +1,52 @@
+import time
+from flask import Flask, Response, g, request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+REQUEST_LATENCY = Histogram(
+    "auth_request_duration_seconds", "Time spent handling a request",
+    ["method", "endpoint"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUESTS = Counter("auth_requests_total", "Requests handled", ["method", "endpoint", "status"])
+
+
+class CacheCollector:
+    """Reads the user cache's own hit/miss counters at scrape time, so lookups pay nothing extra"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def collect(self):
+        hits = CounterMetricFamily("auth_user_cache_hits", "Logins for unknown emails answered from the cache")
+        hits.add_metric([], self.cache.hits)
+        yield hits
+        misses = CounterMetricFamily("auth_user_cache_misses", "User lookups that went to MySQL")
+        misses.add_metric([], self.cache.misses)
+        yield misses
+        size = GaugeMetricFamily("auth_user_cache_entries", "Unknown emails currently cached")
+        size.add_metric([], len(self.cache))
+        yield size
+
+
+def init_app(app: Flask, cache=None):
+    """Time every request, export the user cache's hit rate and serve the registry on /metrics"""
+    if cache is not None:
+        REGISTRY.register(CacheCollector(cache))
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _observe(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+            REQUEST_LATENCY.labels(request.method, endpoint).observe(time.perf_counter() - start)
+            REQUESTS.labels(request.method, endpoint, str(response.status_code)).inc()
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
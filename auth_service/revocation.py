@@ -0,0 +1,154 @@
+import os, threading, time, logging
+
+logger = logging.getLogger(__name__)
+
+# How often each replica pulls new revocations; this bounds how long a revoked token keeps working
+REVOCATION_SYNC_INTERVAL = float(os.getenv('REVOCATION_SYNC_INTERVAL', '5'))
+# Past this without a successful sync, tokens are checked against MySQL directly
+REVOCATION_MAX_STALENESS = float(os.getenv('REVOCATION_MAX_STALENESS', '60'))
+REVOCATION_BATCH = 1000
+
+
+class DenySet:
+    """
+    An in-memory set of revoked token ids, tagged with the version of the
+    newest revocation it contains so it can be brought up to date incrementally.
+    Entries are dropped once the token they revoke would have expired anyway.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._lock = threading.Lock()
+        self._entries: dict[str, float] = {}
+
+    def __contains__(self, jti) -> bool:
+        return jti in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, jti: str, exp: float):
+        with self._lock:
+            self._entries[jti] = exp
+
+    def apply(self, entries: list[tuple[str, float]], version: int):
+        now = time.time()
+        with self._lock:
+            for jti, exp in entries:
+                if exp > now:
+                    self._entries[jti] = exp
+            self.version = max(self.version, version)
+            expired = [jti for jti, exp in self._entries.items() if exp <= now]
+            for jti in expired:
+                del self._entries[jti]
+
+
+class RevocationStore:
+    """Revocations persisted in MySQL; every revocation gets a new, increasing version"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def revoke(self, jti: str, exp: float) -> bool:
+        """Returns False if the token was already revoked, by this or any other replica"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    "INSERT IGNORE INTO revoked_tokens (jti, expires_at) VALUES (%s, FROM_UNIXTIME(%s))",
+                    (jti, int(exp)),
+                )
+                # The unique jti makes this the one atomic check shared by all replicas
+                inserted = cursor.rowcount > 0
+                # Opportunistically trim rows no verifier needs any more
+                cursor.execute("DELETE FROM revoked_tokens WHERE expires_at < NOW() - INTERVAL 1 DAY LIMIT 100")
+            finally:
+                cursor.close()
+        return inserted
+
+    def is_revoked(self, jti: str) -> bool:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1 FROM revoked_tokens WHERE jti = %s LIMIT 1", (jti,))
+                return cursor.fetchone() is not None
+            finally:
+                cursor.close()
+
+    def changes_since(self, version: int, limit: int = REVOCATION_BATCH) -> tuple[list[tuple[str, float]], int, bool]:
+        """Return revocations newer than `version`, the version they bring a reader to, and whether more remain"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    "SELECT version, jti, UNIX_TIMESTAMP(expires_at) FROM revoked_tokens "
+                    "WHERE version > %s AND expires_at > NOW() ORDER BY version LIMIT %s",
+                    (version, limit),
+                )
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+
+        entries = [(jti, float(exp)) for _, jti, exp in rows]
+        new_version = rows[-1][0] if rows else version
+        return entries, new_version, len(rows) == limit
+
+
+class RevocationSync:
+    """Keeps a DenySet current from the store on a background thread"""
+
+    def __init__(self, store: RevocationStore, interval: float = REVOCATION_SYNC_INTERVAL,
+                 max_staleness: float = REVOCATION_MAX_STALENESS):
+        self.store = store
+        self.interval = interval
+        self.max_staleness = max_staleness
+        self.denied = DenySet()
+        # None until the first sync succeeds; a deny-set that never synced is never fresh
+        self.synced_at: float | None = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        # Threads don't survive gunicorn's fork, so start one per worker on first use
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="revocation-sync", daemon=True)
+            self._thread.start()
+
+    @property
+    def fresh(self) -> bool:
+        self.ensure_started()
+        return self.synced_at is not None and time.monotonic() - self.synced_at < self.max_staleness
+
+    def is_revoked(self, jti: str | None) -> bool:
+        if not jti:
+            return False
+        if jti in self.denied:
+            return True
+        # Until the deny-set is known to be current, a revocation made elsewhere may be missing from it
+        return not self.fresh and self.store.is_revoked(jti)
+
+    def revoke(self, jti: str, exp: float) -> bool:
+        inserted = self.store.revoke(jti, exp)
+        self.denied.add(jti, exp)
+        return inserted
+
+    def sync(self):
+        more = True
+        while more:
+            entries, version, more = self.store.changes_since(self.denied.version)
+            self.denied.apply(entries, version)
+        self.synced_at = time.monotonic()
+
+    def _run(self):
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                logger.warning("Revocation sync failed: %s", e)
+            time.sleep(self.interval)
@@ -1,10 +1,13 @@
-import jwt, datetime, os, logging
+import jwt, datetime, os, uuid
+import MySQLdb
 from flask import Flask, request, jsonify, Response
-from flask_mysqldb import MySQL
+from db import ConnectionPool, PoolTimeout
+from cache import TTLCache
+from revocation import RevocationStore, RevocationSync
+import metrics, logsetup
 
 # Set up logging
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
+logger = logsetup.configure("auth")
 
 # ===================================================================================================
 # Configurations
@@ -12,87 +15,169 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 
 app.config['MYSQL_HOST'] = os.getenv('MYSQL_HOST', 'localhost')
+app.config['MYSQL_PORT'] = int(os.getenv('MYSQL_PORT', '3306'))
 app.config['MYSQL_USER'] = os.getenv('MYSQL_USER', 'demo_user')
 app.config['MYSQL_PASSWORD'] = os.getenv('MYSQL_PASSWORD', 'secure_password')
 app.config['MYSQL_DB'] = os.getenv('MYSQL_DB', 'auth_db')
 app.config['SECRET_KEY'] = os.getenv('JWT_SECRET', 'your_secret_key')
+app.config['ACCESS_TOKEN_TTL'] = int(os.getenv('ACCESS_TOKEN_TTL', '900'))
+app.config['REFRESH_TOKEN_TTL'] = int(os.getenv('REFRESH_TOKEN_TTL', str(7 * 24 * 3600)))
 
-mysql = MySQL(app)
+def connect_mysql():
+    # autocommit so a pooled connection never reads from a stale repeatable-read snapshot
+    return MySQLdb.connect(
+        host=app.config['MYSQL_HOST'],
+        port=app.config['MYSQL_PORT'],
+        user=app.config['MYSQL_USER'],
+        passwd=app.config['MYSQL_PASSWORD'],
+        db=app.config['MYSQL_DB'],
+        autocommit=True,
+    )
+
+pool = ConnectionPool(connect_mysql)
+users = TTLCache()
+revocations = RevocationSync(RevocationStore(pool))
+metrics.init_app(app, users)
+
+# Only the columns login needs, by the unique email index
+USER_QUERY = "SELECT email, password FROM users WHERE email = %s LIMIT 1"
 # ===================================================================================================
 # Routes
-#   - POST  /login      {Basic Authorization}
-#   - GET   /me         {Bearer Authorization}
-#   - GET   /health     NONE
+#   - POST  /login        {Basic Authorization}
+#   - POST  /refresh      {Bearer Authorization: refresh token}
+#   - POST  /revoke       {Bearer Authorization}
+#   - GET   /me           {Bearer Authorization}
+#   - GET   /revocations  {Bearer Authorization: service token}
+#   - GET   /health       NONE
+#   - GET   /metrics      NONE
 # ===================================================================================================
 @app.route('/login', methods=['POST'])
 def login():
     try:
-        logger.info("Login attempt received")
+        logger.debug("Login attempt received")
         auth = request.authorization
         if not auth or not auth.username or not auth.password:
             logger.warning("Missing authorization headers")
             return Response('Please provide proper authorization headers', 401, {'WWW-Authenticate': 'Basic realm="Login required!"'})
 
-        logger.info(f"Login attempt for user: {auth.username}")
-
-        if not hasattr(mysql, 'connection') or mysql.connection is None:
-            logger.error("Database connection is None")
-            return Response('Database connection error', 500)
-
-        cursor = mysql.connection.cursor()
-        logger.debug(f"Executing query for user: {auth.username}")
-        res = cursor.execute("SELECT * FROM users WHERE email=%s", (auth.username,))
-        logger.debug(f"Query returned {res} rows")
-
-        if res > 0:
-            user_row = cursor.fetchone()
-            email, password = user_row[1], user_row[2]
-            logger.debug(f"Found user: {email}")
-
-            if auth.username != email or auth.password != password:
-                logger.warning(f"Invalid credentials for user: {auth.username}")
-                cursor.close()
-                return Response('Email or password is incorrect', 401, {'WWW-Authenticate': 'Basic realm="Login required!"'})
-            else:
-                logger.info(f"Creating token for user: {email}")
-                token = create_token(email, app.config['SECRET_KEY'], True)
-                cursor.close()
-                logger.info("Login successful")
-                return token
-        else:
-            logger.warning(f"User not found: {auth.username}")
-            cursor.close()
+        logger.debug("Login attempt for user: %s", auth.username)
+
+        user, cached = lookup_user(auth.username)
+        if user and cached and tuple(user) != (auth.username, auth.password):
+            # The password may have changed since the record was cached
+            user, _ = lookup_user(auth.username, fresh=True)
+        if not user:
+            logger.warning("User not found: %s", auth.username)
             return Response('Could not verify', 401, {'WWW-Authenticate': 'Basic realm="Login required!"'})
+
+        email, password = user
+        if auth.username != email or auth.password != password:
+            logger.warning("Invalid credentials for user: %s", auth.username)
+            return Response('Email or password is incorrect', 401, {'WWW-Authenticate': 'Basic realm="Login required!"'})
+
+        logger.debug("Creating token for user: %s", email)
+        logger.debug("Login successful")
+        return issue_tokens(email, True)
+    except PoolTimeout as e:
+        logger.error("Database pool exhausted: %s", e)
+        return Response('Database busy, try again', 503, {'Retry-After': '1'})
+    except Exception as e:
+        logger.error("Unexpected error in login: %s", e)
+        return Response('Internal server error', 500)
+
+@app.route('/refresh', methods=['POST'])
+def refresh():
+    token = bearer_token()
+    if not token:
+        return Response('Please provide proper authorization headers', 401, {'WWW-Authenticate': 'Bearer realm="Login required!"'})
+
+    decoded = validate_jwt(token, app.config['SECRET_KEY'], token_type='refresh')
+    if decoded is None:
+        return Response('Refresh token is invalid, expired or revoked', 401, {'WWW-Authenticate': 'Bearer realm="Login required!"'})
+
+    # Refresh tokens are single use, so a stolen one stops working after its next legitimate use.
+    # Only the call that actually revokes it gets new tokens; a concurrent or replayed one,
+    # here or on a replica whose deny-set has not caught up, is refused.
+    try:
+        first_use = revocations.revoke(decoded['jti'], decoded['exp'])
+    except Exception as e:
+        logger.error("Could not rotate refresh token: %s", e)
+        return Response('Internal server error', 500)
+    if not first_use:
+        logger.warning("Refresh token reused for user: %s", decoded['user_email'])
+        return Response('Refresh token is invalid, expired or revoked', 401, {'WWW-Authenticate': 'Bearer realm="Login required!"'})
+
+    return issue_tokens(decoded['user_email'], decoded['is_admin'])
+
+@app.route('/revoke', methods=['POST'])
+def revoke():
+    """Revoke the bearer token and, if given in the body, its refresh token"""
+    token = bearer_token()
+    if not token:
+        return Response('Please provide proper authorization headers', 401, {'WWW-Authenticate': 'Bearer realm="Login required!"'})
+
+    decoded = validate_jwt(token, app.config['SECRET_KEY'], token_type=None)
+    if decoded is None:
+        return Response('Token is invalid or expired', 401, {'WWW-Authenticate': 'Bearer realm="Login required!"'})
+
+    targets = [decoded]
+    body = request.get_json(silent=True) or {}
+    if body.get('refresh_token'):
+        extra = validate_jwt(body['refresh_token'], app.config['SECRET_KEY'], token_type='refresh')
+        if extra is None or extra['user_email'] != decoded['user_email']:
+            return Response('Refresh token is invalid', 400)
+        targets.append(extra)
+
+    try:
+        for t in targets:
+            if t.get('jti'):
+                revocations.revoke(t['jti'], t['exp'])
     except Exception as e:
-        logger.error(f"Unexpected error in login: {e}")
+        logger.error("Could not revoke token: %s", e)
         return Response('Internal server error', 500)
 
+    return Response('Token revoked', 200)
+
 @app.route('/me', methods=['GET'])
 def me():
-    auth = request.headers.get('Authorization')
-    if not auth or not auth.startswith('Bearer'):
+    token = bearer_token()
+    if not token:
         return Response('Please provide proper authorization headers', 401, {'WWW-Authenticate': 'Bearer realm="Login required!"'})
 
-    token = auth.split(' ')[1]
     decoded = validate_jwt(token, app.config['SECRET_KEY'])
     if decoded is None:
         return Response('Token is invalid or expired', 401, {'WWW-Authenticate': 'Bearer realm="Login required!"'})
 
     return decoded
 
+@app.route('/revocations', methods=['GET'])
+def revocation_feed():
+    """Revocations newer than ?since=<version>, for verifiers keeping their own deny-set"""
+    # Only services holding the signing key (the gateway) may read the feed
+    token = bearer_token()
+    if not token or validate_jwt(token, app.config['SECRET_KEY'], token_type='service') is None:
+        return Response('Service token required', 401, {'WWW-Authenticate': 'Bearer realm="Service"'})
+
+    since = request.args.get('since', 0, type=int)
+    try:
+        entries, version, more = revocations.store.changes_since(since)
+    except Exception as e:
+        logger.error("Could not read revocations: %s", e)
+        return Response('Internal server error', 500)
+
+    return jsonify({'version': version, 'more': more, 'revoked': entries})
+
 @app.route('/health', methods=['GET'])
 def health():
     try:
         # Test database connection
-        if hasattr(mysql, 'connection') and mysql.connection is not None:
-            cursor = mysql.connection.cursor()
+        with pool.connection() as conn:
+            cursor = conn.cursor()
             cursor.execute("SELECT 1")
             cursor.close()
-            db_status = "connected"
-        else:
-            db_status = "disconnected"
+        db_status = "connected"
     except Exception as e:
-        logger.error(f"Health check DB error: {e}")
+        logger.error("Health check DB error: %s", e)
         db_status = f"error: {str(e)}"
 
     return jsonify({
@@ -106,26 +191,75 @@ def health():
 # ===================================================================================================
 # Helper methods
 # ===================================================================================================
-def create_token(username: str, secret: str, is_admin: bool) -> str:
+def fetch_user(email: str) -> tuple[str, str] | None:
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(USER_QUERY, (email,))
+            return cursor.fetchone()
+        finally:
+            cursor.close()
+
+def lookup_user(email: str, fresh: bool = False) -> tuple[tuple[str, str] | None, bool]:
+    """
+    The (email, password) record, and whether it came from the cache. Records
+    and emails with no account are cached for USER_CACHE_TTL seconds. Code
+    that changes a password or creates or deletes a user must call
+    users.invalidate(email), so the change takes effect at once; a wrong
+    password against a cached record is always re-checked against MySQL.
+    """
+    if not fresh:
+        user = users.get(email)
+        if user is False:
+            return None, True
+        if user:
+            return user, True
+
+    user = fetch_user(email)
+    users.set(email, tuple(user) if user else False)
+    return user, False
+
+def bearer_token() -> str | None:
+    auth = request.headers.get('Authorization')
+    if not auth or not auth.startswith('Bearer '):
+        return None
+    return auth.split(' ')[1] or None
+
+def issue_tokens(username: str, is_admin: bool) -> Response:
+    """The access token is the body, as it always was; the refresh token rides in a header"""
+    access = create_token(username, app.config['SECRET_KEY'], is_admin)
+    refresh = create_token(username, app.config['SECRET_KEY'], is_admin, token_type='refresh')
+    return Response(access, 200, {'X-Refresh-Token': refresh})
+
+def create_token(username: str, secret: str, is_admin: bool, token_type: str = 'access') -> str:
+    ttl = app.config['REFRESH_TOKEN_TTL'] if token_type == 'refresh' else app.config['ACCESS_TOKEN_TTL']
     return jwt.encode(
         {
             'user_email': username,
             'is_admin': is_admin,
-            'exp': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1),
+            'type': token_type,
+            'jti': uuid.uuid4().hex,
+            'exp': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=ttl),
             'iat': datetime.datetime.now(datetime.timezone.utc)
         },
         secret,
         algorithm='HS256'
     )
 
-def validate_jwt(token: str, secret: str) -> dict | None:
+def validate_jwt(token: str, secret: str, token_type: str | None = 'access') -> dict | None:
     try:
         decoded = jwt.decode(token, secret, algorithms=['HS256'])
-        return decoded
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
 
+    # Tokens issued before refresh tokens existed carry no type and are access tokens
+    if token_type and decoded.get('type', 'access') != token_type:
+        return None
+    if revocations.is_revoked(decoded.get('jti')):
+        return None
+    return decoded
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,91 @@
+"""The MySQL connection pool (db.py), with stand-in connections"""
+import threading
+import pytest
+from db import ConnectionPool, PoolTimeout
+
+
+class Connection:
+    opened = 0
+
+    def __init__(self, healthy=True):
+        Connection.opened += 1
+        self.healthy = healthy
+        self.closed = False
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, args=()):
+        if not self.healthy:
+            raise OSError("server has gone away")
+
+    def fetchall(self):
+        return [(1,)]
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    Connection.opened = 0
+
+
+def test_connections_are_reused():
+    pool = ConnectionPool(Connection, size=2)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    assert Connection.opened == 1
+
+
+def test_callers_beyond_the_size_wait_then_time_out():
+    pool = ConnectionPool(Connection, size=1, timeout=0.05)
+    with pool.connection():
+        with pytest.raises(PoolTimeout):
+            with pool.connection():
+                pass
+
+
+def test_a_waiter_gets_the_returned_connection():
+    pool = ConnectionPool(Connection, size=1, timeout=5)
+    got = []
+
+    def wait():
+        with pool.connection() as conn:
+            got.append(conn)
+
+    with pool.connection() as held:
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+    waiter.join(5)
+    assert got == [held]
+
+
+def test_a_connection_that_raised_is_discarded():
+    pool = ConnectionPool(Connection, size=1)
+    with pytest.raises(ValueError):
+        with pool.connection() as broken:
+            raise ValueError("query failed")
+    assert broken.closed
+    with pool.connection() as fresh:
+        assert fresh is not broken
+
+
+def test_old_connections_are_recycled():
+    pool = ConnectionPool(Connection, size=1, recycle=0)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is not first
+    assert first.closed
+
+
+def test_dead_idle_connections_are_replaced():
+    pool = ConnectionPool(Connection, size=1, ping_after=0)
+    with pool.connection() as first:
+        first.healthy = False
+    with pool.connection() as second:
+        assert second is not first and second.healthy
+    assert first.closed
@@ -0,0 +1,60 @@
+"""Login against the SQLite stand-in from bench_login.py, with the user cache"""
+import base64
+import pytest
+
+pytest.importorskip("MySQLdb")
+import server
+import bench_login
+from cache import TTLCache
+
+EMAIL = "user0@example.com"
+
+
+@pytest.fixture
+def db(monkeypatch):
+    keeper = bench_login.seed(2)
+    stats = bench_login.Stats()
+    monkeypatch.setattr(server, "pool", bench_login.OneShot(lambda: bench_login.StandInConnection(stats, 0, 0)))
+    monkeypatch.setattr(server, "users", TTLCache(ttl=60))
+    yield keeper, stats
+    keeper.close()
+
+
+def login(password, email=EMAIL):
+    auth = base64.b64encode(f"{email}:{password}".encode()).decode()
+    return server.app.test_client().post("/login", headers={"Authorization": f"Basic {auth}"}).status_code
+
+
+def test_repeat_logins_are_served_from_the_cache(db):
+    keeper, stats = db
+    assert login("password") == 200
+    assert login("password") == 200
+    assert stats.queries == 1
+
+
+def test_new_password_is_read_despite_a_cached_record(db):
+    keeper, stats = db
+    assert login("password") == 200
+    keeper.execute("UPDATE users SET password = 'changed' WHERE email = ?", (EMAIL,))
+    keeper.commit()
+
+    assert login("changed") == 200
+    assert login("password") == 401
+
+
+def test_invalidated_record_is_read_again(db):
+    keeper, stats = db
+    assert login("password") == 200
+    keeper.execute("DELETE FROM users WHERE email = ?", (EMAIL,))
+    keeper.commit()
+
+    server.users.invalidate(EMAIL)
+    assert login("password") == 401
+    assert stats.queries == 2
+
+
+def test_unknown_emails_are_cached(db):
+    keeper, stats = db
+    assert login("password", "nobody@example.com") == 401
+    assert login("password", "nobody@example.com") == 401
+    assert stats.queries == 1
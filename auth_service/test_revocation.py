@@ -0,0 +1,105 @@
+"""Refresh token reuse, the revocation feed's service token, and the deny-set's fallback to the store"""
+import datetime, time
+import jwt
+import pytest
+from revocation import RevocationSync
+
+
+class Store:
+    """RevocationStore in memory; revocations made "elsewhere" skip the local deny-set"""
+
+    def __init__(self):
+        self.revoked: dict[str, float] = {}
+        self.lookups = 0
+
+    def revoke(self, jti, exp):
+        first = jti not in self.revoked
+        self.revoked.setdefault(jti, exp)
+        return first
+
+    def is_revoked(self, jti):
+        self.lookups += 1
+        return jti in self.revoked
+
+    def changes_since(self, version, limit=1000):
+        entries = list(self.revoked.items())[version:version + limit]
+        return entries, version + len(entries), False
+
+
+@pytest.fixture
+def sync(monkeypatch):
+    sync = RevocationSync(Store(), max_staleness=60)
+    # Synced by hand instead of on the background thread
+    monkeypatch.setattr(sync, "ensure_started", lambda: None)
+    return sync
+
+
+def test_unsynced_deny_set_falls_back_to_the_store(sync):
+    sync.store.revoke("elsewhere", time.time() + 60)
+    assert sync.is_revoked("elsewhere")
+    assert not sync.is_revoked("other")
+    assert sync.store.lookups == 2
+
+
+def test_synced_deny_set_is_trusted(sync):
+    sync.store.revoke("elsewhere", time.time() + 60)
+    sync.sync()
+    assert sync.is_revoked("elsewhere")
+    assert not sync.is_revoked("other")
+    assert sync.store.lookups == 0
+
+
+def test_stale_deny_set_falls_back_to_the_store(sync):
+    sync.sync()
+    sync.synced_at -= 61
+    sync.store.revoke("elsewhere", time.time() + 60)
+    assert sync.is_revoked("elsewhere")
+
+
+def test_local_revocations_apply_at_once(sync):
+    assert sync.revoke("mine", time.time() + 60)
+    assert not sync.revoke("mine", time.time() + 60)
+    assert sync.is_revoked("mine")
+
+
+# ---------------------------------------------------------------------------------------------------
+# Routes; the server needs MySQLdb importable
+# ---------------------------------------------------------------------------------------------------
+@pytest.fixture
+def app(monkeypatch):
+    pytest.importorskip("MySQLdb")
+    import server
+    monkeypatch.setattr(server, "revocations", RevocationSync(Store()))
+    monkeypatch.setattr(server.revocations, "ensure_started", lambda: None)
+    return server
+
+
+def test_refresh_tokens_are_single_use(app):
+    client = app.app.test_client()
+    refresh = app.create_token("a@example.com", app.app.config['SECRET_KEY'], True, token_type='refresh')
+    first = client.post("/refresh", headers={"Authorization": f"Bearer {refresh}"})
+    assert first.status_code == 200
+    assert first.headers["X-Refresh-Token"] != refresh
+
+    replayed = client.post("/refresh", headers={"Authorization": f"Bearer {refresh}"})
+    assert replayed.status_code == 401
+
+
+def test_access_tokens_cannot_refresh(app):
+    access = app.create_token("a@example.com", app.app.config['SECRET_KEY'], True)
+    assert app.app.test_client().post("/refresh", headers={"Authorization": f"Bearer {access}"}).status_code == 401
+
+
+def test_revocation_feed_requires_a_service_token(app):
+    client = app.app.test_client()
+    secret = app.app.config['SECRET_KEY']
+    assert client.get("/revocations").status_code == 401
+
+    access = app.create_token("a@example.com", secret, True)
+    assert client.get("/revocations", headers={"Authorization": f"Bearer {access}"}).status_code == 401
+
+    exp = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=60)
+    service = jwt.encode({"type": "service", "sub": "gateway", "exp": exp}, secret, algorithm="HS256")
+    response = client.get("/revocations", headers={"Authorization": f"Bearer {service}"})
+    assert response.status_code == 200
+    assert response.get_json()["revoked"] == []
@@ -1,7 +1,22 @@
 import pika, sys, os
 from pymongo import MongoClient
-from gridfs import GridFS
-from convert import to_mp3
+from convert import to_mp3, metrics, logsetup, drain, shards
+
+logger = logsetup.configure("converter")
+
+def make_callback(fs_videos, fs_mp3, jobs):
+    """The on_message callback: convert one video, then ack it, or nack it for another converter"""
+    def callback(ch, method, properties, body):
+        if drain.draining():
+            # Delivered while shutting down; another converter will take it
+            ch.basic_nack(delivery_tag = method.delivery_tag)
+            return
+        err = to_mp3.start(body, fs_videos, fs_mp3, ch, jobs, properties)
+        if err:
+            ch.basic_nack(delivery_tag = method.delivery_tag)
+        else:
+            ch.basic_ack(delivery_tag = method.delivery_tag)
+    return callback
 
 def main():
     try:
@@ -14,8 +29,9 @@ def main():
         db_videos = client.gateway_db
         db_mp3 = client.mp3
 
-        fs_videos = GridFS(db_videos)
-        fs_mp3 = GridFS(db_mp3)
+        # Same shard lists as the gateway, so both route every fid to the same bucket
+        fs_videos = shards.ShardedGridFS.from_env("VIDEO_SHARDS", db_videos)
+        fs_mp3 = shards.ShardedGridFS.from_env("MP3_SHARDS", db_mp3)
 
         connection = pika.BlockingConnection(
             pika.ConnectionParameters(
@@ -24,23 +40,34 @@ def main():
         )
         channel = connection.channel()
 
-        def callback(ch, method, _properties, body):
-            err = to_mp3.start(body, fs_videos, fs_mp3, ch)
-            if err:
-                ch.basic_nack(delivery_tag = method.delivery_tag)
-            else:
-                ch.basic_ack(delivery_tag = method.delivery_tag)
+        metrics.serve("rabbitmq", [os.environ.get("VIDEO_QUEUE"), os.environ.get("MP3_QUEUE")])
+
+        # One job at a time: anything prefetched would only wait behind it, and would
+        # have to be handed back on shutdown
+        channel.basic_qos(prefetch_count=1)
 
-        channel.basic_consume(
+        consumer_tag = channel.basic_consume(
             queue = os.environ.get("VIDEO_QUEUE"),
-            on_message_callback = lambda ch, method, properties, body: callback(ch, method, properties, body),
+            on_message_callback = make_callback(fs_videos, fs_mp3, db_videos.jobs),
         )
 
-        print(" [*] Waiting for messages. To exit press CTRL+C")
+        # On SIGTERM, stop taking deliveries and let the running job finish (or
+        # checkpoint) within DRAIN_GRACE_SECONDS before exiting
+        drain.install()
+
+        logger.info("Waiting for messages. To exit press CTRL+C")
+
+        while not drain.draining():
+            connection.process_data_events(time_limit=1)
 
-        channel.start_consuming()
+        logger.info("SIGTERM received, no longer taking jobs")
+        channel.basic_cancel(consumer_tag)
+        connection.close()
+        logger.info("Drained, exiting")
+        logsetup.flush()
     except Exception as e:
-        print(f" [!] Error: {e}")
+        logger.error("Error: %s", e)
+        logsetup.flush()
         try:
             sys.exit(1)
         except SystemExit:
@@ -50,7 +77,8 @@ if __name__ == "__main__":
     try:
         main()
     except KeyboardInterrupt:
-        print(" [*] Interrupted")
+        logger.info("Interrupted")
+        logsetup.flush()
         try:
             sys.exit(0)
         except SystemExit:
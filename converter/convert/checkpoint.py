@@ -0,0 +1,129 @@
+"""
+Segmented encoding with checkpoints, so a long conversion survives its pod.
+
+Audio longer than CHECKPOINT_MIN_SECONDS is decoded in segments of
+CHECKPOINT_SEGMENT_SECONDS of source audio. Each finished segment's PCM, after
+silence trimming, is stored losslessly (FLAC) in the mp3 GridFS and recorded
+on the job document (`checkpoint`), together with the waveform and silence
+trimming state at that point, including any audio the trimmer is holding
+back. When the message is redelivered - the pod was drained or killed -
+decoding resumes after the last stored segment instead of starting over.
+Once the last segment is done, the stored PCM is encoded as one MP3, so the
+result is the same as a single-pass encode: no encoder padding or trimming
+decision falls on a segment boundary. The segments are deleted after the MP3
+is stored.
+"""
+import logging, os, shutil
+from bson.objectid import ObjectId
+from convert import encoder, jobs as job_status, metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds of source audio per checkpointed segment; 0 disables checkpointing
+CHECKPOINT_SEGMENT_SECONDS = int(os.environ.get("CHECKPOINT_SEGMENT_SECONDS", "120"))
+# Shorter audio is encoded in one go, restarting it is cheap
+CHECKPOINT_MIN_SECONDS = float(os.environ.get("CHECKPOINT_MIN_SECONDS", "600"))
+
+# Checkpoints whose segments hold anything else (MP3 segments of older converters) are not resumed
+SEGMENT_FORMAT = encoder.LOSSLESS_CODEC
+
+
+def wanted(jobs, message: dict, duration: float) -> bool:
+    # The checkpoint lives on the job document, so there has to be one
+    return (
+        CHECKPOINT_SEGMENT_SECONDS > 0
+        and duration > CHECKPOINT_MIN_SECONDS
+        and jobs is not None
+        and bool(message.get("job_id"))
+    )
+
+
+def spans(duration: float, seconds: int = CHECKPOINT_SEGMENT_SECONDS) -> list[tuple[float, float]]:
+    starts = range(0, int(-(-duration // seconds)) * seconds, seconds)
+    return [(start, min(start + seconds, duration)) for start in starts]
+
+
+def load(jobs, message: dict) -> dict | None:
+    try:
+        doc = jobs.find_one({"_id": ObjectId(message["job_id"])}, {"checkpoint": 1})
+    except Exception as e:
+        logger.error("Could not load checkpoint of job %s: %s", message.get("job_id"), e)
+        return None
+
+    checkpoint = (doc or {}).get("checkpoint")
+    # Segments cut at another length cannot be continued
+    if not checkpoint or checkpoint.get("segment_seconds") != CHECKPOINT_SEGMENT_SECONDS:
+        return None
+    if checkpoint.get("format") != SEGMENT_FORMAT:
+        return None
+    return checkpoint
+
+
+def encode(audio, path: str, fs, jobs, message: dict, watcher, envelope, trimmer=None):
+    """
+    Encode `audio` to `path` segment by segment, resuming from the job's checkpoint.
+
+    Raises job_status.Cancelled if the job is cancelled between segments; the
+    exceptions raised by `watcher` while a segment is encoding pass through and
+    leave the checkpoint in place.
+    """
+    checkpoint = load(jobs, message)
+    # The envelope and trimmer state count samples, so they only carry over at the same rate
+    fps = encoder.sample_rate(audio)
+    if checkpoint and ((trimmer is None) != (checkpoint.get("trimmer") is None) or checkpoint.get("fps") != fps):
+        checkpoint = None
+    if checkpoint:
+        envelope.restore(checkpoint["envelope"])
+        if trimmer:
+            trimmer.restore(checkpoint["trimmer"])
+        logger.info("Job %s resuming after segment %d", message["job_id"], len(checkpoint["segments"]))
+        metrics.RESUMED_SEGMENTS.inc(len(checkpoint["segments"]))
+    else:
+        checkpoint = {"segment_seconds": CHECKPOINT_SEGMENT_SECONDS, "format": SEGMENT_FORMAT, "fps": fps, "segments": []}
+
+    segment_path = f"{path}.segment.{SEGMENT_FORMAT}"
+    bounds = spans(audio.duration, CHECKPOINT_SEGMENT_SECONDS)
+    try:
+        for i in range(len(checkpoint["segments"]), len(bounds)):
+            start, end = bounds[i]
+            encoder.encode(
+                audio.subclipped(start, end), segment_path, logger=watcher, sinks=[envelope],
+                filters=[trimmer] if trimmer else [], final=i == len(bounds) - 1, codec=encoder.LOSSLESS_CODEC,
+            )
+            with open(segment_path, "rb") as f:
+                fid = fs.put(f, metadata={"job_id": message["job_id"], "segment": i})
+
+            checkpoint["segments"].append(fid)
+            checkpoint["envelope"] = envelope.state()
+            checkpoint["trimmer"] = trimmer.state() if trimmer else None
+            if not job_status.update(jobs, message, checkpoint=checkpoint):
+                discard(fs, jobs, message, checkpoint)
+                raise job_status.Cancelled(message["job_id"])
+            metrics.CHECKPOINTS.inc()
+
+        encoder.join(_download(fs, checkpoint["segments"], segment_path), path, fps, audio.nchannels, logger=watcher)
+    finally:
+        if os.path.exists(segment_path):
+            os.remove(segment_path)
+    return checkpoint
+
+
+def _download(fs, fids: list, path: str):
+    """Fetch the segments to `path` one at a time, each overwriting the last once it has been read"""
+    for fid in fids:
+        with open(path, "wb") as f:
+            shutil.copyfileobj(fs.get(fid), f)
+        yield path
+
+
+def discard(fs, jobs, message: dict, checkpoint: dict | None = None):
+    """Delete the stored segments once they are no longer needed"""
+    checkpoint = checkpoint or load(jobs, message)
+    if not checkpoint:
+        return
+    for fid in checkpoint["segments"]:
+        try:
+            fs.delete(fid)
+        except Exception as e:
+            logger.error("Could not delete segment %s of job %s: %s", fid, message.get("job_id"), e)
+    job_status.update(jobs, message, checkpoint=None)
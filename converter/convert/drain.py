@@ -0,0 +1,27 @@
+import os, signal, time
+
+# Time a running job gets to finish after SIGTERM; keep it below the pod's terminationGracePeriodSeconds
+DRAIN_GRACE_SECONDS = float(os.environ.get("DRAIN_GRACE_SECONDS", "100"))
+
+_deadline = None
+
+
+def begin(grace: float = DRAIN_GRACE_SECONDS):
+    """Stop taking jobs; the one running may carry on until the grace period is over"""
+    global _deadline
+    if _deadline is None:
+        _deadline = time.monotonic() + grace
+
+
+def draining() -> bool:
+    return _deadline is not None
+
+
+def expired() -> bool:
+    return _deadline is not None and time.monotonic() >= _deadline
+
+
+def install():
+    # Only a flag is set here: the handler may run in the middle of a pika or
+    # logging call, so everything else happens once the consumer loop notices.
+    signal.signal(signal.SIGTERM, lambda signum, frame: begin())
@@ -0,0 +1,93 @@
+import os
+import subprocess as sp
+import numpy as np
+from moviepy.audio.io.ffmpeg_audiowriter import FFMPEG_AudioWriter
+from moviepy.config import FFMPEG_BINARY
+
+# Sample rate used when the clip does not report its own, as AudioClip.write_audiofile did for MP3 output
+ENCODE_FPS = 44100
+ENCODE_NBYTES = 2
+# Samples per PCM chunk handed through the pipeline
+ENCODE_CHUNK = int(os.environ.get("ENCODE_CHUNK", "2000"))
+ENCODE_CODEC = "libmp3lame"
+# Lossless codec for PCM that is stored now and encoded later
+LOSSLESS_CODEC = "flac"
+
+
+def sample_rate(clip) -> int:
+    """The source's own rate, so audio is not resampled on its way to the encoder"""
+    return int(getattr(clip, "fps", None) or ENCODE_FPS)
+
+
+def encode(clip, path: str, logger=None, sinks=(), filters=(), final=True, codec=ENCODE_CODEC):
+    """
+    Decode `clip` to 16-bit PCM at its own sample rate, chunk by chunk, and
+    pipe it to an MP3 encoder.
+
+    Each chunk first passes through the filters' process() (which may drop or
+    hold back audio, releasing what is left from flush() at the end) and is
+    then handed to each sink's feed() as it is encoded, so analyses such as the
+    waveform envelope run in the same pass over the audio instead of decoding
+    it a second time. `final` is False when the clip is one segment of a longer
+    encode: the filters are not flushed, and what they hold back is part of
+    their state() and released in a later segment. `logger` receives moviepy's
+    progress callbacks (and may abort the encode by raising from them); the
+    encoder is always closed.
+    """
+    fps = sample_rate(clip)
+    writer = FFMPEG_AudioWriter(path, fps, ENCODE_NBYTES, clip.nchannels, codec=codec)
+    try:
+        for chunk in clip.iter_chunks(chunksize=ENCODE_CHUNK, quantize=True, nbytes=ENCODE_NBYTES,
+                                      fps=fps, logger=logger):
+            _write(writer, sinks, _apply(filters, chunk))
+        if final:
+            for i, f in enumerate(filters):
+                _write(writer, sinks, _apply(filters[i + 1:], f.flush()))
+    finally:
+        writer.close()
+
+
+def join(paths, path: str, fps: int, nchannels: int, logger=None):
+    """
+    Encode the PCM of several files written by encode(codec=LOSSLESS_CODEC) as
+    one MP3, exactly as if it had been encoded in one go. `logger`'s
+    bars_callback is called for every chunk, so it can abort the encode.
+    """
+    frame_bytes = ENCODE_NBYTES * nchannels
+    writer = FFMPEG_AudioWriter(path, fps, ENCODE_NBYTES, nchannels, codec=ENCODE_CODEC)
+    try:
+        index = 0
+        for source in paths:
+            proc = sp.Popen(
+                [FFMPEG_BINARY, "-loglevel", "error", "-i", source,
+                 "-f", f"s{8 * ENCODE_NBYTES}le", "-acodec", f"pcm_s{8 * ENCODE_NBYTES}le", "-"],
+                stdin=sp.DEVNULL, stdout=sp.PIPE, stderr=sp.PIPE,
+            )
+            try:
+                while data := proc.stdout.read(ENCODE_CHUNK * frame_bytes):
+                    writer.write_frames(np.frombuffer(data, dtype=f"<i{ENCODE_NBYTES}").reshape(-1, nchannels))
+                    index += 1
+                    if logger is not None:
+                        logger.bars_callback("chunk", "index", index)
+            finally:
+                proc.stdout.close()
+                err = proc.stderr.read()
+                proc.stderr.close()
+                if proc.wait() != 0:
+                    raise IOError(f"could not decode {source}: {err.decode(errors='replace').strip()}")
+    finally:
+        writer.close()
+
+
+def _apply(filters, chunk):
+    for f in filters:
+        chunk = f.process(chunk)
+    return chunk
+
+
+def _write(writer, sinks, chunk):
+    if not len(chunk):
+        return
+    for sink in sinks:
+        sink.feed(chunk)
+    writer.write_frames(chunk)
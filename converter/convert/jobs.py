@@ -0,0 +1,97 @@
+import datetime, os, time
+import logging
+from bson.objectid import ObjectId
+from proglog import ProgressBarLogger
+from convert import drain
+
+logger = logging.getLogger(__name__)
+
+# How often, in seconds, a running encode looks for a cancellation
+CANCEL_CHECK_INTERVAL = float(os.environ.get("CANCEL_CHECK_INTERVAL", "5"))
+
+# States that end a job here, giving back the owner's active job slot (see the gateway's limiter)
+FINISHED_STATES = ("done", "failed")
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Interrupted(Exception):
+    """The pod is shutting down and the grace period ran out"""
+
+
+def now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def update(jobs, message: dict, **fields) -> bool:
+    """
+    Record progress on the job document the gateway created for this upload.
+
+    Cancellation is terminal, so a cancelled job is never moved to another
+    state; False is returned instead so the caller can stop working on it.
+    """
+    job_id = message.get("job_id")
+    # Messages queued before jobs existed carry no job_id, there is nothing to update
+    if jobs is None or not job_id:
+        return True
+
+    fields["updated_at"] = now()
+    try:
+        res = jobs.update_one(
+            {"_id": ObjectId(job_id), "state": {"$ne": "cancelled"}},
+            {"$set": fields},
+        )
+        if res.matched_count == 0:
+            return not cancelled(jobs, message)
+        if fields.get("state") in FINISHED_STATES:
+            jobs.database.job_slots.update_one({"jobs": ObjectId(job_id)}, {"$pull": {"jobs": ObjectId(job_id)}})
+    except Exception as e:
+        logger.error("Could not update job %s: %s", job_id, e)
+    return True
+
+
+def attach(jobs, message: dict, **fields):
+    """Set fields on the job whatever its state, e.g. the MP3 of a job cancelled as it finished"""
+    job_id = message.get("job_id")
+    if jobs is None or not job_id:
+        return
+
+    fields["updated_at"] = now()
+    try:
+        jobs.update_one({"_id": ObjectId(job_id)}, {"$set": fields})
+    except Exception as e:
+        logger.error("Could not update job %s: %s", job_id, e)
+
+
+def cancelled(jobs, message: dict) -> bool:
+    job_id = message.get("job_id")
+    if jobs is None or not job_id:
+        return False
+
+    try:
+        return jobs.count_documents({"_id": ObjectId(job_id), "state": "cancelled"}, limit=1) > 0
+    except Exception as e:
+        logger.error("Could not check job %s: %s", job_id, e)
+        return False
+
+
+class CancelWatcher(ProgressBarLogger):
+    """moviepy progress logger that aborts the encode once the job is cancelled or the drain times out"""
+
+    def __init__(self, jobs, message: dict, interval: float = CANCEL_CHECK_INTERVAL):
+        super().__init__()
+        self.jobs = jobs
+        self.message = message
+        self.interval = interval
+        self.next_check = time.monotonic() + interval
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        if drain.expired():
+            raise Interrupted(self.message.get("job_id"))
+        if time.monotonic() < self.next_check:
+            return
+        self.next_check = time.monotonic() + self.interval
+        if cancelled(self.jobs, self.message):
+            raise Cancelled(self.message.get("job_id"))
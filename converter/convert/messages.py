@@ -0,0 +1,101 @@
+"""
+Job messages exchanged over the `video` and `mp3` queues.
+
+Both queues carry the same versioned record: the gateway publishes it with
+`mp3_fid` unset, the converter fills it in and republishes it. Bodies are
+msgpack when MESSAGE_ENCODING asks for it and the library is installed, JSON
+otherwise, and are tagged with an AMQP content type. Decoding accepts either
+(sniffing the body when the content type is missing), so producers and
+consumers of different versions can be mixed during a rolling deploy:
+
+- v1 messages (plain JSON without "v", possibly "username" instead of
+  "user_email") are still accepted;
+- fields a consumer does not know are kept, so they survive the converter
+  republishing the message, while the known FIELDS are type checked;
+- a message from a newer schema version than this module's is rejected
+  rather than guessed at, so bump SCHEMA_VERSION only for changes older
+  consumers cannot read, and roll consumers out before producers;
+- msgpack is only understood by consumers running this module, so switch
+  MESSAGE_ENCODING to msgpack only once every consumer has been upgraded.
+
+This module is copied verbatim into each service; keep the copies in sync.
+"""
+import json, os
+
+try:
+    import msgpack
+except ImportError:  # JSON only
+    msgpack = None
+
+SCHEMA_VERSION = 2
+# Known fields and the types they may hold when set (None is always allowed)
+FIELDS = {
+    "job_id": str,
+    "video_fid": str,
+    "mp3_fid": str,
+    "user_email": str,
+    "trace_id": str,
+    "enqueued_at": (int, float),
+    "trim_silence": bool,
+}
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+
+# Encoding of published messages: "json" (readable by every consumer version) or "msgpack"
+MESSAGE_ENCODING = os.environ.get("MESSAGE_ENCODING", "json")
+
+
+class MessageError(ValueError):
+    pass
+
+
+def encode(message: dict, encoding: str = MESSAGE_ENCODING) -> tuple[bytes, str]:
+    """Returns (body, content_type)"""
+    record = {**message, "v": SCHEMA_VERSION}
+    if encoding == "msgpack" and msgpack is not None:
+        return msgpack.packb(record, use_bin_type=True), MSGPACK
+    return json.dumps(record, separators=(",", ":")).encode(), JSON
+
+
+def decode(body: bytes, content_type: str | None = None, require: tuple[str, ...] = ()) -> dict:
+    """Decode a message body once, normalising older schema versions"""
+    if not body:
+        raise MessageError("empty message")
+
+    if content_type is None:
+        # JSON objects start with "{" (or whitespace); msgpack maps never do
+        content_type = JSON if body.lstrip()[:1] == b"{" else MSGPACK
+
+    try:
+        if content_type == MSGPACK:
+            if msgpack is None:
+                raise MessageError("msgpack message received but msgpack is not installed")
+            message = msgpack.unpackb(body, raw=False)
+        else:
+            message = json.loads(body)
+    except MessageError:
+        raise
+    except Exception as e:
+        raise MessageError(f"undecodable {content_type} message: {e}") from e
+
+    if not isinstance(message, dict):
+        raise MessageError("message is not an object")
+
+    version = message.setdefault("v", 1)
+    if not isinstance(version, int) or isinstance(version, bool) or version < 1:
+        raise MessageError(f"invalid schema version {version!r}")
+    if version > SCHEMA_VERSION:
+        raise MessageError(f"unsupported schema version {version}, this consumer reads up to {SCHEMA_VERSION}")
+    if "user_email" not in message and "username" in message:
+        message["user_email"] = message["username"]
+
+    for field, types in FIELDS.items():
+        value = message.get(field)
+        if value is not None and not isinstance(value, types):
+            raise MessageError(f"field {field} has unexpected type {type(value).__name__}")
+
+    missing = [f for f in require if not message.get(f)]
+    if missing:
+        raise MessageError(f"missing required field(s): {', '.join(missing)}")
+    return message
@@ -0,0 +1,77 @@
+import os, threading, time
+import logging
+import pika
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9100"))
+# Seconds between queue depth polls; each poll is one passive queue.declare per queue
+METRICS_QUEUE_POLL = float(os.environ.get("METRICS_QUEUE_POLL", "15"))
+
+CONVERSION_SECONDS = Histogram(
+    "converter_conversion_duration_seconds", "Wall time from picking a job up to storing its MP3",
+    buckets=(1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600),
+)
+REALTIME_FACTOR = Histogram(
+    "converter_realtime_factor", "Seconds of audio produced per second of conversion",
+    buckets=(0.5, 1, 2, 5, 10, 20, 50, 100, 200),
+)
+JOBS = Counter("converter_jobs_total", "Jobs finished", ["outcome"])
+BYTES = Counter("converter_bytes_total", "Bytes read from and written to GridFS", ["direction"])
+CHECKPOINTS = Counter("converter_checkpoints_total", "Encoded segments checkpointed to GridFS")
+RESUMED_SEGMENTS = Counter("converter_resumed_segments_total", "Checkpointed segments reused instead of encoded again")
+SILENCE_REMOVED_SECONDS = Counter("converter_silence_removed_seconds_total", "Seconds of silence trimmed before encoding")
+QUEUE_WAIT = Histogram(
+    "converter_queue_wait_seconds", "Time a job spent queued before delivery (consumer lag)",
+    buckets=(0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600),
+)
+QUEUE_DEPTH = Gauge("converter_queue_messages", "Messages ready in the queue", ["queue"])
+QUEUE_CONSUMERS = Gauge("converter_queue_consumers", "Consumers attached to the queue", ["queue"])
+
+
+def observe_queue_wait(message: dict):
+    enqueued_at = message.get("enqueued_at")
+    if enqueued_at:
+        QUEUE_WAIT.observe(max(time.time() - enqueued_at, 0.0))
+
+
+class QueueMonitor:
+    """
+    Polls queue depth on a connection of its own.
+
+    pika's BlockingConnection is not thread safe, so the consuming connection
+    is never touched from here.
+    """
+
+    def __init__(self, host: str, queues: list[str], interval: float = METRICS_QUEUE_POLL):
+        self.host = host
+        self.queues = [q for q in queues if q]
+        self.interval = interval
+
+    def start(self):
+        threading.Thread(target=self._run, name="queue-monitor", daemon=True).start()
+        return self
+
+    def _run(self):
+        connection = None
+        while True:
+            try:
+                if connection is None or connection.is_closed:
+                    connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.host))
+                    channel = connection.channel()
+                for q in self.queues:
+                    frame = channel.queue_declare(queue=q, passive=True)
+                    QUEUE_DEPTH.labels(q).set(frame.method.message_count)
+                    QUEUE_CONSUMERS.labels(q).set(frame.method.consumer_count)
+                connection.sleep(self.interval)
+            except Exception as e:
+                logger.warning("Queue depth poll failed: %s", e)
+                connection = None
+                time.sleep(self.interval)
+
+
+def serve(host: str, queues: list[str], port: int = METRICS_PORT):
+    """Expose /metrics on its own port and start polling the given queues"""
+    start_http_server(port)
+    QueueMonitor(host, queues).start()
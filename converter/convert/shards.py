@@ -0,0 +1,150 @@
+"""
+GridFS storage spread over several buckets and/or MongoDB deployments.
+
+A store is configured as an ordered list of shards, e.g.
+
+    VIDEO_SHARDS="v0=default,v1=mongodb://mongo-2:27017/gateway_db?authSource=admin,v2=default#videos2"
+
+where `default` is the database the service already uses and `#bucket`
+picks a GridFS bucket other than "fs". With nothing configured, a store is
+the single default bucket, as before.
+
+Files are placed by consistent hashing of their ObjectId over the shard
+names. IDs are never altered, so they keep all of ObjectId's uniqueness and
+FIDs stay plain ObjectIds for jobs, messages and URLs. A read goes to the
+owner the ring names, which is where every file lives once the ring is
+settled, and only on a miss tries the first shard (files from before
+sharding) and then the rest. The existing database must therefore stay
+first and new shards are only ever appended.
+
+Adding a shard moves ownership of about 1/n of the ring to it; until
+`rebalance.py` in the converter has moved the affected files under their
+same ID, reads of them cost one extra lookup per shard tried.
+
+This module is copied verbatim into each service; keep the copies in sync.
+"""
+import bisect, hashlib, os
+from bson.objectid import ObjectId
+from gridfs import GridFS, NoFile
+from pymongo import MongoClient
+
+# Points per shard on the hash ring; more points spread files more evenly
+SHARD_VNODES = int(os.environ.get("SHARD_VNODES", "64"))
+
+
+def _hash(data: bytes) -> int:
+    return int.from_bytes(hashlib.md5(data).digest()[:8], "big")
+
+
+class Shard:
+    def __init__(self, index: int, name: str, db, bucket: str = "fs"):
+        self.index = index
+        self.name = name
+        self.db = db
+        self.bucket = bucket
+        self.fs = GridFS(db, collection=bucket)
+        self.files = db[f"{bucket}.files"]
+        self.chunks = db[f"{bucket}.chunks"]
+
+
+class Ring:
+    """Consistent hash ring over shard names"""
+
+    def __init__(self, shards: list[Shard], vnodes: int = SHARD_VNODES):
+        points = sorted(
+            (_hash(f"{shard.name}#{i}".encode()), shard.index)
+            for shard in shards for i in range(max(vnodes, 1))
+        )
+        self.hashes = [h for h, _ in points]
+        self.owners = [index for _, index in points]
+
+    def owner(self, key: bytes) -> int:
+        i = bisect.bisect(self.hashes, _hash(key)) % len(self.hashes)
+        return self.owners[i]
+
+
+class ShardedGridFS:
+    """The subset of the GridFS API the services use, routed by the hash ring"""
+
+    def __init__(self, shards: list[Shard], vnodes: int = SHARD_VNODES):
+        if not shards:
+            raise ValueError("at least one shard is required")
+        self.shards = shards
+        self.ring = Ring(shards, vnodes)
+
+    @classmethod
+    def from_env(cls, var: str, default_db) -> "ShardedGridFS":
+        spec = os.environ.get(var, "").strip()
+        if not spec:
+            return cls([Shard(0, "default", default_db)])
+
+        clients: dict[str, MongoClient] = {}
+        shards = []
+        for index, entry in enumerate(p.strip() for p in spec.split(",") if p.strip()):
+            name, _, location = entry.partition("=")
+            location, _, bucket = location.strip().partition("#")
+            if location == "default":
+                db = default_db
+            else:
+                if location not in clients:
+                    clients[location] = MongoClient(location)
+                db = clients[location].get_default_database()
+            shards.append(Shard(index, name.strip(), db, bucket or "fs"))
+        return cls(shards)
+
+    # -----------------------------------------------------------------------------------------------
+    # Routing
+    # -----------------------------------------------------------------------------------------------
+    def owner(self, fid) -> Shard:
+        """The shard the ring assigns this ID to, where new files are written"""
+        return self.shards[self.ring.owner(ObjectId(fid).binary)]
+
+    def _candidates(self, fid) -> list[Shard]:
+        """Where a file may be: its owner, then pre-sharding, then anywhere a rebalance has yet to move it from"""
+        owner = self.owner(fid)
+        return [owner] + [shard for shard in self.shards if shard is not owner]
+
+    def locate(self, fid) -> Shard | None:
+        """The shard holding the file, or None if there is no such file"""
+        oid = ObjectId(fid)
+        for shard in self._candidates(oid):
+            if shard.files.count_documents({"_id": oid}, limit=1):
+                return shard
+        return None
+
+    # -----------------------------------------------------------------------------------------------
+    # GridFS
+    # -----------------------------------------------------------------------------------------------
+    def put(self, data, **kwargs) -> ObjectId:
+        fid = kwargs.pop("_id", None) or ObjectId()
+        return self.owner(fid).fs.put(data, _id=fid, **kwargs)
+
+    def get(self, fid):
+        oid = ObjectId(fid)
+        candidates = self._candidates(oid)
+        for shard in candidates[:-1]:
+            try:
+                return shard.fs.get(oid)
+            except NoFile:
+                continue
+        return candidates[-1].fs.get(oid)
+
+    def find_file(self, fid, projection=None) -> dict | None:
+        """The files document, e.g. to read metadata without opening the file"""
+        oid = ObjectId(fid)
+        for shard in self._candidates(oid):
+            doc = shard.files.find_one({"_id": oid}, projection)
+            if doc:
+                return doc
+        return None
+
+    def exists(self, fid) -> bool:
+        return self.locate(fid) is not None
+
+    def delete(self, fid):
+        oid = ObjectId(fid)
+        # An interrupted rebalance may have left the file on two shards; neither copy may survive
+        holders = [shard for shard in self._candidates(oid) if shard.files.count_documents({"_id": oid}, limit=1)]
+        # No files document anywhere, but a put() that failed half way may have left chunks on the owner
+        for shard in holders or [self.owner(oid)]:
+            shard.fs.delete(oid)
@@ -0,0 +1,183 @@
+import math, os
+import numpy as np
+from bson.binary import Binary
+
+# Trim every job, not only those uploaded with trim_silence
+TRIM_SILENCE = os.environ.get("TRIM_SILENCE", "false").lower() in ("1", "true", "yes")
+# Frames quieter than this RMS level (dB below full scale) count as silence
+SILENCE_THRESHOLD_DB = float(os.environ.get("SILENCE_THRESHOLD_DB", "-50"))
+# Internal silences shorter than this are left alone; leading and trailing silence always goes
+SILENCE_MIN_SECONDS = float(os.environ.get("SILENCE_MIN_SECONDS", "2"))
+# Silence kept where a cut is made, split between both sides of it
+SILENCE_KEEP_SECONDS = float(os.environ.get("SILENCE_KEEP_SECONDS", "0.5"))
+SILENCE_FRAME_MS = float(os.environ.get("SILENCE_FRAME_MS", "20"))
+
+FULL_SCALE = 32768.0
+
+
+class SilenceTrimmer:
+    """
+    Encode filter that removes leading, trailing and long internal silence.
+
+    PCM is cut into short frames whose RMS level is computed a whole chunk at a
+    time; runs of quiet frames are then kept, or cut down to SILENCE_KEEP_SECONDS,
+    as their length becomes known. Only the first SILENCE_MIN_SECONDS of a quiet
+    run and the pad to keep after a cut are ever held back, so memory stays
+    bounded however long the silence is. `removed` lists the dropped ranges as
+    [start, end] seconds of the source audio.
+    """
+
+    def __init__(self, fps: int, threshold_db: float = SILENCE_THRESHOLD_DB,
+                 min_seconds: float = SILENCE_MIN_SECONDS, keep_seconds: float = SILENCE_KEEP_SECONDS,
+                 frame_ms: float = SILENCE_FRAME_MS):
+        self.fps = fps
+        self.frame = max(int(fps * frame_ms / 1000), 1)
+        self.threshold = FULL_SCALE * 10 ** (threshold_db / 20)
+        self.min_frames = max(math.ceil(min_seconds * fps / self.frame), 1)
+        self.pad_frames = min(int(keep_seconds / 2 * fps / self.frame), self.min_frames)
+        self.removed: list[list[float]] = []
+
+        self.carry = None  # samples short of a whole frame, waiting for the next chunk
+        self.position = 0  # source samples consumed
+        self.started = False  # whether anything above the threshold has been seen
+        self.run_start = None  # first sample of the current quiet run
+
+    @property
+    def removed_seconds(self) -> float:
+        return round(sum(end - start for start, end in self.removed), 3)
+
+    def process(self, chunk: np.ndarray) -> np.ndarray:
+        chunk = chunk.reshape(len(chunk), -1)
+        if self.carry is not None:
+            chunk = np.concatenate((self.carry, chunk))
+        whole = len(chunk) // self.frame * self.frame
+        self.carry = chunk[whole:]
+        frames = chunk[:whole].reshape(-1, self.frame, chunk.shape[1])
+
+        out = []
+        if len(frames):
+            level = np.sqrt((frames.astype(np.float64) ** 2).mean(axis=(1, 2)))
+            silent = level < self.threshold
+            # Handle runs of equal frames at once rather than frame by frame
+            edges = np.flatnonzero(np.diff(silent)) + 1
+            for start, end in zip(np.concatenate(([0], edges)), np.concatenate((edges, [len(frames)]))):
+                if silent[start]:
+                    out.append(self._silence(frames[start:end]))
+                else:
+                    out.append(self._end_run(trailing=False))
+                    out.append(frames[start:end])
+                    self.started = True
+                    self.position += int(end - start) * self.frame
+        return self._join(out, chunk.shape[1])
+
+    def flush(self) -> np.ndarray:
+        """The audio still held back once the stream has ended"""
+        channels = self.carry.shape[1] if self.carry is not None else 1
+        out = []
+        if self.carry is not None and len(self.carry):
+            if self.run_start is None:
+                out.append(self.carry)
+            # a partial frame inside trailing silence goes with it
+            self.position += len(self.carry)
+            self.carry = None
+        out.append(self._end_run(trailing=True))
+        return self._join(out, channels)
+
+    def state(self) -> dict:
+        """
+        Everything needed to carry on after a restart, including the audio held
+        back, so a segmented encode trims exactly as a single pass would.
+        """
+        run = None
+        if self.run_start is not None:
+            run = {
+                "start": self.run_start,
+                "frames": self.run_frames,
+                "long": self.long,
+                "head": None if self.long else _pack(np.concatenate(self.head)),
+                "head_kept": self.head_kept if self.long else None,
+                "tail": _pack(self.tail),
+            }
+        return {
+            "position": self.position,
+            "started": self.started,
+            "removed": self.removed,
+            "carry": None if self.carry is None else _pack(self.carry),
+            "run": run,
+        }
+
+    def restore(self, state: dict):
+        self.position = state["position"]
+        self.started = state["started"]
+        self.removed = [list(r) for r in state["removed"]]
+        self.carry = None if state["carry"] is None else _unpack(state["carry"])
+        run = state["run"]
+        self.run_start = None if run is None else run["start"]
+        if run is not None:
+            self.run_frames, self.long, self.tail = run["frames"], run["long"], _unpack(run["tail"])
+            self.head = None if run["long"] else [_unpack(run["head"])]
+            self.head_kept = run["head_kept"]
+
+    def _silence(self, frames: np.ndarray) -> np.ndarray | None:
+        if self.run_start is None:
+            self.run_start, self.run_frames, self.head, self.long = self.position, 0, [], False
+            self.tail = frames[:0]
+        self.position += len(frames) * self.frame
+        self.run_frames += len(frames)
+
+        out = None
+        if not self.long:
+            self.head.append(frames)
+            # Leading silence is removed whatever its length
+            if self.run_frames <= (self.min_frames if self.started else 0):
+                return None
+            # Long enough to cut: release the pad before the cut, the rest becomes the tail
+            self.long = True
+            frames, self.head = np.concatenate(self.head), None
+            self.head_kept = min(self.pad_frames if self.started else 0, len(frames))
+            out, frames = frames[:self.head_kept], frames[self.head_kept:]
+
+        # Only the last pad's worth is kept for after the cut
+        self.tail = np.concatenate((self.tail, frames))[-self.pad_frames:] if self.pad_frames else frames[:0]
+        return out
+
+    def _end_run(self, trailing: bool) -> np.ndarray | None:
+        if self.run_start is None:
+            return None
+        run_start, self.run_start = self.run_start, None
+
+        if not self.long:
+            head = np.concatenate(self.head)
+            if not trailing:
+                # a short pause inside the audio is kept as it is
+                return head
+            keep = min(self.pad_frames, len(head))
+            self._remove(run_start + keep * self.frame, self.position)
+            return head[:keep]
+
+        cut_start = run_start + self.head_kept * self.frame
+        if trailing and self.started:
+            self._remove(cut_start, self.position)
+            return None
+        # After a cut (or if the whole clip is silent) the tail pad is kept
+        self._remove(cut_start, self.position - len(self.tail) * self.frame)
+        return self.tail
+
+    def _remove(self, start: int, end: int):
+        if end > start:
+            self.removed.append([round(start / self.fps, 3), round(end / self.fps, 3)])
+
+    @staticmethod
+    def _join(parts: list, channels: int) -> np.ndarray:
+        parts = [p.reshape(-1, channels) for p in parts if p is not None and len(p)]
+        if not parts:
+            return np.zeros((0, channels), dtype=np.int16)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+def _pack(pcm: np.ndarray) -> dict:
+    return {"shape": list(pcm.shape), "pcm": Binary(pcm.astype(np.int16).tobytes())}
+
+
+def _unpack(packed: dict) -> np.ndarray:
+    return np.frombuffer(packed["pcm"], dtype=np.int16).reshape(packed["shape"]).copy()
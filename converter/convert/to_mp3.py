@@ -1,47 +1,198 @@
-import pika, json, tempfile, os
+import pika, tempfile, os, time
+import logging
 from pika import spec, DeliveryMode
 from bson.objectid import ObjectId
+from gridfs import NoFile
 from moviepy import VideoFileClip
+from convert import jobs as job_status
+from convert import tracing, metrics, messages
+from convert import encoder, waveform, silence, checkpoint
 
+logger = logging.getLogger(__name__)
 
-def start(message, fs_videos, fs_mp3s, channel):
-    message = json.loads(message)
+
+def start(message, fs_videos, fs_mp3s, channel, jobs=None, properties=None):
+    try:
+        message = messages.decode(message, properties.content_type if properties else None, require=("video_fid",))
+    except messages.MessageError as e:
+        # Redelivering an undecodable message would only fail again
+        logger.error("Dropping message: %s", e)
+        return None
+
+    started = time.monotonic()
+    trace_id = tracing.trace_id(message, properties)
+    tracing.record_queued(trace_id, message, queue=os.environ.get("VIDEO_QUEUE"))
+    metrics.observe_queue_wait(message)
+
+    # A cancelled job is acked without fetching anything
+    if not job_status.update(jobs, message, state="processing", started_at=job_status.now()):
+        logger.info("Job %s was cancelled, skipping", message.get("job_id"))
+        metrics.JOBS.labels("cancelled").inc()
+        return None
 
     # empty temp file
     tf = tempfile.NamedTemporaryFile()
-    # video contents
-    out = fs_videos.get(ObjectId(message["video_fid"]))
-    # add video contents to empty file
-    tf.write(out.read())
-    # create audio from temp video file
-    audio = VideoFileClip(tf.name).audio
-    tf.close()
-
-    if audio is None:
-        return "no audio stream found in the video"
-
-    # write audio to the file
+    try:
+        with tracing.span(trace_id, "fetch") as span:
+            # video contents
+            out = fs_videos.get(ObjectId(message["video_fid"]))
+            # add video contents to empty file
+            tf.write(out.read())
+            # ffmpeg reads the file by name, so nothing may be left in our buffer
+            tf.flush()
+            span["bytes"] = out.length
+            metrics.BYTES.labels("in").inc(out.length)
+    except NoFile:
+        # Redelivering cannot bring the video back
+        tf.close()
+        return fail(jobs, message, "source video not found", requeue=False)
+    except Exception as e:
+        tf.close()
+        return fail(jobs, message, f"could not fetch the video, err = {e}")
+
     tf_path = tempfile.gettempdir() + f"/{message['video_fid']}.mp3"
-    audio.write_audiofile(tf_path)
+    segmented = False
+    try:
+        with tracing.span(trace_id, "encode") as span:
+            # create audio from temp video file
+            try:
+                audio = VideoFileClip(tf.name).audio
+            except Exception as e:
+                # ffmpeg could not read it, and will not on a redelivery either
+                return fail(jobs, message, f"could not read the video, err = {e}", requeue=False)
+            finally:
+                tf.close()
+
+            if audio is None:
+                return fail(jobs, message, "no audio stream found in the video", requeue=False)
+
+            # write audio to the file, checking for cancellation as the encode progresses
+            # and building the waveform envelope from the same PCM chunks
+            # (the envelope and trimmer count samples, so they run at the rate the encoder decodes at)
+            fps = encoder.sample_rate(audio)
+            envelope = waveform.Envelope(audio.duration, fps)
+            trimmer = None
+            if message.get("trim_silence") or silence.TRIM_SILENCE:
+                # drop silent stretches before they reach the encoder
+                trimmer = silence.SilenceTrimmer(fps)
+            watcher = job_status.CancelWatcher(jobs, message)
+            # long audio is encoded in checkpointed segments so a redelivery can resume it
+            segmented = checkpoint.wanted(jobs, message, audio.duration)
+            if segmented:
+                checkpoint.encode(audio, tf_path, fs_mp3s, jobs, message, watcher, envelope, trimmer)
+            else:
+                encoder.encode(audio, tf_path, logger=watcher, sinks=[envelope], filters=[trimmer] if trimmer else [])
+            span["audio_seconds"] = audio.duration
+            if trimmer:
+                span["silence_removed_seconds"] = trimmer.removed_seconds
+    except job_status.Cancelled:
+        logger.info("Job %s was cancelled during encoding", message.get("job_id"))
+        discard(tf_path, fs_mp3s, jobs, message, segmented)
+        metrics.JOBS.labels("cancelled").inc()
+        return None
+    except job_status.Interrupted:
+        # Shutting down: leave the checkpoint for whichever converter gets the message next
+        logger.warning("Job %s interrupted by shutdown, returning it to the queue", message.get("job_id"))
+        if os.path.exists(tf_path):
+            os.remove(tf_path)
+        job_status.update(jobs, message, state="queued")
+        metrics.JOBS.labels("interrupted").inc()
+        return "interrupted by shutdown"
+    except Exception as e:
+        discard(tf_path, fs_mp3s, jobs, message, segmented)
+        return fail(jobs, message, f"could not encode the audio, err = {e}")
 
     # save file to mongo
-    f = open(tf_path, "rb")
-    data = f.read()
-    fid = fs_mp3s.put(data)
-    f.close()
-    os.remove(tf_path)
+    try:
+        with tracing.span(trace_id, "store") as span:
+            with open(tf_path, "rb") as f:
+                data = f.read()
+            metadata = {"waveform": envelope.result()}
+            if message.get("job_id"):
+                # Lets the sweeper tie the file to its job
+                metadata["job_id"] = message["job_id"]
+            if trimmer:
+                metadata["silence_removed"] = trimmer.removed
+                metadata["silence_removed_seconds"] = trimmer.removed_seconds
+            fid = fs_mp3s.put(data, metadata=metadata)
+            os.remove(tf_path)
+            span["bytes"] = len(data)
+    except Exception as e:
+        discard(tf_path, fs_mp3s, jobs, message, segmented)
+        return fail(jobs, message, f"could not store the MP3, err = {e}")
+    metrics.BYTES.labels("out").inc(len(data))
+    if trimmer:
+        metrics.SILENCE_REMOVED_SECONDS.inc(trimmer.removed_seconds)
 
     message["mp3_fid"] = str(fid)
+    convert_seconds = time.monotonic() - started
+
+    if job_status.cancelled(jobs, message):
+        logger.info("Job %s was cancelled before it was stored", message.get("job_id"))
+        fs_mp3s.delete(fid)
+        discard(tf_path, fs_mp3s, jobs, message, segmented)
+        metrics.JOBS.labels("cancelled").inc()
+        return None
 
+    # Publish before the job is marked done: clients and the sweeper act on a done job,
+    # which must not happen while this message can still be requeued
     try:
-        channel.basic_publish(
-            exchange="",
-            routing_key=os.environ.get("MP3_QUEUE"),
-            body=json.dumps(message),
-            properties=pika.BasicProperties(
-                delivery_mode=DeliveryMode(spec.PERSISTENT_DELIVERY_MODE)
-            ),
-        )
+        with tracing.span(trace_id, "publish"):
+            message["trace_id"] = trace_id
+            headers = tracing.stamp(message)
+            body, content_type = messages.encode(message)
+            channel.basic_publish(
+                exchange="",
+                routing_key=os.environ.get("MP3_QUEUE"),
+                body=body,
+                properties=pika.BasicProperties(
+                    delivery_mode=DeliveryMode(spec.PERSISTENT_DELIVERY_MODE),
+                    content_type=content_type,
+                    correlation_id=trace_id,
+                    headers=headers,
+                ),
+            )
     except Exception as err:
         fs_mp3s.delete(fid)
-        return f"failed to publish message, err = {err}"
+        return fail(jobs, message, f"failed to publish message, err = {err}")
+
+    done = job_status.update(
+        jobs, message,
+        state="done",
+        mp3_fid=fid,
+        mp3_size=len(data),
+        duration=envelope.seconds,
+        silence_removed_seconds=trimmer.removed_seconds if trimmer else None,
+        convert_seconds=round(convert_seconds, 3),
+        finished_at=job_status.now(),
+    )
+    if segmented:
+        checkpoint.discard(fs_mp3s, jobs, message)
+    if not done:
+        # Cancelled between the check above and now. The notification is already on its way
+        # and links to the MP3, so the file is kept, and recorded on the job for the sweeper
+        logger.info("Job %s was cancelled as it finished", message.get("job_id"))
+        job_status.attach(jobs, message, mp3_fid=fid)
+        metrics.JOBS.labels("cancelled").inc()
+        return None
+
+    metrics.JOBS.labels("done").inc()
+    metrics.CONVERSION_SECONDS.observe(convert_seconds)
+    if audio.duration and convert_seconds > 0:
+        metrics.REALTIME_FACTOR.observe(audio.duration / convert_seconds)
+
+
+def fail(jobs, message: dict, error: str, requeue: bool = True):
+    """Mark the job failed; returns the error for a nack, or None to ack a message that can never succeed"""
+    logger.error("Job %s failed: %s", message.get("job_id"), error)
+    job_status.update(jobs, message, state="failed", mp3_fid=None, error=error)
+    metrics.JOBS.labels("failed").inc()
+    return error if requeue else None
+
+
+def discard(tf_path: str, fs_mp3s, jobs, message: dict, segmented: bool):
+    """Remove the local MP3 and any checkpointed segments of an encode that will not be stored"""
+    if os.path.exists(tf_path):
+        os.remove(tf_path)
+    if segmented:
+        checkpoint.discard(fs_mp3s, jobs, message)
@@ -0,0 +1,82 @@
+import os
+import numpy as np
+from bson.binary import Binary
+
+# Points in a stored envelope; at one byte per point per series this is ~2 KB
+WAVEFORM_BINS = int(os.environ.get("WAVEFORM_BINS", "1000"))
+
+FULL_SCALE = 32768.0
+
+
+class Envelope:
+    """
+    Downsampled peak and RMS envelope, accumulated from int16 PCM chunks.
+
+    The clip is split into `bins` equal runs of samples; for each run the
+    loudest sample (across channels) and the RMS level are kept and finally
+    quantised to one byte of full scale each.
+    """
+
+    def __init__(self, duration: float, fps: int, bins: int = WAVEFORM_BINS):
+        total = max(int(duration * fps), 1)
+        self.bins = max(min(bins, total), 1)
+        self.samples_per_bin = -(-total // self.bins)
+        self.fps = fps
+        self.offset = 0
+        self.peaks = np.zeros(self.bins, dtype=np.int32)
+        self.sum_squares = np.zeros(self.bins, dtype=np.float64)
+        self.counts = np.zeros(self.bins, dtype=np.int64)
+
+    def feed(self, chunk: np.ndarray):
+        n = len(chunk)
+        if n == 0:
+            return
+        samples = chunk.astype(np.int32).reshape(n, -1)
+        peak = np.abs(samples).max(axis=1)
+        power = (samples.astype(np.float64) ** 2).mean(axis=1)
+
+        # Bin of every sample; chunks are contiguous, so runs of equal bins are reduced at once
+        idx = np.minimum((self.offset + np.arange(n)) // self.samples_per_bin, self.bins - 1)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(idx)) + 1))
+        bins = idx[starts]
+        np.maximum.at(self.peaks, bins, np.maximum.reduceat(peak, starts))
+        np.add.at(self.sum_squares, bins, np.add.reduceat(power, starts))
+        np.add.at(self.counts, bins, np.diff(np.append(starts, n)))
+        self.offset += n
+
+    def state(self) -> dict:
+        """Everything needed to carry on feeding after a restart"""
+        return {
+            "offset": self.offset,
+            "peaks": Binary(self.peaks.tobytes()),
+            "sum_squares": Binary(self.sum_squares.tobytes()),
+            "counts": Binary(self.counts.tobytes()),
+        }
+
+    def restore(self, state: dict):
+        self.offset = state["offset"]
+        self.peaks = np.frombuffer(state["peaks"], dtype=np.int32).copy()
+        self.sum_squares = np.frombuffer(state["sum_squares"], dtype=np.float64).copy()
+        self.counts = np.frombuffer(state["counts"], dtype=np.int64).copy()
+
+    @property
+    def seconds(self) -> float:
+        """Length of the audio fed so far"""
+        return self.offset / self.fps
+
+    def result(self) -> dict:
+        # Trimming may leave less audio than the clip's duration; unused bins are dropped
+        used = min(max(-(-self.offset // self.samples_per_bin), 1), self.bins)
+        rms = np.sqrt(self.sum_squares[:used] / np.maximum(self.counts[:used], 1))
+        return {
+            "bins": used,
+            "duration": round(self.seconds, 3),
+            "samples_per_bin": self.samples_per_bin,
+            "sample_rate": self.fps,
+            "peaks": Binary(_quantise(self.peaks[:used]).tobytes()),
+            "rms": Binary(_quantise(rms).tobytes()),
+        }
+
+
+def _quantise(levels: np.ndarray) -> np.ndarray:
+    return np.clip(np.rint(levels / FULL_SCALE * 255), 0, 255).astype(np.uint8)
@@ -0,0 +1,160 @@
+"""
+Moves GridFS files to the shard the hash ring assigns them to.
+
+Run after appending a shard to VIDEO_SHARDS / MP3_SHARDS (and rolling out the
+services with the new list, so new files already land on it). Only the files
+whose owner changed are moved, about 1/n of them for the nth shard. Each one
+is copied to its owner under the same ID and the old copy is deleted, so jobs,
+messages and links already handed out need no update, and reads find the file
+on either shard while the move is under way. The copy records the shard it
+came from (metadata.moved_from), so a copy left by an interrupted run is only
+trusted if it really is the same file. Files of running jobs and checkpointed
+segments are left for a later run. Work is done in small batches with a pause in between, like the sweeper.
+
+    python3 rebalance.py --dry-run   # report what would move
+    python3 rebalance.py
+    python3 rebalance.py --store mp3
+"""
+import argparse, datetime, json, os, sys, time
+from gridfs import NoFile
+from pymongo import ASCENDING, MongoClient
+from convert import shards
+
+BATCH_SIZE = int(os.environ.get("REBALANCE_BATCH_SIZE", "50"))
+BATCH_PAUSE = float(os.environ.get("REBALANCE_BATCH_PAUSE", "0.5"))
+
+ACTIVE_STATES = ["queued", "processing"]
+
+
+def now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class Rebalancer:
+
+    def __init__(self, db_videos, db_mp3, dry_run=False, batch_size=BATCH_SIZE, pause=BATCH_PAUSE):
+        self.stores = {
+            "videos": (shards.ShardedGridFS.from_env("VIDEO_SHARDS", db_videos), "video_fid"),
+            "mp3": (shards.ShardedGridFS.from_env("MP3_SHARDS", db_mp3), "mp3_fid"),
+        }
+        self.jobs = db_videos.jobs
+        self.dry_run = dry_run
+        self.batch_size = max(batch_size, 1)
+        self.pause = pause
+
+    def run(self, stores=("videos", "mp3")) -> dict:
+        report = {"dry_run": self.dry_run, "started_at": now().isoformat()}
+        for name in stores:
+            store, job_field = self.stores[name]
+            report[name] = {shard.name: self.rebalance_shard(store, shard, job_field) for shard in store.shards}
+        report["finished_at"] = now().isoformat()
+        return report
+
+    def rebalance_shard(self, store, shard, job_field: str) -> dict:
+        stats = {"files": 0, "moved": 0, "bytes": 0, "skipped": 0, "conflicts": [], "to": {}}
+        query: dict = {}
+
+        while True:
+            batch = list(
+                shard.files.find(query, {"_id": 1, "length": 1, "metadata.segment": 1})
+                .sort("_id", ASCENDING).limit(self.batch_size)
+            )
+            if not batch:
+                break
+            query["_id"] = {"$gt": batch[-1]["_id"]}
+
+            for doc in batch:
+                stats["files"] += 1
+                owner = store.owner(doc["_id"])
+                if owner.index == shard.index:
+                    continue
+                if self.busy(doc, job_field):
+                    stats["skipped"] += 1
+                    continue
+
+                if not self.dry_run and not self.move(shard, owner, doc["_id"]):
+                    # The owner already holds a different file under this ID; reported, left alone
+                    stats["conflicts"].append(str(doc["_id"]))
+                    continue
+                stats["moved"] += 1
+                stats["bytes"] += doc.get("length", 0)
+                stats["to"][owner.name] = stats["to"].get(owner.name, 0) + 1
+            self.throttle()
+
+        return stats
+
+    def busy(self, doc: dict, job_field: str) -> bool:
+        """Files a converter may be reading or about to reuse right now"""
+        if (doc.get("metadata") or {}).get("segment") is not None:
+            return True
+        return self.jobs.count_documents(
+            {job_field: doc["_id"], "state": {"$in": ACTIVE_STATES}}, limit=1
+        ) > 0
+
+    def move(self, source, owner, fid) -> bool:
+        """Returns False, leaving the original in place, if the owner holds another file under this ID"""
+        try:
+            out = source.fs.get(fid)
+        except NoFile:
+            # Deleted since the batch was listed
+            return True
+        # A previous run may have copied the file and stopped before deleting the original
+        existing = owner.files.find_one({"_id": fid}, {"length": 1, "metadata.moved_from": 1})
+        if existing is not None:
+            if not self.same_file(out, source, owner, existing):
+                return False
+        else:
+            # Chunks of a put() that failed half way would collide with the new ones
+            owner.chunks.delete_many({"files_id": fid})
+            metadata = {**(out.metadata or {}), "moved_from": source.name}
+            extra = {"filename": out.filename} if out.filename is not None else {}
+            owner.fs.put(out, _id=fid, chunkSize=out.chunk_size, metadata=metadata, **extra)
+            # Keep the original upload time, the sweeper's retention is based on it
+            owner.files.update_one({"_id": fid}, {"$set": {"uploadDate": out.upload_date}})
+
+        source.fs.delete(fid)
+        return True
+
+    @staticmethod
+    def same_file(out, source, owner, existing: dict) -> bool:
+        if existing.get("length") != out.length:
+            return False
+        if (existing.get("metadata") or {}).get("moved_from") == source.name:
+            return True
+        # No record of where it came from: compare the contents
+        copy = owner.fs.get(existing["_id"])
+        while True:
+            a, b = out.read(out.chunk_size), copy.read(out.chunk_size)
+            if a != b:
+                return False
+            if not a:
+                return True
+
+    def throttle(self):
+        if self.pause > 0:
+            time.sleep(self.pause)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move GridFS files to the shard the hash ring assigns them to")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be moved without moving it")
+    parser.add_argument("--store", choices=["videos", "mp3", "all"], default="all", help="which files to rebalance")
+    args = parser.parse_args()
+
+    client = MongoClient(
+        "host.minikube.internal",
+        27017,
+        username=os.environ.get("MONGO_USERNAME"),
+        password=os.environ.get("MONGO_PASSWORD")
+    )
+    rebalancer = Rebalancer(client.gateway_db, client.mp3, dry_run=args.dry_run)
+    stores = ("videos", "mp3") if args.store == "all" else (args.store,)
+    print(json.dumps(rebalancer.run(stores), indent=2))
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print(" [*] Interrupted")
+        sys.exit(0)
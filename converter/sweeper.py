@@ -0,0 +1,251 @@
+"""
+Garbage collector for GridFS.
+
+Deletes source videos once their job is finished or once they are older than
+the retention period, and removes orphaned fs.files / fs.chunks entries left
+behind by failed uploads in every video and mp3 shard (see convert/shards.py).
+Files are only ever treated as orphans when they name their job in
+metadata.job_id and that job does not refer to them. Work is done
+in small batches with a pause in between so the sweep never competes with the
+gateway and converters for Mongo's working set.
+
+    python3 sweeper.py --dry-run     # report what would be deleted
+    python3 sweeper.py               # sweep once
+    python3 sweeper.py --interval 3600
+"""
+import argparse, datetime, json, os, sys, time
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, MongoClient
+from convert import shards
+
+# Videos are deleted this long after upload whether or not they were converted
+RETENTION_HOURS = float(os.environ.get("SWEEP_VIDEO_RETENTION_HOURS", "72"))
+# Delete a source video as soon as its job is done or cancelled
+DELETE_CONVERTED = os.environ.get("SWEEP_DELETE_CONVERTED", "true").lower() == "true"
+# Files and chunks younger than this may belong to an upload still in flight
+ORPHAN_GRACE_HOURS = float(os.environ.get("SWEEP_ORPHAN_GRACE_HOURS", "6"))
+BATCH_SIZE = int(os.environ.get("SWEEP_BATCH_SIZE", "100"))
+BATCH_PAUSE = float(os.environ.get("SWEEP_BATCH_PAUSE", "0.5"))
+
+FINISHED_STATES = ["done", "cancelled"]
+
+
+def now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def field_values(doc: dict, path: str) -> list:
+    """The value(s) at a dotted path, e.g. "checkpoint.segments" -> the list of segment fids"""
+    value = doc
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return []
+        value = value.get(key)
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+class Sweeper:
+    def __init__(self, db_videos, db_mp3, dry_run=False, batch_size=BATCH_SIZE, pause=BATCH_PAUSE):
+        self.videos = shards.ShardedGridFS.from_env("VIDEO_SHARDS", db_videos)
+        self.mp3s = shards.ShardedGridFS.from_env("MP3_SHARDS", db_mp3)
+        self.jobs = db_videos.jobs
+        self.dry_run = dry_run
+        self.batch_size = max(batch_size, 1)
+        self.pause = pause
+
+    def ensure_indexes(self):
+        self.jobs.create_index([("state", ASCENDING), ("video_purged_at", ASCENDING)], name="state_video_purged")
+        self.jobs.create_index([("video_fid", ASCENDING)], name="video_fid")
+        self.jobs.create_index([("mp3_fid", ASCENDING)], name="mp3_fid")
+
+    def run(self) -> dict:
+        report = {
+            "dry_run": self.dry_run,
+            "started_at": now().isoformat(),
+            "converted_videos": self.sweep_converted_videos() if DELETE_CONVERTED else None,
+            "expired_videos": self.sweep_expired_videos(),
+            "orphaned_files": {
+                "videos": {s.name: self.sweep_orphaned_files(s, "video_fid") for s in self.videos.shards},
+                # checkpointed segments of an interrupted encode are not orphans either
+                "mp3": {s.name: self.sweep_orphaned_files(s, "mp3_fid", "checkpoint.segments") for s in self.mp3s.shards},
+            },
+            "orphaned_chunks": {
+                "videos": {s.name: self.sweep_orphaned_chunks(s) for s in self.videos.shards},
+                "mp3": {s.name: self.sweep_orphaned_chunks(s) for s in self.mp3s.shards},
+            },
+        }
+        report["finished_at"] = now().isoformat()
+        return report
+
+    # -----------------------------------------------------------------------------------------------
+    # Source videos
+    # -----------------------------------------------------------------------------------------------
+    def sweep_converted_videos(self) -> dict:
+        """Source videos whose job has finished are no longer needed"""
+        query = {"state": {"$in": FINISHED_STATES}, "video_purged_at": None}
+        stats = {"files": 0, "bytes": 0}
+
+        while True:
+            batch = list(self.jobs.find(query, {"video_fid": 1}).limit(self.batch_size))
+            if not batch:
+                break
+            # In a dry run nothing is marked, so page by _id instead of re-querying
+            if self.dry_run:
+                query["_id"] = {"$gt": batch[-1]["_id"]}
+            self.delete_videos([job["video_fid"] for job in batch], stats)
+            self.throttle()
+
+        return stats
+
+    def sweep_expired_videos(self) -> dict:
+        """Any source video past the retention period goes, converted or not"""
+        cutoff = now() - datetime.timedelta(hours=RETENTION_HOURS)
+        stats = {"files": 0, "bytes": 0}
+
+        for shard in self.videos.shards:
+            query: dict = {"uploadDate": {"$lt": cutoff}}
+            while True:
+                batch = list(shard.files.find(query, {"_id": 1}).sort("_id", ASCENDING).limit(self.batch_size))
+                if not batch:
+                    break
+                query["_id"] = {"$gt": batch[-1]["_id"]}
+                self.delete_videos([f["_id"] for f in batch], stats, shard)
+                self.throttle()
+
+        return stats
+
+    def delete_videos(self, fids: list, stats: dict, shard=None):
+        if shard:
+            self.delete_files(shard, fids, stats)
+        else:
+            # Every shard holding a copy, in case a rebalance was interrupted mid-move
+            for each in self.videos.shards:
+                self.delete_files(each, fids, stats)
+        if not self.dry_run:
+            self.jobs.update_many(
+                {"video_fid": {"$in": fids}},
+                {"$set": {"video_purged_at": now()}},
+            )
+
+    # -----------------------------------------------------------------------------------------------
+    # Orphans
+    # -----------------------------------------------------------------------------------------------
+    def sweep_orphaned_files(self, shard, *job_fields: str) -> dict:
+        """
+        Files their job does not refer to, e.g. an upload whose publish failed
+        and whose cleanup never ran. Only files stamped with the job they were
+        stored for (metadata.job_id) are considered: a file without one may
+        predate jobs or come from a producer that does not create them, and is
+        never deleted here.
+        """
+        stats = {"files": 0, "bytes": 0}
+        cutoff = ObjectId.from_datetime(now() - datetime.timedelta(hours=ORPHAN_GRACE_HOURS))
+        query: dict = {"_id": {"$lt": cutoff}, "metadata.job_id": {"$exists": True}}
+
+        while True:
+            batch = list(
+                shard.files.find(query, {"_id": 1, "metadata.job_id": 1}).sort("_id", ASCENDING).limit(self.batch_size)
+            )
+            if not batch:
+                break
+            query["_id"]["$gt"] = batch[-1]["_id"]
+
+            job_ids = {ObjectId(j) for j in (f["metadata"]["job_id"] for f in batch) if ObjectId.is_valid(j)}
+            referenced = set()
+            for job in self.jobs.find({"_id": {"$in": list(job_ids)}}, {field: 1 for field in job_fields}):
+                for field in job_fields:
+                    referenced.update(field_values(job, field))
+
+            orphans = [
+                f["_id"] for f in batch
+                if ObjectId.is_valid(f["metadata"]["job_id"]) and f["_id"] not in referenced
+            ]
+            if orphans:
+                self.delete_files(shard, orphans, stats)
+            self.throttle()
+
+        return stats
+
+    def sweep_orphaned_chunks(self, shard) -> dict:
+        """fs.chunks whose fs.files entry is gone, left by a put() that failed half way"""
+        # files_id is the ObjectId generated by put(), so its timestamp bounds the upload start
+        cutoff = ObjectId.from_datetime(now() - datetime.timedelta(hours=ORPHAN_GRACE_HOURS))
+        stats = {"files": 0, "chunks": 0}
+        # Every stored file has a first chunk, so paging over n=0 walks the (files_id, n) index once per file
+        query: dict = {"files_id": {"$lt": cutoff}, "n": 0}
+
+        while True:
+            ids = [
+                c["files_id"] for c in
+                shard.chunks.find(query, {"files_id": 1}).sort("files_id", ASCENDING).limit(self.batch_size)
+            ]
+            if not ids:
+                break
+            query["files_id"]["$gt"] = ids[-1]
+
+            groups = shard.chunks.aggregate([
+                {"$match": {"files_id": {"$gte": ids[0], "$lte": ids[-1]}}},
+                {"$group": {"_id": "$files_id", "chunks": {"$sum": 1}}},
+            ])
+            self.delete_chunk_groups(shard, list(groups), stats)
+            self.throttle()
+
+        return stats
+
+    def delete_chunk_groups(self, shard, groups: list, stats: dict):
+        ids = [g["_id"] for g in groups]
+        present = {f["_id"] for f in shard.files.find({"_id": {"$in": ids}}, {"_id": 1})}
+        orphans = [g for g in groups if g["_id"] not in present]
+        if not orphans:
+            return
+
+        stats["files"] += len(orphans)
+        stats["chunks"] += sum(g["chunks"] for g in orphans)
+        if not self.dry_run:
+            shard.chunks.delete_many({"files_id": {"$in": [g["_id"] for g in orphans]}})
+
+    # -----------------------------------------------------------------------------------------------
+    # Helpers
+    # -----------------------------------------------------------------------------------------------
+    def delete_files(self, shard, fids: list, stats: dict):
+        for f in shard.files.find({"_id": {"$in": fids}}, {"length": 1}):
+            stats["files"] += 1
+            stats["bytes"] += f.get("length", 0)
+            if not self.dry_run:
+                shard.fs.delete(f["_id"])
+
+    def throttle(self):
+        if self.pause > 0:
+            time.sleep(self.pause)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete converted source videos and orphaned GridFS files")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be deleted without deleting it")
+    parser.add_argument("--interval", type=float, default=0, help="keep sweeping every N seconds instead of once")
+    args = parser.parse_args()
+
+    client = MongoClient(
+        "host.minikube.internal",
+        27017,
+        username=os.environ.get("MONGO_USERNAME"),
+        password=os.environ.get("MONGO_PASSWORD")
+    )
+    sweeper = Sweeper(client.gateway_db, client.mp3, dry_run=args.dry_run)
+    sweeper.ensure_indexes()
+
+    while True:
+        print(json.dumps(sweeper.run(), indent=2))
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print(" [*] Interrupted")
+        sys.exit(0)
@@ -0,0 +1,113 @@
+"""Segmented encodes resumed from their checkpoint match a single-pass encode"""
+import hashlib
+import numpy as np
+import pytest
+from bson.objectid import ObjectId
+from gridfs import GridFS
+from moviepy.audio.AudioClip import AudioArrayClip
+from convert import checkpoint, encoder, silence, waveform, jobs as job_status
+
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("mongomock.gridfs")
+
+FPS = 22050
+SEGMENT_SECONDS = 2
+
+
+class Watcher:
+    """Progress logger that interrupts the encode after `limit` chunks, like a drain running out"""
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.chunks = 0
+
+    def __call__(self, **kwargs):
+        pass
+
+    def iter_bar(self, **kwargs):
+        (bar, values), = kwargs.items()
+        for value in values:
+            self.bars_callback(bar, "index", value)
+            yield value
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        self.chunks += 1
+        if self.limit is not None and self.chunks > self.limit:
+            raise job_status.Interrupted("test")
+
+
+@pytest.fixture
+def clip():
+    rng = np.random.default_rng(7)
+    # Quiet runs straddle the segment boundaries at 2s, 4s and 6s
+    spans = [(0.3, 0.0), (1.4, 0.3), (2.6, 0.0), (0.9, 0.3), (0.2, 0.0), (1.6, 0.3), (1.5, 0.0)]
+    pcm = np.concatenate([rng.standard_normal((int(s * FPS), 2)) * level + 1e-5 for s, level in spans])
+    return AudioArrayClip(np.clip(pcm, -1, 1), fps=FPS)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setattr(checkpoint, "CHECKPOINT_SEGMENT_SECONDS", SEGMENT_SECONDS)
+    mongomock.gridfs.enable_gridfs_integration()
+    db = mongomock.MongoClient().db
+    job_id = ObjectId()
+    db.jobs.insert_one({"_id": job_id, "state": "processing"})
+    return db, GridFS(db, "mp3"), {"job_id": str(job_id), "video_fid": str(ObjectId())}
+
+
+def digest(path):
+    with open(path, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def single_pass(clip, path):
+    envelope, trimmer = waveform.Envelope(clip.duration, FPS), silence.SilenceTrimmer(FPS)
+    encoder.encode(clip, path, sinks=[envelope], filters=[trimmer])
+    return envelope, trimmer
+
+
+def test_resumed_encode_matches_a_single_pass(clip, store, tmp_path):
+    db, fs, message = store
+    expected_envelope, expected_trimmer = single_pass(clip, str(tmp_path / "single.mp3"))
+
+    path = str(tmp_path / "segmented.mp3")
+    segments = []
+    # About 23 chunks make a segment, so each run stores one more before it is stopped
+    for limit in (30, 30, None):
+        envelope, trimmer = waveform.Envelope(clip.duration, FPS), silence.SilenceTrimmer(FPS)
+        try:
+            checkpoint.encode(clip, path, fs, db.jobs, message, Watcher(limit), envelope, trimmer)
+        except job_status.Interrupted:
+            segments.append(len(db.jobs.find_one()["checkpoint"]["segments"]))
+            continue
+        break
+
+    # Each run picked up where the last one stopped
+    assert segments == [1, 2]
+    assert digest(path) == digest(str(tmp_path / "single.mp3"))
+    assert trimmer.removed == expected_trimmer.removed
+    assert envelope.result() == expected_envelope.result()
+
+
+def test_checkpoint_of_another_rate_is_not_resumed(clip, store, tmp_path):
+    db, fs, message = store
+    envelope, trimmer = waveform.Envelope(clip.duration, FPS), silence.SilenceTrimmer(FPS)
+    with pytest.raises(job_status.Interrupted):
+        checkpoint.encode(clip, str(tmp_path / "a.mp3"), fs, db.jobs, message, Watcher(30), envelope, trimmer)
+    db.jobs.update_one({}, {"$set": {"checkpoint.fps": FPS * 2}})
+
+    envelope, trimmer = waveform.Envelope(clip.duration, FPS), silence.SilenceTrimmer(FPS)
+    checkpoint.encode(clip, str(tmp_path / "b.mp3"), fs, db.jobs, message, Watcher(), envelope, trimmer)
+    single_pass(clip, str(tmp_path / "single.mp3"))
+    assert digest(str(tmp_path / "b.mp3")) == digest(str(tmp_path / "single.mp3"))
+
+
+def test_discard_removes_segments(clip, store, tmp_path):
+    db, fs, message = store
+    envelope = waveform.Envelope(clip.duration, FPS)
+    done = checkpoint.encode(clip, str(tmp_path / "a.mp3"), fs, db.jobs, message, Watcher(), envelope)
+    assert len(done["segments"]) == len(checkpoint.spans(clip.duration, SEGMENT_SECONDS))
+
+    checkpoint.discard(fs, db.jobs, message)
+    assert db.mp3.files.count_documents({}) == 0
+    assert db.jobs.find_one()["checkpoint"] is None
@@ -0,0 +1,68 @@
+"""rebalance.py moves files to their owner under the same ID"""
+import pytest
+from bson.objectid import ObjectId
+from convert import shards
+import rebalance
+
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("mongomock.gridfs")
+
+
+@pytest.fixture
+def setup(monkeypatch):
+    mongomock.gridfs.enable_gridfs_integration()
+    monkeypatch.setenv("VIDEO_SHARDS", "a=default,b=default#b")
+    db = mongomock.MongoClient().db
+    first = shards.ShardedGridFS([shards.Shard(0, "a", db)])
+    rebalancer = rebalance.Rebalancer(db, mongomock.MongoClient().mp3, pause=0)
+    store, _ = rebalancer.stores["videos"]
+    # Written before "b" was added, so all of them sit on "a"
+    fids = [first.put(f"video {i}".encode(), metadata={"job_id": str(ObjectId())}) for i in range(30)]
+    moving = [fid for fid in fids if store.owner(fid).index == 1]
+    assert moving
+    return db, rebalancer, store, fids, moving
+
+
+def test_files_move_under_their_own_id(setup):
+    db, rebalancer, store, fids, moving = setup
+    db.jobs.insert_one({"video_fid": moving[0], "state": "done"})
+
+    report = rebalancer.run(("videos",))["videos"]
+    assert report["a"]["moved"] == len(moving)
+    assert report["a"]["conflicts"] == []
+    for i, fid in enumerate(fids):
+        assert store.locate(fid) is store.owner(fid)
+        assert store.get(fid).read() == f"video {i}".encode()
+    # Jobs keep pointing at the same FID
+    assert db.jobs.find_one()["video_fid"] == moving[0]
+
+
+def test_files_of_running_jobs_are_skipped(setup):
+    db, rebalancer, store, fids, moving = setup
+    db.jobs.insert_one({"video_fid": moving[0], "state": "processing"})
+    report = rebalancer.run(("videos",))["videos"]
+    assert report["a"]["skipped"] == 1
+    assert store.locate(moving[0]).index == 0
+
+
+def test_copy_left_by_an_interrupted_run_is_reused(setup):
+    db, rebalancer, store, fids, moving = setup
+    fid = moving[0]
+    a, b = store.shards
+    b.fs.put(a.fs.get(fid), _id=fid, metadata={"moved_from": "a"})
+
+    assert rebalancer.move(a, b, fid)
+    assert not a.files.count_documents({"_id": fid})
+    assert b.files.count_documents({"_id": fid}) == 1
+
+
+def test_a_different_file_under_the_same_id_is_a_conflict(setup):
+    db, rebalancer, store, fids, moving = setup
+    fid = moving[0]
+    a, b = store.shards
+    b.fs.put(b"x" * a.fs.get(fid).length, _id=fid)
+
+    report = rebalancer.run(("videos",))["videos"]
+    assert report["a"]["conflicts"] == [str(fid)]
+    # The original is kept
+    assert a.fs.get(fid).read().startswith(b"video")
@@ -0,0 +1,73 @@
+"""SilenceTrimmer, fed in chunks and carried across a checkpoint"""
+import numpy as np
+import pytest
+from convert import silence
+
+FPS = 8000
+# Fixed rather than the environment's defaults, which the expected ranges depend on
+PARAMS = {"threshold_db": -50, "min_seconds": 2, "keep_seconds": 0.5, "frame_ms": 20}
+
+
+def audio(*spans, channels=2, seed=1):
+    """Stereo int16 PCM from (seconds, loud) spans"""
+    rng = np.random.default_rng(seed)
+    parts = [
+        (rng.uniform(-1, 1, (int(seconds * FPS), channels)) * (8000 if loud else 1)).astype(np.int16)
+        for seconds, loud in spans
+    ]
+    return np.concatenate(parts)
+
+
+def trim(pcm, chunk=1000):
+    trimmer = silence.SilenceTrimmer(FPS, **PARAMS)
+    out = [trimmer.process(pcm[i:i + chunk]) for i in range(0, len(pcm), chunk)]
+    out.append(trimmer.flush())
+    return np.concatenate(out), trimmer
+
+
+def test_leading_trailing_and_long_silence_is_removed():
+    pcm = audio((1, False), (2, True), (4, False), (1, True), (3, False))
+    out, trimmer = trim(pcm)
+    # Half of keep_seconds, rounded down to whole 20ms frames, is kept next to the sound
+    assert trimmer.removed == [[0.0, 0.76], [3.24, 6.76], [8.24, 11.0]]
+    assert len(out) == len(pcm) - round(trimmer.removed_seconds * FPS)
+
+
+def test_short_pauses_are_kept():
+    pcm = audio((1, True), (1, False), (1, True))
+    out, trimmer = trim(pcm)
+    assert trimmer.removed == []
+    assert np.array_equal(out, pcm)
+
+
+def test_all_silent_clip():
+    pcm = audio((3, False))
+    out, trimmer = trim(pcm)
+    assert len(out) <= len(pcm)
+    assert trimmer.removed_seconds > 0
+
+
+@pytest.mark.parametrize("chunk", [1, 997, 2000, 50000])
+def test_output_does_not_depend_on_chunking(chunk):
+    pcm = audio((0.5, False), (1.5, True), (2.5, False), (1, True), (0.3, False), (1, True), (2, False))
+    expected, reference = trim(pcm, chunk=3000)
+    out, trimmer = trim(pcm, chunk=chunk)
+    assert np.array_equal(out, expected)
+    assert trimmer.removed == reference.removed
+
+
+@pytest.mark.parametrize("cut", [0.5, 1.2, 2.05, 3.0, 4.4])
+def test_state_carries_over_mid_stream(cut):
+    """A restart may fall anywhere, including inside a quiet run the trimmer is holding back"""
+    pcm = audio((0.5, False), (1.5, True), (2.5, False), (1, True), (0.3, False), (1, True), (2, False))
+    expected, reference = trim(pcm)
+
+    at = int(cut * FPS)
+    first = silence.SilenceTrimmer(FPS, **PARAMS)
+    head = first.process(pcm[:at])
+    resumed = silence.SilenceTrimmer(FPS, **PARAMS)
+    resumed.restore(first.state())
+    tail = np.concatenate((resumed.process(pcm[at:]), resumed.flush()))
+
+    assert np.array_equal(np.concatenate((head.reshape(-1, 2), tail)), expected)
+    assert resumed.removed == reference.removed
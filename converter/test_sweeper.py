@@ -0,0 +1,103 @@
+"""What the GridFS sweeper deletes, and what it leaves alone"""
+import datetime
+import pytest
+from bson.objectid import ObjectId
+import sweeper
+
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("mongomock.gridfs")
+
+
+def old_id(hours: float) -> ObjectId:
+    """An ID minted `hours` ago, with its own random bytes"""
+    stamp = ObjectId.from_datetime(sweeper.now() - datetime.timedelta(hours=hours)).binary[:4]
+    return ObjectId(stamp + ObjectId().binary[4:])
+
+
+@pytest.fixture
+def sweep(monkeypatch):
+    mongomock.gridfs.enable_gridfs_integration()
+    monkeypatch.delenv("VIDEO_SHARDS", raising=False)
+    monkeypatch.delenv("MP3_SHARDS", raising=False)
+    client = mongomock.MongoClient()
+    return sweeper.Sweeper(client.gateway_db, client.mp3, pause=0)
+
+
+def video(sweep, data=b"video", hours=0.0, job_id=None):
+    fid = old_id(hours)
+    sweep.videos.put(data, _id=fid, metadata={"job_id": str(job_id)} if job_id else None)
+    return fid
+
+
+def test_videos_of_finished_jobs_are_deleted(sweep):
+    done, running = video(sweep), video(sweep)
+    sweep.jobs.insert_many([{"state": "done", "video_fid": done}, {"state": "processing", "video_fid": running}])
+
+    assert sweep.sweep_converted_videos() == {"files": 1, "bytes": 5}
+    assert not sweep.videos.exists(done)
+    assert sweep.videos.exists(running)
+    assert sweep.jobs.find_one({"video_fid": done})["video_purged_at"]
+    # Marked jobs are not looked at again
+    assert sweep.sweep_converted_videos() == {"files": 0, "bytes": 0}
+
+
+def test_videos_past_retention_are_deleted(sweep):
+    old, new = video(sweep), video(sweep)
+    shard, = sweep.videos.shards
+    shard.files.update_one({"_id": old}, {"$set": {"uploadDate": sweeper.now() - datetime.timedelta(days=30)}})
+
+    assert sweep.sweep_expired_videos()["files"] == 1
+    assert not sweep.videos.exists(old)
+    assert sweep.videos.exists(new)
+
+
+def test_only_stamped_files_their_job_forgot_are_orphans(sweep):
+    job_id = ObjectId()
+    referenced = video(sweep, hours=12, job_id=job_id)
+    orphan = video(sweep, hours=12, job_id=job_id)
+    recent = video(sweep, hours=1, job_id=job_id)
+    unstamped = video(sweep, hours=12)
+    sweep.jobs.insert_one({"_id": job_id, "state": "processing", "video_fid": referenced})
+
+    shard, = sweep.videos.shards
+    assert sweep.sweep_orphaned_files(shard, "video_fid")["files"] == 1
+    assert not sweep.videos.exists(orphan)
+    for kept in (referenced, recent, unstamped):
+        assert sweep.videos.exists(kept)
+
+
+def test_checkpointed_segments_are_not_orphans(sweep):
+    job_id = ObjectId()
+    segment = old_id(12)
+    sweep.mp3s.put(b"segment", _id=segment, metadata={"job_id": str(job_id)})
+    sweep.jobs.insert_one({"_id": job_id, "state": "processing", "checkpoint": {"segments": [segment]}})
+
+    shard, = sweep.mp3s.shards
+    assert sweep.sweep_orphaned_files(shard, "mp3_fid", "checkpoint.segments")["files"] == 0
+    assert sweep.mp3s.exists(segment)
+
+
+def test_chunks_without_a_file_are_deleted(sweep):
+    shard, = sweep.videos.shards
+    kept = video(sweep, hours=12)
+    lost = old_id(12)
+    shard.chunks.insert_many([{"files_id": lost, "n": n, "data": b"x"} for n in range(3)])
+
+    assert sweep.sweep_orphaned_chunks(shard) == {"files": 1, "chunks": 3}
+    assert shard.chunks.count_documents({"files_id": lost}) == 0
+    assert shard.chunks.count_documents({"files_id": kept}) == 1
+
+
+def test_dry_run_deletes_nothing(sweep):
+    sweep.dry_run = True
+    done = video(sweep)
+    sweep.jobs.insert_one({"state": "done", "video_fid": done})
+    shard, = sweep.videos.shards
+    shard.chunks.insert_one({"files_id": old_id(12), "n": 0, "data": b"x"})
+
+    report = sweep.run()
+    assert report["converted_videos"]["files"] == 1
+    assert report["orphaned_chunks"]["videos"][shard.name]["chunks"] == 1
+    assert sweep.videos.exists(done)
+    assert "video_purged_at" not in sweep.jobs.find_one()
+    assert shard.chunks.count_documents({}) == 2
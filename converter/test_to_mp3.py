@@ -0,0 +1,121 @@
+"""Job state transitions of a conversion: cancellation, failures and the publish race"""
+import numpy as np
+import pytest
+from bson.objectid import ObjectId
+from gridfs import GridFS
+from moviepy import ColorClip
+from moviepy.audio.AudioClip import AudioArrayClip
+from convert import encoder, messages, to_mp3
+
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("mongomock.gridfs")
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("video") / "clip.mp4")
+    sound = AudioArrayClip(np.random.default_rng(3).uniform(-0.5, 0.5, (22050, 2)), fps=22050)
+    ColorClip((32, 32), (0, 0, 0), duration=1).with_audio(sound).write_videofile(
+        path, fps=5, audio_codec="aac", logger=None
+    )
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class Channel:
+    def __init__(self, on_publish=None):
+        self.published = []
+        self.on_publish = on_publish
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        if self.on_publish:
+            self.on_publish()
+        self.published.append(body)
+
+
+@pytest.fixture
+def job(video, monkeypatch):
+    monkeypatch.setenv("MP3_QUEUE", "mp3")
+    mongomock.gridfs.enable_gridfs_integration()
+    db = mongomock.MongoClient().db
+    fs_videos, fs_mp3s = GridFS(db, "videos"), GridFS(db, "mp3")
+    job_id = ObjectId()
+    video_fid = fs_videos.put(video)
+    db.jobs.insert_one({"_id": job_id, "state": "queued", "video_fid": video_fid})
+    body, _ = messages.encode({"job_id": str(job_id), "video_fid": str(video_fid), "user_email": "a@example.com"})
+    return db, fs_videos, fs_mp3s, body
+
+
+def test_a_converted_job_is_done(job):
+    db, fs_videos, fs_mp3s, body = job
+    job_id = db.jobs.find_one()["_id"]
+    db.job_slots.insert_one({"_id": "a@example.com", "jobs": [job_id]})
+    channel = Channel()
+    assert to_mp3.start(body, fs_videos, fs_mp3s, channel, db.jobs) is None
+    doc = db.jobs.find_one()
+    assert doc["state"] == "done"
+    assert fs_mp3s.exists(doc["mp3_fid"])
+    assert len(channel.published) == 1
+    # The owner's active job slot is given back
+    assert db.job_slots.find_one()["jobs"] == []
+
+
+def test_a_cancelled_job_is_skipped(job):
+    db, fs_videos, fs_mp3s, body = job
+    db.jobs.update_one({}, {"$set": {"state": "cancelled"}})
+    channel = Channel()
+    assert to_mp3.start(body, fs_videos, fs_mp3s, channel, db.jobs) is None
+    assert db.jobs.find_one()["state"] == "cancelled"
+    assert channel.published == []
+    assert db["mp3.files"].count_documents({}) == 0
+
+
+def test_cancelled_after_publishing_keeps_the_mp3(job):
+    db, fs_videos, fs_mp3s, body = job
+    # The user cancels while the notification is being published
+    channel = Channel(lambda: db.jobs.update_one({}, {"$set": {"state": "cancelled"}}))
+    assert to_mp3.start(body, fs_videos, fs_mp3s, channel, db.jobs) is None
+
+    doc = db.jobs.find_one()
+    assert doc["state"] == "cancelled"
+    # The published message links to the file, which the job still refers to
+    mp3_fid = messages.decode(channel.published[0])["mp3_fid"]
+    assert doc["mp3_fid"] == ObjectId(mp3_fid)
+    assert fs_mp3s.exists(ObjectId(mp3_fid))
+
+
+def test_encoder_failure_fails_the_job_and_requeues(job, monkeypatch):
+    db, fs_videos, fs_mp3s, body = job
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("ffmpeg died")
+    monkeypatch.setattr(encoder, "encode", broken)
+
+    assert "ffmpeg died" in to_mp3.start(body, fs_videos, fs_mp3s, Channel(), db.jobs)
+    assert db.jobs.find_one()["state"] == "failed"
+    assert db["mp3.files"].count_documents({}) == 0
+
+
+def test_store_failure_fails_the_job_and_requeues(job, monkeypatch):
+    db, fs_videos, fs_mp3s, body = job
+
+    def broken(*args, **kwargs):
+        raise IOError("mongo unavailable")
+    monkeypatch.setattr(fs_mp3s, "put", broken)
+
+    assert "mongo unavailable" in to_mp3.start(body, fs_videos, fs_mp3s, Channel(), db.jobs)
+    assert db.jobs.find_one()["state"] == "failed"
+
+
+def test_video_without_audio_is_not_requeued(job, tmp_path):
+    db, fs_videos, fs_mp3s, body = job
+    path = str(tmp_path / "silent.mp4")
+    ColorClip((32, 32), (0, 0, 0), duration=1).write_videofile(path, fps=5, audio=False, logger=None)
+    with open(path, "rb") as f:
+        video_fid = fs_videos.put(f.read())
+    body, _ = messages.encode({**messages.decode(body), "video_fid": str(video_fid)})
+
+    assert to_mp3.start(body, fs_videos, fs_mp3s, Channel(), db.jobs) is None
+    doc = db.jobs.find_one()
+    assert doc["state"] == "failed"
+    assert "no audio" in doc["error"]
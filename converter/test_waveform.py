@@ -0,0 +1,63 @@
+"""Envelope bucket maths (convert/waveform.py)"""
+import numpy as np
+import pytest
+from convert import waveform
+
+
+def reference(pcm: np.ndarray, samples_per_bin: int) -> tuple[list[int], list[int]]:
+    """Peak and RMS per bin, computed directly"""
+    peaks, rms = [], []
+    for start in range(0, len(pcm), samples_per_bin):
+        run = pcm[start:start + samples_per_bin].astype(np.float64)
+        peaks.append(np.abs(run).max())
+        rms.append(np.sqrt((run ** 2).mean(axis=1).mean()))
+    return list(waveform._quantise(np.array(peaks))), list(waveform._quantise(np.array(rms)))
+
+
+@pytest.fixture
+def pcm():
+    rng = np.random.default_rng(5)
+    return (rng.uniform(-1, 1, (10_007, 2)) * np.linspace(100, 30000, 10_007)[:, None]).astype(np.int16)
+
+
+@pytest.mark.parametrize("chunk", [1, 333, 1000, 20_000])
+def test_bins_match_a_direct_computation_for_any_chunking(pcm, chunk):
+    envelope = waveform.Envelope(len(pcm) / 1000, 1000, bins=50)
+    for i in range(0, len(pcm), chunk):
+        envelope.feed(pcm[i:i + chunk])
+
+    result = envelope.result()
+    peaks, rms = reference(pcm, envelope.samples_per_bin)
+    # 10007 samples over 50 bins round up to 201 per bin, so the last bin is short
+    assert envelope.samples_per_bin == 201
+    assert result["bins"] == len(peaks) == 50
+    assert list(result["peaks"]) == peaks
+    assert list(result["rms"]) == rms
+
+
+def test_short_clips_get_one_bin_per_sample():
+    envelope = waveform.Envelope(0.005, 1000, bins=50)
+    envelope.feed(np.array([[100, -200], [32767, 0], [0, 0], [-32768, 5], [1, 1]], dtype=np.int16))
+    result = envelope.result()
+    assert result["bins"] == 5 and envelope.samples_per_bin == 1
+    assert list(result["peaks"]) == [2, 255, 0, 255, 0]
+
+
+def test_trimmed_audio_drops_unused_bins(pcm):
+    envelope = waveform.Envelope(len(pcm) / 1000, 1000, bins=50)
+    envelope.feed(pcm[:1000])
+    result = envelope.result()
+    assert result["bins"] == 5
+    assert result["duration"] == 1.0
+
+
+def test_state_survives_a_restart(pcm):
+    whole = waveform.Envelope(len(pcm) / 1000, 1000, bins=50)
+    whole.feed(pcm)
+
+    first = waveform.Envelope(len(pcm) / 1000, 1000, bins=50)
+    first.feed(pcm[:4321])
+    resumed = waveform.Envelope(len(pcm) / 1000, 1000, bins=50)
+    resumed.restore(first.state())
+    resumed.feed(pcm[4321:])
+    assert resumed.result() == whole.result()
@@ -1,43 +1,68 @@
 import os, requests
 import logging
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-def login(req) -> tuple[str | None , tuple[str, int] | None]:
+def login(req) -> tuple[tuple[str, str | None] | None, tuple[str, int] | None]:
+    """Return (access_token, refresh_token)"""
     auth = req.authorization
     if not auth:
         logger.error("Missing authorization header")
         return None, ("Missing authorization header", 401)
 
-    basicauth = (auth.username, auth.password)
-    auth_service_url = f"http://{os.environ.get('AUTH_SVC_ADDR')}/login"
+    logger.debug("Username: %s", auth.username)
 
-    logger.info(f"Attempting to connect to auth service at: {auth_service_url}")
-    logger.info(f"Username: {auth.username}")
+    response, err = _post("/login", auth=(auth.username, auth.password))
+    if err:
+        return None, err
+
+    return (response.text, response.headers.get("X-Refresh-Token")), None
+
+def refresh(req) -> tuple[tuple[str, str | None] | None, tuple[str, int] | None]:
+    """Exchange the refresh token in the Authorization header for a new token pair"""
+    if "Authorization" not in req.headers:
+        return None, ("Missing authorization header", 401)
+
+    response, err = _post("/refresh", headers={"Authorization": req.headers["Authorization"]})
+    if err:
+        return None, err
+
+    return (response.text, response.headers.get("X-Refresh-Token")), None
+
+def revoke(req) -> tuple[str | None, tuple[str, int] | None]:
+    if "Authorization" not in req.headers:
+        return None, ("Missing authorization header", 401)
+
+    response, err = _post(
+        "/revoke",
+        headers={"Authorization": req.headers["Authorization"]},
+        json=req.get_json(silent=True),
+    )
+    if err:
+        return None, err
+
+    return response.text, None
+
+def _post(path: str, **kwargs) -> tuple[requests.Response | None, tuple[str, int] | None]:
+    auth_service_url = f"http://{os.environ.get('AUTH_SVC_ADDR')}{path}"
+    logger.debug("Attempting to connect to auth service at: %s", auth_service_url)
 
     try:
-        response = requests.post(
-            auth_service_url,
-            auth=basicauth,
-            timeout=10
-        )
+        response = requests.post(auth_service_url, timeout=10, **kwargs)
 
-        logger.info(f"Auth service response status: {response.status_code}")
-        logger.info(f"Auth service response text: {response.text}")
+        logger.debug("Auth service response status: %s", response.status_code)
 
         if response.status_code == 200:
-            return response.text, None
+            return response, None
         else:
             return None, (response.text, response.status_code)
 
     except requests.exceptions.ConnectionError as e:
-        logger.error(f"Connection error to auth service: {e}")
+        logger.error("Connection error to auth service: %s", e)
         return None, ("Auth service unavailable", 503)
     except requests.exceptions.Timeout as e:
-        logger.error(f"Timeout error to auth service: {e}")
+        logger.error("Timeout error to auth service: %s", e)
         return None, ("Auth service timeout", 504)
     except Exception as e:
-        logger.error(f"Unexpected error: {e}")
+        logger.error("Unexpected error: %s", e)
         return None, ("Internal server error", 500)
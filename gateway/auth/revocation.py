@@ -0,0 +1,109 @@
+import os, threading, time, logging
+import jwt, requests
+
+logger = logging.getLogger(__name__)
+
+# How often the deny-set pulls new revocations from the auth service
+REVOCATION_SYNC_INTERVAL = float(os.getenv("REVOCATION_SYNC_INTERVAL", "5"))
+# Past this without a successful sync, tokens are checked with the auth service again
+REVOCATION_MAX_STALENESS = float(os.getenv("REVOCATION_MAX_STALENESS", "60"))
+# Lifetime of the token the feed is read with
+SERVICE_TOKEN_TTL = 60
+
+
+class DenySet:
+    """
+    An in-memory set of revoked token ids, tagged with the version of the
+    newest revocation it contains so it can be brought up to date incrementally.
+    Entries are dropped once the token they revoke would have expired anyway.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._lock = threading.Lock()
+        self._entries: dict[str, float] = {}
+
+    def __contains__(self, jti) -> bool:
+        return jti in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def apply(self, entries: list, version: int):
+        now = time.time()
+        with self._lock:
+            for jti, exp in entries:
+                if exp > now:
+                    self._entries[jti] = exp
+            self.version = max(self.version, version)
+            expired = [jti for jti, exp in self._entries.items() if exp <= now]
+            for jti in expired:
+                del self._entries[jti]
+
+
+class RevocationSync:
+    """Keeps a DenySet current from the auth service's /revocations feed on a background thread"""
+
+    def __init__(self, interval: float = REVOCATION_SYNC_INTERVAL, max_staleness: float = REVOCATION_MAX_STALENESS):
+        self.interval = interval
+        self.max_staleness = max_staleness
+        self.denied = DenySet()
+        # None until the first sync succeeds; a deny-set that never synced is never fresh
+        self.synced_at: float | None = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+
+    def ensure_started(self):
+        # Threads don't survive gunicorn's fork, so start one per worker on first use
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="revocation-sync", daemon=True).start()
+
+    @property
+    def fresh(self) -> bool:
+        self.ensure_started()
+        return self.synced_at is not None and time.monotonic() - self.synced_at < self.max_staleness
+
+    def is_revoked(self, jti: str | None) -> bool:
+        return bool(jti) and jti in self.denied
+
+    def sync(self):
+        more = True
+        while more:
+            response = self._session.get(
+                f"http://{os.environ.get('AUTH_SVC_ADDR')}/revocations",
+                params={"since": self.denied.version},
+                headers={"Authorization": f"Bearer {service_token()}"},
+                timeout=5,
+            )
+            response.raise_for_status()
+            feed = response.json()
+            self.denied.apply(feed["revoked"], feed["version"])
+            more = feed["more"]
+        self.synced_at = time.monotonic()
+
+    def _run(self):
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                logger.warning("Revocation sync failed: %s", e)
+            time.sleep(self.interval)
+
+
+def service_token() -> str:
+    """A short-lived token proving to the auth service that this is the gateway, signed with the shared JWT key"""
+    now = int(time.time())
+    return jwt.encode(
+        {"type": "service", "sub": "gateway", "iat": now, "exp": now + SERVICE_TOKEN_TTL},
+        os.environ.get("JWT_SECRET", ""),
+        algorithm="HS256",
+    )
+
+
+revocations = RevocationSync()
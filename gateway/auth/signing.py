@@ -0,0 +1,53 @@
+import os, hmac, hashlib, time, math
+
+# Signed download URLs are verified locally with a shared key, so the
+# download route never has to call the auth service.
+SIGNED_URL_TTL = int(os.getenv("SIGNED_URL_TTL", "900"))
+# Expiries are rounded up to this granularity so that every URL minted for the
+# same fid inside one window is byte-identical and can be served from cache.
+SIGNED_URL_BUCKET = int(os.getenv("SIGNED_URL_BUCKET", "300"))
+
+
+def _key() -> bytes | None:
+    key = os.getenv("DOWNLOAD_SIGNING_KEY")
+    return key.encode() if key else None
+
+
+def _digest(key: bytes, fid: str, expires: int) -> str:
+    return hmac.new(key, f"{fid}:{expires}".encode(), hashlib.sha256).hexdigest()
+
+
+def sign(fid: str, ttl: int | None = None) -> tuple[tuple[int, str] | None, tuple[str, int] | None]:
+    key = _key()
+    if not key:
+        return None, ("Signed downloads are not configured", 503)
+
+    ttl = ttl or SIGNED_URL_TTL
+    bucket = max(SIGNED_URL_BUCKET, 1)
+    expires = math.ceil((time.time() + ttl) / bucket) * bucket
+
+    return (expires, _digest(key, fid, expires)), None
+
+
+def verify(fid: str, expires: str | None, signature: str | None) -> tuple[int | None, tuple[str, int] | None]:
+    """Check a signed URL and return the seconds it stays valid for"""
+    key = _key()
+    if not key:
+        return None, ("Signed downloads are not configured", 503)
+
+    if not expires or not signature:
+        return None, ("Missing signature", 403)
+
+    try:
+        expires_at = int(expires)
+    except ValueError:
+        return None, ("Invalid expiry", 403)
+
+    if not hmac.compare_digest(_digest(key, fid, expires_at), signature):
+        return None, ("Invalid signature", 403)
+
+    remaining = expires_at - int(time.time())
+    if remaining <= 0:
+        return None, ("Link expired", 410)
+
+    return remaining, None
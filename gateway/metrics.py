@@ -0,0 +1,38 @@
+import time
+from flask import Flask, Response, g, request
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+# Labelled by route rule rather than path, so cardinality stays bounded whatever clients request
+REQUEST_LATENCY = Histogram(
+    "gateway_request_duration_seconds", "Time spent handling a request",
+    ["method", "endpoint"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+REQUESTS = Counter("gateway_requests_total", "Requests handled", ["method", "endpoint", "status"])
+
+UPLOAD_BYTES = Counter("gateway_upload_bytes_total", "Video bytes stored in GridFS by /upload")
+DOWNLOAD_BYTES = Counter("gateway_download_bytes_total", "MP3 bytes served", ["route"])
+UPLOADS_THROTTLED = Counter("gateway_uploads_throttled_total", "Uploads refused with 429")
+# local = verified against the synced deny-set, remote = round trip to the auth service
+TOKEN_VALIDATIONS = Counter("gateway_token_validations_total", "Access tokens validated", ["method"])
+
+
+def init_app(app: Flask):
+    """Time every request and serve the registry on /metrics"""
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _observe(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+            REQUEST_LATENCY.labels(request.method, endpoint).observe(time.perf_counter() - start)
+            REQUESTS.labels(request.method, endpoint, str(response.status_code)).inc()
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,193 @@
+import os, math, time, threading, logging, datetime
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from storage import jobs
+
+logger = logging.getLogger(__name__)
+
+# Sustained uploads allowed per user, and how many may be sent back to back
+UPLOAD_RATE_PER_MINUTE = float(os.getenv("UPLOAD_RATE_PER_MINUTE", "10"))
+UPLOAD_BURST = float(os.getenv("UPLOAD_BURST", "5"))
+# Queued + processing jobs a single user may have at once
+MAX_ACTIVE_JOBS = int(os.getenv("MAX_ACTIVE_JOBS", "5"))
+ACTIVE_JOBS_RETRY_AFTER = int(os.getenv("ACTIVE_JOBS_RETRY_AFTER", "30"))
+
+# A slot whose job was never created is given up after this long, e.g. when a gateway died mid-upload
+STALE_SLOT_SECONDS = 3600
+
+
+class MemoryBuckets:
+    """Per-process token buckets, used when the shared store is unreachable"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets: dict[str, tuple[float, float]] = {}
+
+    def take(self, key: str, rate: float, burst: float) -> tuple[bool, float]:
+        now = time.monotonic()
+        with self.lock:
+            tokens, ts = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - ts) * rate)
+            allowed = tokens >= 1
+            self.buckets[key] = (tokens - 1 if allowed else tokens, now)
+        return allowed, tokens
+
+
+class MongoBuckets:
+    """
+    Token buckets shared by every gateway replica.
+
+    Refill and take happen in a single pipeline update, so concurrent requests
+    for one user can never both spend the last token.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def ensure_indexes(self):
+        # Idle buckets are full again by expires_at and can simply disappear
+        self.collection.create_index("expires_at", expireAfterSeconds=0, name="expires_at_ttl")
+
+    def take(self, key: str, rate: float, burst: float) -> tuple[bool, float]:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        refilled = {
+            "$min": [
+                burst,
+                {"$add": [
+                    {"$ifNull": ["$tokens", burst]},
+                    {"$multiply": [{"$divide": [{"$subtract": [now, {"$ifNull": ["$ts", now]}]}, 1000]}, rate]},
+                ]},
+            ]
+        }
+        doc = self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "ts": now}},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", 1]},
+                    "available": "$tokens",
+                    "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                    "expires_at": now + datetime.timedelta(seconds=burst / rate),
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc["allowed"], doc["available"]
+
+
+class ActiveJobSlots:
+    """
+    Per-user slots for queued + processing jobs, shared by every gateway replica.
+
+    Each user has one document listing the job IDs holding a slot. A slot is
+    taken by pushing the new job's ID only while the list is shorter than the
+    limit, in a single update, so concurrent uploads can never both take the
+    last one. Slots are given back when a job is cancelled here, or finished
+    or failed by the converter. If a release was lost, a full list is checked
+    against the jobs collection before an upload is refused.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = db.job_slots
+
+    def ensure_indexes(self):
+        # The converter gives a slot back by job ID alone
+        self.collection.create_index("jobs", name="jobs")
+
+    def take(self, owner: str, job_id: ObjectId, limit: int) -> bool:
+        if self._push(owner, job_id, limit):
+            return True
+        return self._reclaim(owner) and self._push(owner, job_id, limit)
+
+    def release(self, job_id: ObjectId):
+        self.collection.update_one({"jobs": job_id}, {"$pull": {"jobs": job_id}})
+
+    def _push(self, owner: str, job_id: ObjectId, limit: int) -> bool:
+        try:
+            self.collection.update_one(
+                {"_id": owner, f"jobs.{limit - 1}": {"$exists": False}},
+                {"$push": {"jobs": job_id}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # The owner's document exists but did not match: every slot is taken
+            return False
+        return True
+
+    def _reclaim(self, owner: str) -> bool:
+        """Drop slots of jobs that are no longer active; returns whether any were freed"""
+        doc = self.collection.find_one({"_id": owner}) or {}
+        held = doc.get("jobs", [])
+        states = {j["_id"]: j["state"] for j in self.db.jobs.find({"_id": {"$in": held}}, {"state": 1})}
+        cutoff = time.time() - STALE_SLOT_SECONDS
+        stale = [
+            job_id for job_id in held
+            if states.get(job_id, "missing") not in jobs.ACTIVE_STATES
+            # A missing job may be an upload still being stored
+            and (job_id in states or job_id.generation_time.timestamp() < cutoff)
+        ]
+        if not stale:
+            return False
+        logger.warning("Reclaiming %d active job slot(s) of %s", len(stale), owner)
+        self.collection.update_one({"_id": owner}, {"$pullAll": {"jobs": stale}})
+        return True
+
+
+class Limiter:
+    def __init__(self, db, rate_per_minute=UPLOAD_RATE_PER_MINUTE, burst=UPLOAD_BURST, max_active_jobs=MAX_ACTIVE_JOBS):
+        self.db = db
+        self.rate = rate_per_minute / 60
+        self.burst = max(burst, 1)
+        self.max_active_jobs = max_active_jobs
+        self.shared = MongoBuckets(db.rate_limits)
+        self.local = MemoryBuckets()
+        self.slots = ActiveJobSlots(db)
+
+    def ensure_indexes(self):
+        self.shared.ensure_indexes()
+        self.slots.ensure_indexes()
+
+    def take(self, key: str) -> tuple[bool, float]:
+        try:
+            return self.shared.take(key, self.rate, self.burst)
+        except Exception as e:
+            logger.warning("Shared rate limit store unavailable, using in-memory buckets: %s", e)
+            return self.local.take(key, self.rate, self.burst)
+
+    def check_upload(self, owner: str, job_id: ObjectId) -> tuple[str, int, int] | None:
+        """
+        Take an active job slot for job_id and an upload token. Returns
+        (reason, status, retry_after_seconds) when the upload must be refused;
+        otherwise the caller must release(job_id) if the job is not created.
+        """
+        if self.max_active_jobs > 0:
+            try:
+                reserved = self.slots.take(owner, job_id, self.max_active_jobs)
+            except Exception as e:
+                # Fail closed: without the shared count the quota cannot be enforced
+                logger.error("Could not reserve an active job slot: %s", e)
+                return "Could not check the active job quota", 503, ACTIVE_JOBS_RETRY_AFTER
+            if not reserved:
+                return f"Too many active jobs (limit {self.max_active_jobs})", 429, ACTIVE_JOBS_RETRY_AFTER
+
+        if self.rate <= 0:
+            return None
+
+        allowed, tokens = self.take(f"upload:{owner}")
+        if allowed:
+            return None
+        self.release(job_id)
+        return "Upload rate limit exceeded", 429, max(1, math.ceil((1 - tokens) / self.rate))
+
+    def release(self, job_id: ObjectId):
+        """Give back the active job slot of an upload that did not become a job, or a cancelled job"""
+        if self.max_active_jobs <= 0:
+            return
+        try:
+            self.slots.release(job_id)
+        except Exception as e:
+            # Reclaimed once the owner runs out of slots
+            logger.warning("Could not release the active job slot of %s: %s", job_id, e)
@@ -1,15 +1,16 @@
 from flask.wrappers import Response
-import os, gridfs, pika, json, logging
-from flask import Flask, request, jsonify, send_file
+import os, pika, json
+from flask import Flask, request, jsonify, send_file, url_for
 from typing import Tuple
 from flask_pymongo import PyMongo
-from auth import validate, access
-from storage import util
+from auth import validate, access, signing
+from storage import util, jobs, webhooks, waveforms
+from ratelimit.limiter import Limiter
 from bson.objectid import ObjectId
+import tracing, metrics, logsetup, shards
 
 # Set up logging
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
+logger = logsetup.configure("gateway")
 
 app = Flask(__name__)
 app.config["RABBITMQ_HOST"] = os.getenv("RABBITMQ_HOST", "rabbitmq")
@@ -22,8 +23,20 @@ if mongo.db == None:
 if mongo_mp3.db == None:
     raise Exception("Could not connect to MongoDB")
 
-fs = gridfs.GridFS(mongo.db)
-fs_mp3 = gridfs.GridFS(mongo_mp3.db)
+metrics.init_app(app)
+
+# Each store is the default GridFS bucket of its database unless VIDEO_SHARDS / MP3_SHARDS spread it further
+fs = shards.ShardedGridFS.from_env("VIDEO_SHARDS", mongo.db)
+fs_mp3 = shards.ShardedGridFS.from_env("MP3_SHARDS", mongo_mp3.db)
+
+limiter = Limiter(mongo.db)
+
+try:
+    jobs.ensure_indexes(mongo.db)
+    webhooks.ensure_indexes(mongo.db)
+    limiter.ensure_indexes()
+except Exception as e:
+    logger.error("Could not create indexes: %s", e)
 
 # Initialize RabbitMQ connection and channel
 try:
@@ -45,25 +58,49 @@ except Exception as e:
     channel = None
 
 @app.route('/login', methods=['POST'])
-def login() -> Tuple[str, int]:
+def login() -> Tuple[str, int] | Tuple[str, int, dict]:
     try:
-        logger.info("Login attempt received")
-        token, err = access.login(request)
+        logger.debug("Login attempt received")
+        tokens, err = access.login(request)
 
-        if not err and token:
-            logger.info("Login successful")
-            return token, 200
+        if not err and tokens:
+            logger.debug("Login successful")
+            return token_response(tokens)
         else:
             if err:
-                logger.error(f"Login failed: {err[0]} (status: {err[1]})")
+                logger.error("Login failed: %s (status: %s)", err[0], err[1])
                 return str(err[0]), err[1]
             else:
                 logger.error("Login failed with unknown error")
                 return "Unknown error", 500
     except Exception as e:
-        logger.error(f"Unexpected error in login route: {e}")
+        logger.error("Unexpected error in login route: %s", e)
         return f"Internal server error: {str(e)}", 500
 
+@app.route('/refresh', methods=['POST'])
+def refresh():
+    tokens, err = access.refresh(request)
+    if err:
+        return str(err[0]), err[1]
+
+    if not tokens:
+        return "Unknown error", 500
+
+    return token_response(tokens)
+
+@app.route('/logout', methods=['POST'])
+def logout():
+    """Revoke the bearer token, plus {"refresh_token": ...} if sent in the body"""
+    msg, err = access.revoke(request)
+    if err:
+        return str(err[0]), err[1]
+
+    return msg or "Token revoked", 200
+
+def token_response(tokens: tuple[str, str | None]) -> Tuple[str, int, dict]:
+    token, refresh_token = tokens
+    return token, 200, {"X-Refresh-Token": refresh_token} if refresh_token else {}
+
 @app.route('/upload', methods=['POST'])
 def upload():
     token, err = validate.token(request)
@@ -80,16 +117,36 @@ def upload():
         return "Message queue service unavailable", 503
 
     if access_data["is_admin"]:
+        # A malformed request must not spend a token or hold a job slot
         if not len(request.files) == 1:
             return "Only one file is allowed", 400
 
-        for _, f in request.files.items():
-            err = util.upload(f, fs, channel, access_data)
+        # Refuse before the file is stored; the slot is held from here until the job ends
+        job_id = ObjectId()
+        refused = limiter.check_upload(access_data["user_email"], job_id)
+        if refused:
+            reason, status, retry_after = refused
+            if status == 429:
+                metrics.UPLOADS_THROTTLED.inc()
+            return reason, status, {"Retry-After": str(retry_after)}
 
-            if err:
-                return str(err[0]), err[1]
+        f = next(iter(request.files.values()))
+        # One ID follows the job through the queue, the converter and the notification
+        trace_id = tracing.new_id()
+        # Opt in to removing silent stretches, as a form field or query parameter
+        trim_silence = (request.values.get("trim_silence") or "").lower() in ("1", "true", "yes")
+        message, err = util.upload(f, fs, channel, access_data, mongo.db, trace_id, trim_silence, job_id)
 
-        return "File uploaded successfully", 200
+        if err:
+            limiter.release(job_id)
+            return str(err[0]), err[1]
+
+        return jsonify({
+            "message": "File uploaded successfully",
+            "job_id": message["job_id"],
+            "video_fid": message["video_fid"],
+            "trace_id": trace_id,
+        }), 200, {"X-Trace-Id": trace_id}
     else:
         return "Unauthorized", 403
 
@@ -115,6 +172,7 @@ def download() -> Tuple[str | Response, int]:
 
         try:
             out = fs_mp3.get(ObjectId(fid_string))
+            metrics.DOWNLOAD_BYTES.labels("download").inc(out.length)
             return send_file(out, download_name=f"{fid_string}.mp3", as_attachment=True), 200
         except Exception as e:
             print(f" [!] Error: {e}")
@@ -122,6 +180,226 @@ def download() -> Tuple[str | Response, int]:
 
     return "Permission denied", 403
 
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    token, err = validate.token(request)
+    access_data = json.loads(token) if token else None
+
+    if err:
+        return str(err[0]), err[1]
+
+    if not access_data:
+        return "Unknown error", 500
+
+    state = request.args.get("state")
+    if state and state not in jobs.STATES:
+        return f"state must be one of {', '.join(jobs.STATES)}", 400
+
+    cursor = request.args.get("cursor")
+    if cursor and not ObjectId.is_valid(cursor):
+        return "Invalid cursor", 400
+
+    try:
+        limit = int(request.args.get("limit", jobs.DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return "limit must be an integer", 400
+
+    docs, next_cursor = jobs.page(mongo.db, access_data["user_email"], state, cursor, limit)
+    return jsonify({
+        "jobs": [jobs.serialize(d) for d in docs],
+        "next_cursor": next_cursor,
+    }), 200
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id: str):
+    token, err = validate.token(request)
+    access_data = json.loads(token) if token else None
+
+    if err:
+        return str(err[0]), err[1]
+
+    if not access_data:
+        return "Unknown error", 500
+
+    doc = jobs.get(mongo.db, access_data["user_email"], job_id)
+    if not doc:
+        return "Job not found", 404
+
+    return jsonify(jobs.serialize(doc)), 200
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id: str):
+    token, err = validate.token(request)
+    access_data = json.loads(token) if token else None
+
+    if err:
+        return str(err[0]), err[1]
+
+    if not access_data:
+        return "Unknown error", 500
+
+    doc, err = jobs.cancel(mongo.db, access_data["user_email"], job_id)
+    if err:
+        return str(err[0]), err[1]
+    limiter.release(doc["_id"])
+
+    return jsonify(jobs.serialize(doc)), 200
+
+@app.route("/webhooks", methods=["GET", "POST"])
+def webhook_registrations():
+    token, err = validate.token(request)
+    access_data = json.loads(token) if token else None
+
+    if err:
+        return str(err[0]), err[1]
+
+    if not access_data:
+        return "Unknown error", 500
+
+    owner = access_data["user_email"]
+    if request.method == "GET":
+        return jsonify({"webhooks": [webhooks.serialize(d) for d in webhooks.list_for(mongo.db, owner)]}), 200
+
+    url = (request.get_json(silent=True) or {}).get("url")
+    url_err = webhooks.validate_url(url)
+    if url_err:
+        return url_err, 400
+
+    doc, err = webhooks.create(mongo.db, owner, url)
+    if err:
+        return str(err[0]), err[1]
+
+    return jsonify(webhooks.serialize(doc, with_secret=True)), 201
+
+@app.route("/webhooks/<webhook_id>", methods=["DELETE"])
+def delete_webhook(webhook_id: str):
+    token, err = validate.token(request)
+    access_data = json.loads(token) if token else None
+
+    if err:
+        return str(err[0]), err[1]
+
+    if not access_data:
+        return "Unknown error", 500
+
+    if not webhooks.delete(mongo.db, access_data["user_email"], webhook_id):
+        return "Webhook not found", 404
+
+    return "", 204
+
+@app.route("/download/sign", methods=["POST"])
+def sign_download():
+    token, err = validate.token(request)
+    access_data = json.loads(token) if token else None
+
+    if err:
+        return str(err[0]), err[1]
+
+    if not access_data:
+        return "Unknown error", 500
+
+    if not access_data["is_admin"]:
+        return "Permission denied", 403
+
+    fid_string = request.args.get("fid")
+    if not fid_string or not ObjectId.is_valid(fid_string):
+        return "A valid fid is required", 400
+
+    signed, err = signing.sign(fid_string)
+    if err:
+        return str(err[0]), err[1]
+
+    if not signed:
+        return "Unknown error", 500
+
+    expires, signature = signed
+    url = url_for("signed_download", fid=fid_string, exp=expires, sig=signature, _external=True)
+    return jsonify({"url": url, "expires": expires}), 200
+
+@app.route("/d/<fid>", methods=["GET"])
+def signed_download(fid: str):
+    """Serve an MP3 from a signed URL without calling the auth service"""
+    remaining, err = signing.verify(fid, request.args.get("exp"), request.args.get("sig"))
+    if err:
+        return str(err[0]), err[1]
+
+    # An fid always names the same bytes, so the fid itself is a strong ETag
+    # and revalidations can be answered without touching GridFS.
+    if fid in request.if_none_match:
+        rv = app.response_class(status=304)
+    else:
+        try:
+            out = fs_mp3.get(ObjectId(fid))
+        except Exception as e:
+            logger.error("Signed download failed for %s: %s", fid, e)
+            return "File not found", 404
+
+        metrics.DOWNLOAD_BYTES.labels("signed").inc(out.length)
+        rv = send_file(
+            out,
+            mimetype="audio/mpeg",
+            download_name=f"{fid}.mp3",
+            as_attachment=True,
+            last_modified=out.upload_date,
+            max_age=remaining,
+        )
+
+    rv.set_etag(fid)
+    rv.cache_control.public = True
+    rv.cache_control.max_age = remaining
+    rv.cache_control.immutable = True
+    return rv
+
+@app.route("/waveform/<fid>", methods=["GET"])
+def waveform(fid: str):
+    """
+    Peak/RMS envelope of an MP3 for drawing its waveform.
+
+    Accepts either a bearer token or the same exp/sig pair as a signed
+    download URL for the fid; signed requests are publicly cacheable.
+    """
+    if request.args.get("sig"):
+        remaining, err = signing.verify(fid, request.args.get("exp"), request.args.get("sig"))
+        if err:
+            return str(err[0]), err[1]
+        public, max_age = True, remaining
+    else:
+        token, err = validate.token(request)
+        if err:
+            return str(err[0]), err[1]
+        if not token:
+            return "Unknown error", 500
+        public, max_age = False, waveforms.WAVEFORM_MAX_AGE
+
+    fmt = request.args.get("format", "json")
+    if fmt not in ("json", "binary"):
+        return "format must be json or binary", 400
+
+    # Envelopes never change once an MP3 is stored, so the fid is a strong ETag
+    etag = f"waveform-{fid}-{fmt}"
+    if etag in request.if_none_match:
+        rv = app.response_class(status=304)
+    else:
+        data, err = waveforms.get(fs_mp3, fid)
+        if err:
+            return str(err[0]), err[1]
+
+        if fmt == "binary":
+            rv = app.response_class(waveforms.pack(data), mimetype="application/octet-stream")
+            rv.headers["X-Waveform-Bins"] = str(data["bins"])
+            rv.headers["X-Waveform-Duration"] = str(data["duration"])
+        else:
+            rv = jsonify(waveforms.serialize(data))
+
+    rv.set_etag(etag)
+    if public:
+        rv.cache_control.public = True
+    else:
+        rv.cache_control.private = True
+    rv.cache_control.max_age = max_age
+    rv.cache_control.immutable = True
+    return rv
+
 
 @app.route("/health", methods=["GET"])
 def health():
@@ -0,0 +1,106 @@
+import datetime
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+
+# Job lifecycle: queued -> processing -> done | failed (cancelled may happen at any point before done)
+STATES = ("queued", "processing", "done", "failed", "cancelled")
+ACTIVE_STATES = ("queued", "processing")
+
+# Converter bookkeeping (resumable encode state) that is not part of the API
+INTERNAL_FIELDS = ("checkpoint",)
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def ensure_indexes(db):
+    """Create the indexes every /jobs query is answered from"""
+    db.jobs.create_index([("owner", ASCENDING), ("_id", DESCENDING)], name="owner_id")
+    db.jobs.create_index(
+        [("owner", ASCENDING), ("state", ASCENDING), ("_id", DESCENDING)],
+        name="owner_state_id",
+    )
+
+
+def now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def create(db, owner: str, video_fid: ObjectId, video_size: int | None, trace_id: str | None = None,
+           job_id: ObjectId | None = None) -> ObjectId:
+    ts = now()
+    res = db.jobs.insert_one({
+        "_id": job_id or ObjectId(),
+        "owner": owner,
+        "video_fid": video_fid,
+        "mp3_fid": None,
+        "state": "queued",
+        "created_at": ts,
+        "updated_at": ts,
+        "video_size": video_size,
+        "mp3_size": None,
+        "duration": None,
+        "convert_seconds": None,
+        "trace_id": trace_id,
+    })
+    return res.inserted_id
+
+
+def get(db, owner: str, job_id: str) -> dict | None:
+    if not ObjectId.is_valid(job_id):
+        return None
+    return db.jobs.find_one({"_id": ObjectId(job_id), "owner": owner})
+
+
+def cancel(db, owner: str, job_id: str) -> tuple[dict | None, tuple[str, int] | None]:
+    """Mark a queued or running job cancelled; the converter notices and stops"""
+    if not ObjectId.is_valid(job_id):
+        return None, ("Job not found", 404)
+
+    ts = now()
+    doc = db.jobs.find_one_and_update(
+        {"_id": ObjectId(job_id), "owner": owner, "state": {"$in": list(ACTIVE_STATES)}},
+        {"$set": {"state": "cancelled", "cancelled_at": ts, "updated_at": ts}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if doc:
+        return doc, None
+
+    existing = get(db, owner, job_id)
+    if not existing:
+        return None, ("Job not found", 404)
+    return None, (f"Job is already {existing['state']}", 409)
+
+
+def page(db, owner: str, state: str | None = None, cursor: str | None = None,
+         limit: int = DEFAULT_PAGE_SIZE) -> tuple[list[dict], str | None]:
+    """
+    Return one page of an owner's jobs, newest first.
+
+    The cursor is the id of the last job on the previous page, so every page
+    is a bounded range scan on (owner[, state], _id) however deep the client pages.
+    """
+    query: dict = {"owner": owner}
+    if state:
+        query["state"] = state
+    if cursor:
+        query["_id"] = {"$lt": ObjectId(cursor)}
+
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    docs = list(db.jobs.find(query).sort("_id", DESCENDING).limit(limit + 1))
+
+    next_cursor = str(docs[limit - 1]["_id"]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+
+def serialize(doc: dict) -> dict:
+    out = {}
+    for k, v in doc.items():
+        if k in INTERNAL_FIELDS:
+            continue
+        if isinstance(v, ObjectId):
+            v = str(v)
+        elif isinstance(v, datetime.datetime):
+            v = v.isoformat()
+        out["id" if k == "_id" else k] = v
+    return out
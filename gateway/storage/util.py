@@ -1,28 +1,60 @@
-import json, pika
+import pika
+from bson.objectid import ObjectId
 from pika import spec
 from pika.delivery_mode import DeliveryMode
+from storage import jobs
+import tracing, metrics, messages
 
-def upload(file, fs, channel, access):
+def upload(file, fs, channel, access, db, trace_id=None, trim_silence=False, job_id=None):
+    fid = None
+    # The job's ID is chosen up front and stamped on the file, so the sweeper can tell
+    # an orphaned upload from one that predates jobs
+    job_id = job_id or ObjectId()
     try:
-        fid = fs.put(file)
+        with tracing.span(trace_id, "upload") as span:
+            fid = fs.put(file, metadata={"job_id": str(job_id)})
+            span["bytes"] = size = fs.get(fid).length
+        metrics.UPLOAD_BYTES.inc(size)
     except Exception as e:
-        return f"Could not save file to database: {str(e)}", 500
+        if fid is not None:
+            fs.delete(fid)
+        return None, (f"Could not save file to database: {str(e)}", 500)
+
+    try:
+        jobs.create(db, access["user_email"], fid, size, trace_id, job_id)
+    except Exception as e:
+        fs.delete(fid)
+        return None, (f"Could not create job: {str(e)}", 500)
 
     message = {
+        "job_id": str(job_id),
         "video_fid": str(fid),
         "mp3_fid": None,
         "user_email": access["user_email"],
+        "trace_id": trace_id,
     }
+    if trim_silence:
+        # Only set when asked for, so the message stays as before otherwise
+        message["trim_silence"] = True
 
     try:
-        channel.basic_publish(
-            exchange='',
-            routing_key='video',
-            body=json.dumps(message),
-            properties=pika.BasicProperties(
-                delivery_mode=DeliveryMode(spec.PERSISTENT_DELIVERY_MODE)
-            ),
-        )
+        with tracing.span(trace_id, "enqueue"):
+            headers = tracing.stamp(message)
+            body, content_type = messages.encode(message)
+            channel.basic_publish(
+                exchange='',
+                routing_key='video',
+                body=body,
+                properties=pika.BasicProperties(
+                    delivery_mode=DeliveryMode(spec.PERSISTENT_DELIVERY_MODE),
+                    content_type=content_type,
+                    correlation_id=trace_id,
+                    headers=headers,
+                ),
+            )
     except Exception as e:
         fs.delete(fid)
-        return f"Could not send message to the queue: {str(e)}", 500
+        db.jobs.delete_one({"_id": job_id})
+        return None, (f"Could not send message to the queue: {str(e)}", 500)
+
+    return message, None
@@ -0,0 +1,38 @@
+import os
+from bson.objectid import ObjectId
+
+# Waveform envelopes are written by the converter into the GridFS metadata of
+# each MP3 (metadata.waveform): `bins` points of peak and RMS level, one byte
+# of full scale (0-255) per point.
+
+# Cache lifetime of token-authenticated waveform responses (signed ones live as long as the signature)
+WAVEFORM_MAX_AGE = int(os.getenv("WAVEFORM_MAX_AGE", "86400"))
+
+
+def get(fs, fid: str) -> tuple[dict | None, tuple[str, int] | None]:
+    if not ObjectId.is_valid(fid):
+        return None, ("A valid fid is required", 400)
+
+    doc = fs.find_file(fid, {"metadata.waveform": 1})
+    if not doc:
+        return None, ("File not found", 404)
+
+    waveform = (doc.get("metadata") or {}).get("waveform")
+    if not waveform:
+        # MP3s converted before envelopes were recorded
+        return None, ("No waveform recorded for this file", 404)
+    return waveform, None
+
+
+def serialize(waveform: dict) -> dict:
+    return {
+        "bins": waveform["bins"],
+        "duration": waveform["duration"],
+        "peaks": list(waveform["peaks"]),
+        "rms": list(waveform["rms"]),
+    }
+
+
+def pack(waveform: dict) -> bytes:
+    """Binary form: `bins` peak bytes followed by `bins` RMS bytes"""
+    return bytes(waveform["peaks"]) + bytes(waveform["rms"])
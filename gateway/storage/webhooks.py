@@ -0,0 +1,83 @@
+import datetime, ipaddress, os, secrets, socket
+from urllib.parse import urlparse
+from bson.objectid import ObjectId
+from pymongo import ASCENDING
+
+# Endpoints one user may register
+MAX_WEBHOOKS_PER_USER = int(os.environ.get("MAX_WEBHOOKS_PER_USER", "5"))
+
+
+def ensure_indexes(db):
+    """The notification service looks endpoints up by owner on every completion"""
+    db.webhooks.create_index([("owner", ASCENDING)], name="owner")
+
+
+def validate_url(url) -> str | None:
+    """Returns an error message for URLs the notification service cannot POST to"""
+    if not isinstance(url, str) or not url:
+        return "url is required"
+    parsed = urlparse(url)
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    except ValueError:
+        return "url has an invalid port"
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return "url must be an absolute http(s) URL"
+    return address_error(parsed.hostname, port)
+
+
+def address_error(host: str, port: int) -> str | None:
+    """
+    Endpoints must only resolve to public addresses, so a webhook cannot be
+    pointed at the cluster's own services, loopback or the metadata endpoint.
+    """
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        return f"url host '{host}' could not be resolved"
+    for *_, sockaddr in infos:
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            return f"url host '{host}' does not resolve to a public address"
+    return None
+
+
+def create(db, owner: str, url: str) -> tuple[dict | None, tuple[str, int] | None]:
+    """
+    Register an endpoint; the returned document carries the signing secret,
+    which is only ever shown to the client here.
+    """
+    if db.webhooks.count_documents({"owner": owner}) >= MAX_WEBHOOKS_PER_USER:
+        return None, (f"At most {MAX_WEBHOOKS_PER_USER} webhooks may be registered", 409)
+
+    doc = {
+        "owner": owner,
+        "url": url,
+        "secret": secrets.token_hex(32),
+        "created_at": datetime.datetime.now(datetime.timezone.utc),
+    }
+    doc["_id"] = db.webhooks.insert_one(doc).inserted_id
+    return doc, None
+
+
+def serialize(doc: dict, with_secret: bool = False) -> dict:
+    """The API view of a registration; the secret only when it is first created"""
+    out = {
+        "id": str(doc["_id"]),
+        "owner": doc["owner"],
+        "url": doc["url"],
+        "created_at": doc["created_at"].isoformat(),
+    }
+    if with_secret:
+        out["secret"] = doc["secret"]
+    return out
+
+
+def list_for(db, owner: str) -> list[dict]:
+    return list(db.webhooks.find({"owner": owner}, {"secret": 0}).sort("_id", ASCENDING))
+
+
+def delete(db, owner: str, webhook_id: str) -> bool:
+    if not ObjectId.is_valid(webhook_id):
+        return False
+    return db.webhooks.delete_one({"_id": ObjectId(webhook_id), "owner": owner}).deleted_count == 1
@@ -0,0 +1,70 @@
+"""Job pagination and cancellation (storage/jobs.py)"""
+import pytest
+from bson.objectid import ObjectId
+from storage import jobs
+
+mongomock = pytest.importorskip("mongomock")
+
+OWNER = "a@example.com"
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient().db
+    # IDs from one process increase, so _id order is creation order
+    for _ in range(7):
+        jobs.create(db, OWNER, ObjectId(), 100)
+    jobs.create(db, "b@example.com", ObjectId(), 100)
+    return db
+
+
+def all_pages(db, limit, state=None):
+    pages, cursor = [], None
+    while True:
+        docs, cursor = jobs.page(db, OWNER, state=state, cursor=cursor, limit=limit)
+        pages.append([d["_id"] for d in docs])
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.parametrize("limit", [1, 3, 7, 8])
+def test_pages_cover_every_job_once_newest_first(db, limit):
+    pages = all_pages(db, limit)
+    ids = [i for p in pages for i in p]
+    expected = [d["_id"] for d in db.jobs.find({"owner": OWNER}).sort("_id", -1)]
+    assert ids == expected
+    # A page exactly at the end has no cursor, so no empty page follows it
+    assert all(pages)
+    assert len(pages) == -(-7 // limit)
+
+
+def test_cursor_is_exclusive(db):
+    first, cursor = jobs.page(db, OWNER, limit=3)
+    assert cursor == str(first[-1]["_id"])
+    second, _ = jobs.page(db, OWNER, cursor=cursor, limit=3)
+    assert first[-1]["_id"] not in [d["_id"] for d in second]
+
+
+def test_page_size_is_clamped(db):
+    docs, _ = jobs.page(db, OWNER, limit=0)
+    assert len(docs) == 1
+    docs, _ = jobs.page(db, OWNER, limit=10_000)
+    assert len(docs) == 7
+
+
+def test_state_filter_and_cancel(db):
+    job_id = str(db.jobs.find_one({"owner": OWNER})["_id"])
+    doc, err = jobs.cancel(db, OWNER, job_id)
+    assert err is None and doc["state"] == "cancelled"
+    assert [str(i) for p in all_pages(db, 2, state="cancelled") for i in p] == [job_id]
+
+    # Cancelling is once only, and only for the owner
+    assert jobs.cancel(db, OWNER, job_id) == (None, ("Job is already cancelled", 409))
+    assert jobs.cancel(db, "b@example.com", job_id) == (None, ("Job not found", 404))
+    assert jobs.cancel(db, OWNER, "nonsense") == (None, ("Job not found", 404))
+
+
+def test_serialize_hides_converter_state(db):
+    db.jobs.update_one({}, {"$set": {"checkpoint": {"segments": []}}})
+    out = jobs.serialize(db.jobs.find_one())
+    assert "checkpoint" not in out and isinstance(out["id"], str)
@@ -0,0 +1,71 @@
+"""The active job quota and upload rate limit (ratelimit/limiter.py)"""
+import pytest
+from bson.objectid import ObjectId
+from ratelimit import limiter
+
+mongomock = pytest.importorskip("mongomock")
+
+OWNER = "a@example.com"
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+def test_slots_are_limited_and_given_back(db):
+    quota = limiter.Limiter(db, rate_per_minute=0, max_active_jobs=2)
+    first, second, third = ObjectId(), ObjectId(), ObjectId()
+    assert quota.check_upload(OWNER, first) is None
+    assert quota.check_upload(OWNER, second) is None
+
+    reason, status, retry_after = quota.check_upload(OWNER, third)
+    assert status == 429 and "limit 2" in reason
+
+    quota.release(first)
+    assert quota.check_upload(OWNER, third) is None
+    # Other users have their own slots
+    assert quota.check_upload("b@example.com", ObjectId()) is None
+
+
+def test_slots_of_finished_jobs_are_reclaimed(db):
+    quota = limiter.Limiter(db, rate_per_minute=0, max_active_jobs=1)
+    done = ObjectId()
+    assert quota.check_upload(OWNER, done) is None
+    # The converter finished the job, but its release was lost
+    db.jobs.insert_one({"_id": done, "owner": OWNER, "state": "done"})
+    assert quota.check_upload(OWNER, ObjectId()) is None
+
+
+def test_slots_of_uploads_in_flight_are_kept(db):
+    quota = limiter.Limiter(db, rate_per_minute=0, max_active_jobs=1)
+    # No job document yet: the upload holding the slot is still being stored
+    assert quota.check_upload(OWNER, ObjectId()) is None
+    assert quota.check_upload(OWNER, ObjectId())[1] == 429
+
+
+def test_quota_fails_closed(db, monkeypatch):
+    quota = limiter.Limiter(db, rate_per_minute=0, max_active_jobs=1)
+
+    def unavailable(*args, **kwargs):
+        raise ConnectionError("mongo down")
+    monkeypatch.setattr(quota.slots.collection, "update_one", unavailable)
+    assert quota.check_upload(OWNER, ObjectId())[1] == 503
+
+
+def test_a_throttled_upload_gives_its_slot_back(db, monkeypatch):
+    quota = limiter.Limiter(db, rate_per_minute=60, burst=1, max_active_jobs=1)
+    monkeypatch.setattr(quota, "take", lambda key: (False, 0.5))
+    reason, status, retry_after = quota.check_upload(OWNER, ObjectId())
+    assert status == 429 and retry_after == 1
+
+    monkeypatch.setattr(quota, "take", lambda key: (True, 1))
+    assert quota.check_upload(OWNER, ObjectId()) is None
+
+
+def test_memory_buckets_refill():
+    buckets = limiter.MemoryBuckets()
+    assert buckets.take("k", rate=0, burst=2)[0]
+    assert buckets.take("k", rate=0, burst=2)[0]
+    assert not buckets.take("k", rate=0, burst=2)[0]
+    assert buckets.take("k", rate=1e6, burst=2)[0]
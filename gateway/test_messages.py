@@ -0,0 +1,59 @@
+"""The job message codec (messages.py, copied verbatim into every service)"""
+import json
+import pytest
+import messages
+
+MESSAGE = {
+    "job_id": "65f0c0ffee0000000000aaaa",
+    "video_fid": "65f0c0ffee0000000000bbbb",
+    "mp3_fid": None,
+    "user_email": "a@example.com",
+    "trace_id": "abc123",
+    "enqueued_at": 1700000000.5,
+}
+
+
+def test_json_round_trip():
+    body, content_type = messages.encode(MESSAGE, "json")
+    assert content_type == messages.JSON
+    assert messages.decode(body, content_type) == {**MESSAGE, "v": messages.SCHEMA_VERSION}
+
+
+def test_msgpack_round_trip_and_sniffing():
+    pytest.importorskip("msgpack")
+    body, content_type = messages.encode(MESSAGE, "msgpack")
+    assert content_type == messages.MSGPACK
+    # Without a content type the body is sniffed
+    assert messages.decode(body) == {**MESSAGE, "v": messages.SCHEMA_VERSION}
+
+
+def test_v1_messages_are_normalised():
+    body = json.dumps({"video_fid": "f", "mp3_fid": None, "username": "a@example.com"}).encode()
+    message = messages.decode(body, messages.JSON)
+    assert message["v"] == 1
+    assert message["user_email"] == "a@example.com"
+
+
+def test_unknown_fields_survive():
+    body, content_type = messages.encode({**MESSAGE, "future_field": [1, 2]})
+    assert messages.decode(body, content_type)["future_field"] == [1, 2]
+
+
+@pytest.mark.parametrize("body", [
+    b"",
+    b"not json",
+    b"[1, 2]",
+    json.dumps({"v": messages.SCHEMA_VERSION + 1}).encode(),
+    json.dumps({"v": "2"}).encode(),
+    json.dumps({"job_id": 5}).encode(),
+    json.dumps({"trim_silence": "yes"}).encode(),
+])
+def test_invalid_messages_are_rejected(body):
+    with pytest.raises(messages.MessageError):
+        messages.decode(body, messages.JSON)
+
+
+def test_required_fields():
+    body, content_type = messages.encode(MESSAGE)
+    with pytest.raises(messages.MessageError, match="mp3_fid"):
+        messages.decode(body, content_type, require=("video_fid", "mp3_fid"))
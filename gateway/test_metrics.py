@@ -0,0 +1,51 @@
+"""Request metrics and the /metrics endpoint (metrics.py)"""
+import importlib.util, os
+from flask import Flask
+from prometheus_client import REGISTRY
+import metrics
+
+if not hasattr(metrics, "init_app"):
+    # Every service has a metrics.py; another's was imported first when several services' tests run together
+    _spec = importlib.util.spec_from_file_location("gateway_metrics", os.path.join(os.path.dirname(__file__), "metrics.py"))
+    metrics = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(metrics)
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def app():
+    app = Flask(__name__)
+
+    @app.route("/jobs/<job_id>")
+    def job(job_id):
+        return job_id
+    metrics.init_app(app)
+    return app.test_client()
+
+
+def test_requests_are_labelled_by_route_rule():
+    client = app()
+    before = sample("gateway_requests_total", method="GET", endpoint="/jobs/<job_id>", status="200")
+    latency = sample("gateway_request_duration_seconds_count", method="GET", endpoint="/jobs/<job_id>")
+    client.get("/jobs/a")
+    client.get("/jobs/b")
+
+    assert sample("gateway_requests_total", method="GET", endpoint="/jobs/<job_id>", status="200") == before + 2
+    assert sample("gateway_request_duration_seconds_count", method="GET", endpoint="/jobs/<job_id>") == latency + 2
+
+
+def test_unknown_paths_share_one_label():
+    client = app()
+    before = sample("gateway_requests_total", method="GET", endpoint="unmatched", status="404")
+    client.get("/nope/1")
+    client.get("/nope/2")
+    assert sample("gateway_requests_total", method="GET", endpoint="unmatched", status="404") == before + 2
+
+
+def test_metrics_endpoint_serves_the_registry():
+    response = app().get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    assert b"gateway_request_duration_seconds_bucket" in response.data
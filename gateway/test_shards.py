@@ -0,0 +1,63 @@
+"""Hash ring routing and fallback reads (shards.py, copied verbatim into the converter)"""
+import pytest
+from bson.objectid import ObjectId
+import shards
+
+
+class FakeDb:
+    def __getitem__(self, name):
+        return None
+
+
+@pytest.fixture
+def make_store(monkeypatch):
+    # Routing never touches the databases
+    monkeypatch.setattr(shards, "GridFS", lambda db, collection: None)
+
+    def make(*names):
+        return shards.ShardedGridFS([shards.Shard(i, name, FakeDb()) for i, name in enumerate(names)])
+    return make
+
+
+def test_owner_comes_first_then_the_other_shards_in_order(make_store):
+    store = make_store("a", "b", "c")
+    for _ in range(50):
+        fid = ObjectId()
+        candidates = store._candidates(fid)
+        assert candidates[0] is store.owner(fid)
+        assert sorted(s.index for s in candidates) == [0, 1, 2]
+        assert [s.index for s in candidates[1:]] == sorted(s.index for s in candidates[1:])
+
+
+def test_adding_a_shard_moves_only_its_share(make_store):
+    before, after = make_store("a", "b", "c"), make_store("a", "b", "c", "d")
+    fids = [ObjectId() for _ in range(4000)]
+    moved = [fid for fid in fids if before.owner(fid).name != after.owner(fid).name]
+    # Everything that moves goes to the new shard, about a quarter of the files
+    assert {after.owner(fid).name for fid in moved} == {"d"}
+    assert 0.15 < len(moved) / len(fids) < 0.35
+
+
+def test_shard_limits():
+    with pytest.raises(ValueError):
+        shards.ShardedGridFS([])
+
+
+def test_ids_are_stored_unaltered_and_found_after_a_shard_is_added():
+    mongomock = pytest.importorskip("mongomock")
+    pytest.importorskip("mongomock.gridfs").enable_gridfs_integration()
+    db = mongomock.MongoClient().db
+    one = shards.ShardedGridFS([shards.Shard(0, "a", db)])
+    fids = [one.put(f"file {i}".encode()) for i in range(20)]
+
+    two = shards.ShardedGridFS([shards.Shard(0, "a", db), shards.Shard(1, "b", db, "b")])
+    assert any(two.owner(fid).index == 1 for fid in fids)
+    for i, fid in enumerate(fids):
+        # Not yet rebalanced: found on the first shard after a miss on the new owner
+        assert two.get(fid).read() == f"file {i}".encode()
+        assert two.locate(fid).index == 0
+
+    fid = two.put(b"new")
+    assert two.locate(fid) is two.owner(fid)
+    two.delete(fid)
+    assert not two.exists(fid)
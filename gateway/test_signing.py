@@ -0,0 +1,61 @@
+"""Signed download URLs (auth/signing.py)"""
+import pytest
+from auth import signing
+
+FID = "65f0c0ffee0000000000bbbb"
+
+
+@pytest.fixture(autouse=True)
+def key(monkeypatch):
+    monkeypatch.setenv("DOWNLOAD_SIGNING_KEY", "test-key")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(signing.time, "time", lambda: now[0])
+    return now
+
+
+def test_signed_url_verifies_until_it_expires(clock):
+    (expires, sig), err = signing.sign(FID, ttl=600)
+    assert err is None
+    remaining, err = signing.verify(FID, str(expires), sig)
+    assert err is None and remaining >= 600
+
+    clock[0] = expires
+    assert signing.verify(FID, str(expires), sig) == (None, ("Link expired", 410))
+
+
+def test_urls_minted_in_one_bucket_are_identical(clock, monkeypatch):
+    monkeypatch.setattr(signing, "SIGNED_URL_BUCKET", 300)
+    clock[0] = 1_700_000_010.0
+    first, _ = signing.sign(FID, ttl=600)
+    clock[0] += 90
+    assert signing.sign(FID, ttl=600)[0] == first
+    assert first[0] % 300 == 0
+
+
+@pytest.mark.parametrize("tamper", ["fid", "expires", "signature"])
+def test_tampered_urls_are_refused(clock, tamper):
+    (expires, sig), _ = signing.sign(FID, ttl=600)
+    fid, expires = FID, str(expires)
+    if tamper == "fid":
+        fid = "65f0c0ffee0000000000cccc"
+    elif tamper == "expires":
+        expires = str(int(expires) + 3600)
+    else:
+        sig = sig[:-1] + ("0" if sig[-1] != "0" else "1")
+    assert signing.verify(fid, expires, sig) == (None, ("Invalid signature", 403))
+
+
+@pytest.mark.parametrize("expires, sig, status", [(None, "x", 403), ("1", None, 403), ("soon", "x", 403)])
+def test_malformed_urls_are_refused(expires, sig, status):
+    remaining, err = signing.verify(FID, expires, sig)
+    assert remaining is None and err[1] == status
+
+
+def test_signing_needs_a_key(monkeypatch):
+    monkeypatch.delenv("DOWNLOAD_SIGNING_KEY")
+    assert signing.sign(FID)[1][1] == 503
+    assert signing.verify(FID, "1", "x")[1][1] == 503
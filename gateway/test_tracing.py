@@ -0,0 +1,73 @@
+"""Trace propagation and span export (tracing.py, shared by every service)"""
+import json, time
+import pytest
+import tracing
+
+
+class Properties:
+    def __init__(self, headers=None, correlation_id=None):
+        self.headers = headers
+        self.correlation_id = correlation_id
+
+
+@pytest.fixture
+def spans(tmp_path, monkeypatch):
+    path = tmp_path / "spans.jsonl"
+    exporter = tracing._Exporter(f"file:{path}", maxsize=100)
+    monkeypatch.setattr(tracing, "exporter", exporter)
+
+    def read():
+        exporter.flush()
+        # The batch is taken off the queue just before it is written
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            if path.exists():
+                return [json.loads(line) for line in path.read_text().splitlines()]
+            time.sleep(0.01)
+        return []
+    return read
+
+
+def test_trace_id_comes_from_the_body_then_the_headers():
+    assert tracing.trace_id({"trace_id": "body"}, Properties({tracing.HEADER: "header"})) == "body"
+    assert tracing.trace_id({}, Properties({tracing.HEADER: "header"})) == "header"
+    assert tracing.trace_id({}, Properties(correlation_id="corr")) == "corr"
+    assert tracing.trace_id({}) is None
+
+
+def test_stamp_returns_the_headers_to_publish_with():
+    message = {"trace_id": "t1"}
+    headers = tracing.stamp(message)
+    assert headers == {tracing.HEADER: "t1", tracing.ENQUEUED_HEADER: message["enqueued_at"]}
+
+
+def test_spans_are_exported_with_errors(spans):
+    with tracing.span("t1", "store", size=3):
+        pass
+    with pytest.raises(ValueError):
+        with tracing.span("t1", "publish"):
+            raise ValueError("broker gone")
+
+    stored, published = spans()
+    assert stored["trace_id"] == "t1" and stored["span"] == "store" and stored["attrs"] == {"size": 3}
+    assert published["attrs"]["error"] == "ValueError: broker gone"
+    assert stored["duration"] >= 0
+
+
+def test_nothing_is_recorded_without_a_trace_id(spans):
+    with tracing.span(None, "store"):
+        pass
+    tracing.record_queued(None, {"enqueued_at": time.time()})
+    tracing.record_queued("t1", {})
+    tracing.record("t1", "marker", 1.0, 1.0)
+    assert [s["span"] for s in spans()] == ["marker"]
+
+
+def test_a_full_queue_drops_spans(monkeypatch):
+    exporter = tracing._Exporter("file:/dev/null", maxsize=1)
+    # Keep the export thread from draining the queue
+    exporter._pid = tracing.os.getpid()
+    monkeypatch.setattr(tracing, "exporter", exporter)
+    tracing.record("t1", "a", 0, 1)
+    tracing.record("t1", "b", 0, 1)
+    assert exporter.dropped == 1
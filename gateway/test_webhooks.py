@@ -0,0 +1,64 @@
+"""Webhook registration: URL checks and what the API returns (storage/webhooks.py)"""
+import socket
+import pytest
+from storage import webhooks
+
+
+@pytest.fixture
+def resolve(monkeypatch):
+    answers = {}
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        if host not in answers:
+            raise socket.gaierror("unknown host")
+        return [(socket.AF_INET6 if ":" in a else socket.AF_INET, socket.SOCK_STREAM, 6, "", (a, port))
+                for a in answers[host]]
+    monkeypatch.setattr(webhooks.socket, "getaddrinfo", getaddrinfo)
+    return answers
+
+
+@pytest.mark.parametrize("url", [
+    None,
+    "",
+    "ftp://hook.example/cb",
+    "/relative",
+    "https://hook.example:99999/cb",
+    "https://unknown.example/cb",
+])
+def test_malformed_urls_are_refused(resolve, url):
+    resolve["hook.example"] = ["93.184.216.34"]
+    assert webhooks.validate_url(url) is not None
+
+
+@pytest.mark.parametrize("addresses", [
+    ["127.0.0.1"],
+    ["10.1.2.3"],
+    ["169.254.169.254"],
+    ["100.64.0.1"],
+    ["::1"],
+    # One internal address among public ones is enough to refuse
+    ["93.184.216.34", "192.168.0.10"],
+])
+def test_internal_addresses_are_refused(resolve, addresses):
+    resolve["hook.example"] = addresses
+    assert "public address" in webhooks.validate_url("https://hook.example/cb")
+
+
+def test_public_urls_are_accepted(resolve):
+    resolve["hook.example"] = ["93.184.216.34"]
+    assert webhooks.validate_url("https://hook.example:8443/cb") is None
+
+
+def test_secret_is_only_returned_on_creation():
+    mongomock = pytest.importorskip("mongomock")
+    db = mongomock.MongoClient().db
+    doc, err = webhooks.create(db, "a@example.com", "https://hook.example/cb")
+    assert err is None
+    created = webhooks.serialize(doc, with_secret=True)
+    assert len(created["secret"]) == 64
+
+    listed, = [webhooks.serialize(d) for d in webhooks.list_for(db, "a@example.com")]
+    assert listed["id"] == created["id"] and listed["url"] == created["url"]
+    assert "secret" not in listed
+    # Even a document read with its secret is shown without it
+    assert "secret" not in webhooks.serialize(db.webhooks.find_one())
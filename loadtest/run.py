@@ -0,0 +1,704 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test of the whole pipeline in one process.
+
+The gateway and auth service are served over HTTP on local ports, converter and
+notification workers consume from an in-memory broker, and MongoDB, MySQL and
+SMTP are replaced by the stand-ins in standins.py and notification/smtp_sink.py.
+Virtual users log in and then run a weighted mix of operations against the
+gateway for --duration seconds; the harness then waits for the queued
+conversions to finish and reports throughput, latency percentiles, queue
+behaviour and the CPU each service used:
+
+    python3 loadtest/run.py --users 8 --duration 60 --mix upload=1,download=3,signed=1,waveform=1,jobs=1
+    python3 loadtest/run.py --converters 4 --video-seconds 30 --json after.json --baseline before.json
+
+Operations: login, upload, download, signed (mint a signed URL and fetch it),
+waveform, jobs. Downloads pick from MP3s converted so far; a few warm-up
+uploads make sure there are some before the clock starts. Service settings
+come from the environment as usual, e.g. MAX_ACTIVE_JOBS=5 to load the
+limiter, or MESSAGE_ENCODING=msgpack.
+"""
+import argparse, contextlib, functools, json, logging, os, random, resource, subprocess, sys, tempfile, threading, time
+import importlib
+from unittest import mock
+
+import flask_pymongo, pika, pymongo, requests
+from werkzeug.serving import make_server
+
+import standins
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+OPERATIONS = ("login", "upload", "download", "signed", "waveform", "jobs")
+DEFAULT_MIX = "upload=1,download=3,signed=1,waveform=1,jobs=1"
+PASSWORD = "password"
+
+# Set before any service module is imported, unless already given
+DEFAULT_ENV = {
+    "LOG_FORMAT": "text",
+    "JWT_SECRET": "loadtest-jwt-secret-at-least-32-bytes",
+    "DOWNLOAD_SIGNING_KEY": "loadtest-signing-key",
+    # Virtual users upload far faster than real ones; throttling is opt-in
+    "UPLOAD_RATE_PER_MINUTE": "1000000",
+    "UPLOAD_BURST": "1000000",
+    "MAX_ACTIVE_JOBS": "0",
+    "VIDEO_QUEUE": "video",
+    "MP3_QUEUE": "mp3",
+    "GMAIL_ADDRESS": "loadtest@example.com",
+    "GMAIL_PASSWORD": "loadtest",
+    "SMTP_STARTTLS": "false",
+}
+
+
+# ===================================================================================================
+# Measurements
+# ===================================================================================================
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(seconds: list[float]) -> dict:
+    return {
+        "count": len(seconds),
+        "p50_ms": round(percentile(seconds, 0.50) * 1000, 2),
+        "p90_ms": round(percentile(seconds, 0.90) * 1000, 2),
+        "p99_ms": round(percentile(seconds, 0.99) * 1000, 2),
+        "max_ms": round(max(seconds, default=0) * 1000, 2),
+    }
+
+
+class Meter:
+    """CPU and wall time one service spends handling requests or jobs"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.cpu = 0.0
+        self.busy = 0.0
+
+    def add(self, cpu: float, busy: float):
+        with self.lock:
+            self.calls += 1
+            self.cpu += cpu
+            self.busy += busy
+
+    def wrap(self, fn):
+        @functools.wraps(fn)
+        def metered(*args, **kwargs):
+            with self.track():
+                return fn(*args, **kwargs)
+        return metered
+
+    @contextlib.contextmanager
+    def track(self):
+        cpu, wall = time.thread_time(), time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(time.thread_time() - cpu, time.perf_counter() - wall)
+
+    def wsgi(self, app):
+        """Wrap a WSGI app; a streamed body (send_file) is counted until it is fully written"""
+        def metered(environ, start_response):
+            cpu, wall = time.thread_time(), time.perf_counter()
+            try:
+                body = app(environ, start_response)
+            except Exception:
+                self.add(time.thread_time() - cpu, time.perf_counter() - wall)
+                raise
+
+            def stream():
+                try:
+                    yield from body
+                finally:
+                    if hasattr(body, "close"):
+                        body.close()
+                    self.add(time.thread_time() - cpu, time.perf_counter() - wall)
+            return stream()
+        return metered
+
+
+class Recorder:
+    """Client-side latency and status of every operation"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples: dict[str, list[float]] = {}
+        self.statuses: dict[str, dict[int, int]] = {}
+
+    def record(self, op: str, seconds: float, status: int):
+        with self.lock:
+            self.samples.setdefault(op, []).append(seconds)
+            counts = self.statuses.setdefault(op, {})
+            counts[status] = counts.get(status, 0) + 1
+
+    def report(self, elapsed: float) -> dict:
+        out = {}
+        for op in sorted(self.samples):
+            statuses = self.statuses[op]
+            stats = summarize(self.samples[op])
+            stats["errors"] = sum(n for status, n in statuses.items() if not 200 <= status < 400 and status != 429)
+            stats["throttled"] = statuses.get(429, 0)
+            stats["ops_per_second"] = round(stats["count"] / elapsed, 2) if elapsed else 0.0
+            stats["statuses"] = {str(status): n for status, n in sorted(statuses.items())}
+            out[op] = stats
+        return out
+
+
+class Tracker:
+    """Follows uploads to their notification, and keeps the converted MP3s to download"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started: dict[str, float] = {}
+        self.finished: dict[str, float] = {}
+        self.latencies: list[float] = []
+        self.fids: list[str] = []
+
+    def upload(self, job_id: str, at: float):
+        with self.lock:
+            if job_id in self.finished:
+                self.latencies.append(self.finished.pop(job_id) - at)
+            else:
+                self.started[job_id] = at
+
+    def notified(self, job_id: str | None, mp3_fid: str | None, at: float):
+        with self.lock:
+            if mp3_fid:
+                self.fids.append(mp3_fid)
+            if not job_id:
+                return
+            # The notification can beat the upload's HTTP response back to the client
+            if job_id in self.started:
+                self.latencies.append(at - self.started.pop(job_id))
+            else:
+                self.finished[job_id] = at
+
+    def pending(self) -> int:
+        with self.lock:
+            return len(self.started)
+
+    def fid(self, rng: random.Random) -> str | None:
+        with self.lock:
+            return rng.choice(self.fids) if self.fids else None
+
+    def reset(self):
+        with self.lock:
+            self.started.clear()
+            self.finished.clear()
+            self.latencies = []
+
+
+def children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+# ===================================================================================================
+# Services
+# ===================================================================================================
+def load(service: str, *names: str) -> list:
+    """
+    Import modules of one service as if it were the only one on the path.
+
+    The services share module names (server, metrics, logsetup, ...), so each
+    service's modules are dropped from sys.modules once imported; the returned
+    modules keep their own references to them.
+    """
+    directory = os.path.join(ROOT, service)
+    before = set(sys.modules)
+    sys.path.insert(0, directory)
+    try:
+        return [importlib.import_module(name) for name in names]
+    finally:
+        sys.path.remove(directory)
+        for name in set(sys.modules) - before:
+            path = getattr(sys.modules[name], "__file__", None) or ""
+            if path.startswith(directory + os.sep):
+                del sys.modules[name]
+
+
+def serve(app, meter: Meter):
+    server = make_server("127.0.0.1", 0, meter.wsgi(app), threaded=True)
+    threading.Thread(target=server.serve_forever, name=f"{meter.name}-http", daemon=True).start()
+    return server
+
+
+class Pipeline:
+    """All four services wired to the stand-ins"""
+
+    def __init__(self, args):
+        self.meters = {name: Meter(name) for name in ("gateway", "auth", "converter", "notification")}
+        self.broker = standins.Broker()
+        self.mongo = standins.MongoStandIn()
+        self.mysql = standins.MySQLStandIn(
+            connect_latency=args.mysql_connect_ms / 1000, query_latency=args.mysql_query_ms / 1000
+        )
+        self.tracker = Tracker()
+        self.stop = threading.Event()
+        self.workers: list[threading.Thread] = []
+
+        # Auth, over the SQLite stand-in
+        sys.modules["MySQLdb"] = self.mysql.module()
+        (self.auth,) = load("auth_service", "server")
+        self.auth_http = serve(self.auth.app, self.meters["auth"])
+        os.environ["AUTH_SVC_ADDR"] = f"127.0.0.1:{self.auth_http.server_port}"
+
+        # Gateway and converter, over in-memory MongoDB and the broker
+        with mock.patch.object(flask_pymongo, "MongoClient", lambda *a, **kw: self.mongo.default), \
+                mock.patch.object(pymongo, "MongoClient", self.mongo.client), \
+                mock.patch.object(pika, "BlockingConnection", self.broker.connection):
+            (self.gateway,) = load("gateway", "server")
+            self.converter, shards = load("converter", "consumer", "convert.shards")
+        self.gateway_http = serve(self.gateway.app, self.meters["gateway"])
+        self.base_url = f"http://127.0.0.1:{self.gateway_http.server_port}"
+
+        db_videos, db_mp3 = self.mongo.default.gateway_db, self.mongo.default.mp3
+        self.jobs = db_videos.jobs
+        self.fs_videos = shards.ShardedGridFS.from_env("VIDEO_SHARDS", db_videos)
+        self.fs_mp3 = shards.ShardedGridFS.from_env("MP3_SHARDS", db_mp3)
+
+        # Notification, sending to the SMTP sink
+        (smtp_sink,) = load("notification", "smtp_sink")
+        self.smtp = smtp_sink.SMTPSink(
+            connect_latency=args.smtp_connect_ms / 1000, command_latency=args.smtp_command_ms / 1000
+        ).start()
+        os.environ["SMTP_HOST"], os.environ["SMTP_PORT"] = "127.0.0.1", str(self.smtp.port)
+        os.environ.setdefault("NOTIFY_CONCURRENCY", str(args.notifiers))
+        (self.notification,) = load("notification", "consumer")
+        # Every mode (one at a time, concurrent, digest) sends through transport.deliver
+        transport = self.notification.transport
+        transport.deliver = self.meters["notification"].wrap(transport.deliver)
+        self.broker.on_ack[os.environ["MP3_QUEUE"]] = self.notified
+
+        # Every service configured the root logger in turn; keep the request log out of the report
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+        for i in range(args.converters):
+            self._spawn(self.convert, f"converter-{i}")
+        self._spawn(self.notify, "notification")
+
+    def _spawn(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self.workers.append(thread)
+
+    def convert(self):
+        """One converter process: converter/consumer.py's callback on a connection of its own"""
+        connection = self.broker.connection()
+        channel = connection.channel()
+        channel.basic_qos(prefetch_count=1)
+        callback = self.converter.make_callback(self.fs_videos, self.fs_mp3, self.jobs)
+        channel.basic_consume(queue=os.environ["VIDEO_QUEUE"], on_message_callback=self.meters["converter"].wrap(callback))
+        self._consume(connection)
+
+    def notify(self):
+        """The notification service, in whichever mode notification/consumer.py picks for the environment"""
+        connection = self.broker.connection()
+        channel = connection.channel()
+        concurrency = max(1, int(os.environ["NOTIFY_CONCURRENCY"]))
+        channel.basic_qos(prefetch_count=self.notification.prefetch_count(concurrency))
+        on_message, dispatcher = self.notification.consumer(connection, channel, concurrency)
+        channel.basic_consume(queue=os.environ["MP3_QUEUE"], on_message_callback=on_message)
+        self._consume(connection)
+        if dispatcher:
+            dispatcher.shutdown()
+
+    def _consume(self, connection):
+        while not self.stop.is_set():
+            connection.process_data_events(time_limit=0.2)
+        connection.close()
+
+    def notified(self, delivery):
+        content_type = delivery.properties.content_type if delivery.properties else None
+        message = self.notification.messages.decode(delivery.body, content_type)
+        self.tracker.notified(message.get("job_id"), message.get("mp3_fid"), time.perf_counter())
+
+    def errors(self) -> dict:
+        """Deliveries each consumer nacked, whether requeued or dropped"""
+        stats = self.broker.stats
+        queues = {"converter": os.environ["VIDEO_QUEUE"], "notification": os.environ["MP3_QUEUE"]}
+        return {name: stats[queue].nacked if queue in stats else 0 for name, queue in queues.items()}
+
+    def settle(self, timeout: float) -> bool:
+        """Wait for everything queued to be converted and notified"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.broker.idle() and not self.tracker.pending():
+                return True
+            time.sleep(0.1)
+        return False
+
+    def close(self):
+        self.stop.set()
+        for thread in self.workers:
+            thread.join(timeout=5)
+        self.gateway_http.shutdown()
+        self.auth_http.shutdown()
+        self.smtp.stop()
+
+
+# ===================================================================================================
+# Load
+# ===================================================================================================
+class VirtualUser:
+    def __init__(self, pipeline: Pipeline, recorder: Recorder, email: str, video: bytes, args, seed: int):
+        self.pipeline = pipeline
+        self.recorder = recorder
+        self.email = email
+        self.video = video
+        self.args = args
+        self.rng = random.Random(seed)
+        self.session = requests.Session()
+        self.token = None
+
+    def call(self, op: str, method: str, path: str, auth: bool = True, **kwargs) -> requests.Response | None:
+        url = path if path.startswith("http") else self.pipeline.base_url + path
+        for attempt in range(2):
+            headers = {"Authorization": f"Bearer {self.token}"} if auth else {}
+            started = time.perf_counter()
+            try:
+                rv = self.session.request(method, url, headers=headers, timeout=self.args.timeout, **kwargs)
+            except requests.RequestException:
+                self.recorder.record(op, time.perf_counter() - started, 0)
+                return None
+            elapsed = time.perf_counter() - started
+            # Access tokens expire during long runs
+            if rv.status_code == 401 and auth and attempt == 0 and self.login():
+                continue
+            self.recorder.record(op, elapsed, rv.status_code)
+            return rv
+        return None
+
+    def login(self) -> bool:
+        """Basic auth through the gateway, which asks the auth service"""
+        started = time.perf_counter()
+        try:
+            rv = self.session.post(
+                self.pipeline.base_url + "/login", auth=(self.email, PASSWORD), timeout=self.args.timeout
+            )
+        except requests.RequestException:
+            self.recorder.record("login", time.perf_counter() - started, 0)
+            return False
+        self.recorder.record("login", time.perf_counter() - started, rv.status_code)
+        if rv.status_code != 200:
+            return False
+        self.token = rv.text
+        return True
+
+    def upload(self):
+        sent = time.perf_counter()
+        data = {"trim_silence": "true"} if self.args.trim_silence else {}
+        rv = self.call("upload", "POST", "/upload", files={"file": ("sample.mp4", self.video, "video/mp4")}, data=data)
+        if rv is not None and rv.status_code == 200:
+            self.pipeline.tracker.upload(rv.json()["job_id"], sent)
+
+    def download(self):
+        self.call("download", "GET", f"/download?fid={self.pipeline.tracker.fid(self.rng)}")
+
+    def signed(self):
+        rv = self.call("sign", "POST", f"/download/sign?fid={self.pipeline.tracker.fid(self.rng)}")
+        if rv is not None and rv.status_code == 200:
+            self.call("signed", "GET", rv.json()["url"], auth=False)
+
+    def waveform(self):
+        self.call("waveform", "GET", f"/waveform/{self.pipeline.tracker.fid(self.rng)}")
+
+    def jobs(self):
+        self.call("jobs", "GET", "/jobs?limit=20")
+
+    def run(self, mix: dict[str, float], deadline: float):
+        if not self.login():
+            return
+        ops, weights = list(mix), list(mix.values())
+        think = self.args.think_ms / 1000
+        while time.monotonic() < deadline:
+            getattr(self, self.rng.choices(ops, weights)[0])()
+            if think:
+                # Exponential pauses, so users don't fall into lockstep
+                time.sleep(min(self.rng.expovariate(1 / think), max(deadline - time.monotonic(), 0)))
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    mix = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        op, _, weight = part.partition("=")
+        op = op.strip()
+        if op not in OPERATIONS:
+            raise ValueError(f"unknown operation {op!r}, expected one of {', '.join(OPERATIONS)}")
+        mix[op] = float(weight or 1)
+    if not any(w > 0 for w in mix.values()):
+        raise ValueError("the mix needs at least one operation with a positive weight")
+    return {op: w for op, w in mix.items() if w > 0}
+
+
+def sample_video(seconds: float) -> bytes:
+    """A small MP4 with a test pattern and a tone, made with the ffmpeg moviepy uses"""
+    import imageio_ffmpeg
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sample.mp4")
+        subprocess.run(
+            [
+                imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y",
+                "-f", "lavfi", "-i", "testsrc=size=320x240:rate=15",
+                "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=44100",
+                "-t", str(seconds), "-c:v", "libx264", "-pix_fmt", "yuv420p", "-c:a", "aac", "-shortest", path,
+            ],
+            check=True,
+        )
+        with open(path, "rb") as f:
+            return f.read()
+
+
+# ===================================================================================================
+# Report
+# ===================================================================================================
+def conversions(jobs, exclude: set, elapsed: float) -> dict:
+    states: dict[str, int] = {}
+    seconds, audio = [], 0.0
+    for doc in jobs.find({}, {"state": 1, "convert_seconds": 1, "duration": 1}):
+        if doc["_id"] in exclude:
+            continue
+        states[doc.get("state")] = states.get(doc.get("state"), 0) + 1
+        if doc.get("state") == "done" and doc.get("convert_seconds") is not None:
+            seconds.append(doc["convert_seconds"])
+            audio += doc.get("duration") or 0.0
+    return {
+        "states": states,
+        "done": len(seconds),
+        "per_minute": round(len(seconds) * 60 / elapsed, 2) if elapsed else 0.0,
+        "convert_p50_s": round(percentile(seconds, 0.50), 3),
+        "convert_p99_s": round(percentile(seconds, 0.99), 3),
+        "realtime_factor": round(audio / sum(seconds), 2) if sum(seconds) else 0.0,
+    }
+
+
+def print_report(report: dict):
+    config = report["config"]
+    print(
+        f"{config['users']} users for {config['duration']:g}s, mix {config['mix']}, "
+        f"{config['converters']} converters, {config['notifiers']} notifiers, {config['video']}\n"
+    )
+
+    print(f"{'operation':<12} {'count':>7} {'errors':>7} {'429':>5} {'ops/s':>8} "
+          f"{'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for op, s in report["operations"].items():
+        print(f"{op:<12} {s['count']:>7} {s['errors']:>7} {s['throttled']:>5} {s['ops_per_second']:>8.2f} "
+              f"{s['p50_ms']:>9.1f} {s['p90_ms']:>9.1f} {s['p99_ms']:>9.1f} {s['max_ms']:>9.1f}")
+
+    e2e = report["end_to_end"]
+    print(f"\nupload -> notification  n {e2e['count']}  p50 {e2e['p50_ms'] / 1000:.2f}s  "
+          f"p90 {e2e['p90_ms'] / 1000:.2f}s  p99 {e2e['p99_ms'] / 1000:.2f}s  "
+          f"max {e2e['max_ms'] / 1000:.2f}s  unfinished {e2e['unfinished']}")
+    c = report["conversions"]
+    print(f"conversions            {c['done']} done ({c['per_minute']:.1f}/min)  "
+          f"p50 {c['convert_p50_s']:.2f}s  p99 {c['convert_p99_s']:.2f}s  "
+          f"{c['realtime_factor']:.1f}x realtime  states {c['states']}")
+
+    print(f"\n{'queue':<12} {'published':>9} {'delivered':>9} {'redeliv.':>9} {'dropped':>8} "
+          f"{'max depth':>9} {'wait p50':>10} {'wait p99':>10}")
+    for name, q in report["queues"].items():
+        print(f"{name:<12} {q['published']:>9} {q['delivered']:>9} {q['redelivered']:>9} {q['dropped']:>8} "
+              f"{q['max_depth']:>9} {q['wait']['p50_ms']:>8.0f}ms {q['wait']['p99_ms']:>8.0f}ms")
+
+    print(f"\n{'service':<12} {'calls':>7} {'cpu s':>8} {'cpu %':>7} {'busy s':>8} {'errors':>7}")
+    for name, s in report["services"].items():
+        print(f"{name:<12} {s['calls']:>7} {s['cpu_seconds']:>8.2f} {s['cpu_percent']:>6.1f}% "
+              f"{s['busy_seconds']:>8.2f} {s.get('errors', 0):>7}")
+    print(f"{'ffmpeg':<12} {'':>7} {report['ffmpeg_cpu_seconds']:>8.2f} "
+          f"{report['ffmpeg_cpu_seconds'] * 100 / report['elapsed']:>6.1f}%")
+
+    storage = ", ".join(
+        f"{bucket} {u['files']} files / {u['bytes'] / 1e6:.1f}MB" for bucket, u in report["storage"].items()
+    )
+    print(f"\nGridFS: {storage}")
+    print(f"auth db: {report['auth_db']['connections']} connections, {report['auth_db']['queries']} queries   "
+          f"smtp: {report['smtp']['messages']} messages over {report['smtp']['connections']} connections   "
+          f"peak RSS {report['peak_rss_mb']:.0f}MB")
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Throughput drops and latency rises beyond `tolerance` against an earlier --json report"""
+    problems = []
+    if baseline.get("config") != report["config"]:
+        print("\nNote: the baseline was run with a different configuration")
+
+    def check(label, now, was, higher_is_better):
+        if not was:
+            return
+        change = (now - was) / was
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            problems.append(f"{label}: {was} -> {now} ({change:+.0%})")
+
+    for op, now in report["operations"].items():
+        was = baseline.get("operations", {}).get(op)
+        if was:
+            check(f"{op} ops/s", now["ops_per_second"], was["ops_per_second"], True)
+            check(f"{op} p99 ms", now["p99_ms"], was["p99_ms"], False)
+            if now["errors"] > was["errors"]:
+                problems.append(f"{op} errors: {was['errors']} -> {now['errors']}")
+    check("upload -> notification p99 ms", report["end_to_end"]["p99_ms"],
+          baseline.get("end_to_end", {}).get("p99_ms"), False)
+    check("conversions/min", report["conversions"]["per_minute"],
+          baseline.get("conversions", {}).get("per_minute"), True)
+    return problems
+
+
+# ===================================================================================================
+# Main
+# ===================================================================================================
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=8, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation=weight,... (default %(default)s)")
+    parser.add_argument("--think-ms", type=float, default=100, help="mean pause between a user's operations")
+    parser.add_argument("--converters", type=int, default=2, help="converter workers")
+    parser.add_argument("--notifiers", type=int, default=1, help="notification senders (NOTIFY_CONCURRENCY)")
+    parser.add_argument("--video", help="video file to upload instead of a generated one")
+    parser.add_argument("--video-seconds", type=float, default=5, help="length of the generated video")
+    parser.add_argument("--trim-silence", action="store_true", help="ask for silence trimming on every upload")
+    parser.add_argument("--warmup", type=int, default=2, help="uploads converted before the clock starts")
+    parser.add_argument("--drain-timeout", type=float, default=300,
+                        help="seconds to wait for queued conversions once the load stops")
+    parser.add_argument("--timeout", type=float, default=60, help="HTTP request timeout")
+    parser.add_argument("--mysql-connect-ms", type=float, default=0, help="simulated MySQL connection setup")
+    parser.add_argument("--mysql-query-ms", type=float, default=0, help="simulated MySQL round trip")
+    parser.add_argument("--smtp-connect-ms", type=float, default=0, help="simulated SMTP handshake")
+    parser.add_argument("--smtp-command-ms", type=float, default=0, help="simulated SMTP round trip")
+    parser.add_argument("--log-level", default=os.environ.get("LOG_LEVEL", "ERROR"), help="services' LOG_LEVEL")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the report here")
+    parser.add_argument("--baseline", help="an earlier --json report to compare against; exits 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative change against the baseline")
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.users < 1 or args.converters < 1 or args.notifiers < 1:
+        parser.error("--users, --converters and --notifiers must be at least 1")
+
+    os.environ["LOG_LEVEL"] = args.log_level
+    for key, value in DEFAULT_ENV.items():
+        os.environ.setdefault(key, value)
+
+    if args.video:
+        with open(args.video, "rb") as f:
+            video = f.read()
+    else:
+        video = sample_video(args.video_seconds)
+
+    pipeline = Pipeline(args)
+    emails = [f"loadtest{i}@example.com" for i in range(args.users + 1)]
+    pipeline.mysql.seed_users([(email, PASSWORD) for email in emails])
+
+    # Downloads need MP3s to exist before the first one is attempted
+    warm = VirtualUser(pipeline, Recorder(), emails[-1], video, args, args.seed)
+    if not warm.login():
+        pipeline.close()
+        sys.exit(f"Warm-up login failed: {warm.recorder.statuses}")
+    for _ in range(max(args.warmup, 1)):
+        warm.upload()
+    if not pipeline.settle(args.drain_timeout) or not pipeline.tracker.fids:
+        pipeline.close()
+        sys.exit(f"Warm-up uploads were not converted: {warm.recorder.statuses}, errors {pipeline.errors()}")
+
+    for meter in pipeline.meters.values():
+        meter.reset()
+    pipeline.broker.reset_stats()
+    pipeline.tracker.reset()
+    warmup_jobs = {doc["_id"] for doc in pipeline.jobs.find({}, {"_id": 1})}
+    ffmpeg_cpu = children_cpu()
+    smtp = (pipeline.smtp.messages, pipeline.smtp.connections)
+    mysql = (pipeline.mysql.connects, pipeline.mysql.queries)
+
+    recorder = Recorder()
+    started = time.monotonic()
+    deadline = started + args.duration
+    users = [
+        threading.Thread(
+            target=VirtualUser(pipeline, recorder, emails[i], video, args, args.seed + i + 1).run,
+            args=(mix, deadline), name=f"user-{i}", daemon=True,
+        )
+        for i in range(args.users)
+    ]
+    for thread in users:
+        thread.start()
+    for thread in users:
+        thread.join()
+    load_elapsed = time.monotonic() - started
+
+    pipeline.settle(args.drain_timeout)
+    elapsed = time.monotonic() - started
+
+    services = {}
+    errors = pipeline.errors()
+    for name, meter in pipeline.meters.items():
+        services[name] = {
+            "calls": meter.calls,
+            "cpu_seconds": round(meter.cpu, 3),
+            "cpu_percent": round(meter.cpu * 100 / elapsed, 1),
+            "busy_seconds": round(meter.busy, 3),
+        }
+        if name in errors:
+            services[name]["errors"] = errors[name]
+
+    report = {
+        "config": {
+            "users": args.users, "duration": args.duration, "mix": args.mix, "think_ms": args.think_ms,
+            "converters": args.converters, "notifiers": args.notifiers, "trim_silence": args.trim_silence,
+            "video": args.video or f"{args.video_seconds:g}s generated video",
+        },
+        "elapsed": round(elapsed, 3),
+        "operations": recorder.report(load_elapsed),
+        "end_to_end": {**summarize(pipeline.tracker.latencies), "unfinished": pipeline.tracker.pending()},
+        "conversions": conversions(pipeline.jobs, warmup_jobs, elapsed),
+        "queues": {
+            name: {
+                "published": q.published, "delivered": q.delivered, "redelivered": q.redelivered,
+                "dropped": q.dropped, "max_depth": q.max_depth, "wait": summarize(q.waits),
+            }
+            for name, q in pipeline.broker.stats.items()
+        },
+        "services": services,
+        "ffmpeg_cpu_seconds": round(children_cpu() - ffmpeg_cpu, 3),
+        "storage": pipeline.mongo.gridfs_usage(),
+        "auth_db": {"connections": pipeline.mysql.connects - mysql[0], "queries": pipeline.mysql.queries - mysql[1]},
+        "smtp": {"messages": pipeline.smtp.messages - smtp[0], "connections": pipeline.smtp.connections - smtp[1]},
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    pipeline.close()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(report, json.load(f), args.tolerance)
+        if problems:
+            print("\nRegressions against the baseline:")
+            for problem in problems:
+                print(f"  {problem}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print(" [*] Interrupted")
+        sys.exit(0)
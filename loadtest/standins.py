@@ -0,0 +1,457 @@
+"""
+In-process stand-ins for the infrastructure the services talk to.
+
+    MongoStandIn   in-memory MongoDB (mongomock, with GridFS); the services' own
+                   databases share one client, extra shard URIs get their own
+    Broker         a RabbitMQ stand-in speaking the part of pika's blocking API the
+                   services use, consumers and acks included, with per-queue
+                   depth and wait statistics
+    MySQLStandIn   MySQLdb.connect() over a shared in-memory SQLite database,
+                   translating the few MySQL-only constructs the auth service uses
+
+The services import these as they would the real clients, so their own code
+paths (pooling, GridFS, message encoding, tracing headers) run unchanged.
+"""
+import collections, heapq, itertools, logging, re, sqlite3, threading, time, types, typing
+import mongomock, mongomock.gridfs
+from pymongo import uri_parser
+
+
+# ===================================================================================================
+# MongoDB
+# ===================================================================================================
+class MongoStandIn:
+    """
+    The services' own databases (gateway_db, mp3) live in `default`; every
+    other URI, e.g. an extra shard in VIDEO_SHARDS, is a deployment of its own.
+    """
+
+    def __init__(self):
+        mongomock.gridfs.enable_gridfs_integration()
+        self.default = mongomock.MongoClient()
+        self._clients: dict[str, mongomock.MongoClient] = {}
+        self._lock = threading.Lock()
+
+    def client(self, uri, *args, **kwargs) -> mongomock.MongoClient:
+        """Signature-compatible with pymongo.MongoClient(uri)"""
+        with self._lock:
+            if uri not in self._clients:
+                self._clients[uri] = mongomock.MongoClient(uri)
+            return self._clients[uri]
+
+    def gridfs_usage(self) -> dict:
+        """Files and bytes per GridFS bucket, over every client"""
+        usage = {}
+        clients = [("", self.default)]
+        for uri, client in self._clients.items():
+            host, port = uri_parser.parse_uri(uri)["nodelist"][0]
+            clients.append((f"{host}:{port}/", client))
+        for prefix, client in clients:
+            for db_name in client.list_database_names():
+                db = client[db_name]
+                for name in db.list_collection_names():
+                    if not name.endswith(".files"):
+                        continue
+                    files = list(db[name].find({}, {"length": 1}))
+                    usage[f"{prefix}{db_name}.{name[:-len('.files')]}"] = {
+                        "files": len(files),
+                        "bytes": sum(f.get("length", 0) for f in files),
+                    }
+        return usage
+
+
+# ===================================================================================================
+# RabbitMQ
+# ===================================================================================================
+class Delivery:
+    __slots__ = ("queue", "body", "properties", "published_at", "redelivered")
+
+    def __init__(self, queue, body, properties, published_at, redelivered=False):
+        self.queue = queue
+        self.body = body
+        self.properties = properties
+        self.published_at = published_at
+        self.redelivered = redelivered
+
+
+class QueueStats:
+    def __init__(self):
+        self.published = 0
+        self.delivered = 0
+        self.redelivered = 0
+        self.acked = 0
+        self.nacked = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.waits: list[float] = []
+
+
+class Broker:
+    """
+    Durable-less queues in memory, consumed through Connection and Channel the
+    way the services consume from RabbitMQ: basic_consume() callbacks run from
+    process_data_events() within the channel's prefetch window, and are settled
+    with basic_ack()/basic_nack(). A requeued message goes back to the head of
+    its queue, as RabbitMQ does. `on_ack` maps a queue to a function called with
+    each delivery acked from it.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queues: dict[str, collections.deque] = {}
+        self._unacked: dict[str, int] = {}
+        self.stats: dict[str, QueueStats] = {}
+        self.on_ack: dict[str, typing.Callable[[Delivery], None]] = {}
+        # Bumped on every change a waiting consumer may care about, so none is missed between checks
+        self.version = 0
+
+    def declare(self, queue: str):
+        with self._cond:
+            self._declare(queue)
+
+    def _declare(self, queue: str):
+        if queue not in self._queues:
+            self._queues[queue] = collections.deque()
+            self._unacked[queue] = 0
+            self.stats[queue] = QueueStats()
+
+    def publish(self, queue: str, body: bytes, properties=None):
+        with self._cond:
+            self._declare(queue)
+            self._queues[queue].append(Delivery(queue, body, properties, time.perf_counter()))
+            stats = self.stats[queue]
+            stats.published += 1
+            stats.max_depth = max(stats.max_depth, len(self._queues[queue]))
+            self._changed()
+
+    def get(self, queue: str) -> Delivery | None:
+        with self._cond:
+            self._declare(queue)
+            if not self._queues[queue]:
+                return None
+            delivery = self._queues[queue].popleft()
+            self._unacked[queue] += 1
+            stats = self.stats[queue]
+            stats.delivered += 1
+            if delivery.redelivered:
+                stats.redelivered += 1
+            else:
+                stats.waits.append(time.perf_counter() - delivery.published_at)
+            return delivery
+
+    def ack(self, delivery: Delivery):
+        with self._cond:
+            self._unacked[delivery.queue] -= 1
+            self.stats[delivery.queue].acked += 1
+            self._changed()
+        hook = self.on_ack.get(delivery.queue)
+        if hook:
+            hook(delivery)
+
+    def nack(self, delivery: Delivery, requeue: bool = True):
+        with self._cond:
+            self._unacked[delivery.queue] -= 1
+            stats = self.stats[delivery.queue]
+            stats.nacked += 1
+            if requeue:
+                delivery.redelivered = True
+                self._queues[delivery.queue].appendleft(delivery)
+            else:
+                stats.dropped += 1
+            self._changed()
+
+    def wait(self, since: int, timeout: float):
+        """Until `version` moves past `since` (a publish, settle or wake()), or `timeout`"""
+        with self._cond:
+            if self.version == since:
+                self._cond.wait(timeout)
+
+    def wake(self):
+        with self._cond:
+            self._changed()
+
+    def _changed(self):
+        self.version += 1
+        self._cond.notify_all()
+
+    def idle(self) -> bool:
+        """Nothing queued and nothing being worked on"""
+        with self._cond:
+            return not any(self._queues.values()) and not any(self._unacked.values())
+
+    def depth(self, queue: str) -> int:
+        with self._cond:
+            return len(self._queues.get(queue, ()))
+
+    def reset_stats(self):
+        with self._cond:
+            for queue in self.stats:
+                self.stats[queue] = QueueStats()
+
+    def connection(self, *args, **kwargs) -> "Connection":
+        """Signature-compatible with pika.BlockingConnection"""
+        return Connection(self)
+
+
+class Method:
+    """The part of pika's Basic.Deliver the services read"""
+    __slots__ = ("delivery_tag", "redelivered", "routing_key")
+
+    def __init__(self, delivery_tag: int, delivery: Delivery):
+        self.delivery_tag = delivery_tag
+        self.redelivered = delivery.redelivered
+        self.routing_key = delivery.queue
+
+
+class Channel:
+    def __init__(self, connection: "Connection"):
+        self.connection = connection
+        self.broker = connection.broker
+        self.is_open = True
+        self.prefetch = 0
+        self.consumers: dict[str, tuple[str, typing.Callable]] = {}
+        self.unacked: dict[int, Delivery] = {}
+        self._next_tag = 1
+
+    def queue_declare(self, queue: str, durable: bool = False, **kwargs):
+        self.broker.declare(queue)
+
+    def basic_qos(self, prefetch_count: int = 0, **kwargs):
+        self.prefetch = prefetch_count
+
+    def basic_publish(self, exchange: str, routing_key: str, body, properties=None, mandatory: bool = False):
+        # Only the default exchange is used, which routes by queue name
+        self.broker.publish(routing_key, body, properties)
+
+    def basic_consume(self, queue: str, on_message_callback, **kwargs) -> str:
+        self.broker.declare(queue)
+        consumer_tag = f"ctag-{len(self.consumers) + 1}"
+        self.consumers[consumer_tag] = (queue, on_message_callback)
+        return consumer_tag
+
+    def basic_cancel(self, consumer_tag: str):
+        self.consumers.pop(consumer_tag, None)
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False):
+        for tag in self._tags(delivery_tag, multiple):
+            self.broker.ack(self.unacked.pop(tag))
+
+    def basic_nack(self, delivery_tag: int, multiple: bool = False, requeue: bool = True):
+        for tag in self._tags(delivery_tag, multiple):
+            self.broker.nack(self.unacked.pop(tag), requeue)
+
+    def _tags(self, delivery_tag: int, multiple: bool) -> list[int]:
+        if multiple:
+            return [tag for tag in self.unacked if tag <= delivery_tag]
+        return [delivery_tag] if delivery_tag in self.unacked else []
+
+    def _dispatch(self) -> bool:
+        """Hand at most one delivery to each consumer the prefetch window has room for"""
+        dispatched = False
+        for queue, callback in list(self.consumers.values()):
+            if self.prefetch and len(self.unacked) >= self.prefetch:
+                break
+            delivery = self.broker.get(queue)
+            if delivery is None:
+                continue
+            tag, self._next_tag = self._next_tag, self._next_tag + 1
+            self.unacked[tag] = delivery
+            dispatched = True
+            try:
+                callback(self, Method(tag, delivery), delivery.properties, delivery.body)
+            except Exception:
+                # A real consumer would die here and the message be redelivered elsewhere
+                logging.getLogger("loadtest").exception("Consumer of %s raised", queue)
+                self.basic_nack(tag, requeue=False)
+        return dispatched
+
+    def close(self):
+        self.is_open = False
+
+
+class Connection:
+    """
+    Runs consumer callbacks, threadsafe callbacks and call_later timers on the
+    thread that calls process_data_events(), like pika's BlockingConnection.
+    """
+
+    def __init__(self, broker: Broker):
+        self.broker = broker
+        self.is_closed = False
+        self.channels: list[Channel] = []
+        self._lock = threading.Lock()
+        self._callbacks: collections.deque = collections.deque()
+        self._timers: list = []
+        self._timer_ids = itertools.count()
+
+    @property
+    def is_open(self) -> bool:
+        return not self.is_closed
+
+    def channel(self) -> Channel:
+        channel = Channel(self)
+        self.channels.append(channel)
+        return channel
+
+    def add_callback_threadsafe(self, callback):
+        with self._lock:
+            self._callbacks.append(callback)
+        self.broker.wake()
+
+    def call_later(self, delay: float, callback):
+        timer = (time.monotonic() + delay, next(self._timer_ids), callback)
+        heapq.heappush(self._timers, timer)
+        return timer
+
+    def remove_timeout(self, timer):
+        if timer in self._timers:
+            self._timers.remove(timer)
+            heapq.heapify(self._timers)
+
+    def process_data_events(self, time_limit: float = 0):
+        deadline = time.monotonic() + time_limit
+        while True:
+            version = self.broker.version
+            busy = self._run_callbacks()
+            for channel in self.channels:
+                busy = channel._dispatch() or busy
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if not busy:
+                if self._timers:
+                    remaining = min(remaining, max(self._timers[0][0] - time.monotonic(), 0))
+                self.broker.wait(version, remaining)
+
+    def _run_callbacks(self) -> bool:
+        ran = False
+        while self._timers and self._timers[0][0] <= time.monotonic():
+            heapq.heappop(self._timers)[2]()
+            ran = True
+        while True:
+            with self._lock:
+                if not self._callbacks:
+                    return ran
+                callback = self._callbacks.popleft()
+            callback()
+            ran = True
+
+    def close(self):
+        self.is_closed = True
+        # Whatever is still unacked goes back to its queue, as when a real connection drops
+        for channel in self.channels:
+            for tag in sorted(channel.unacked, reverse=True):
+                channel.basic_nack(tag, requeue=True)
+            channel.close()
+
+
+# ===================================================================================================
+# MySQL
+# ===================================================================================================
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT UNIQUE NOT NULL, password TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS revoked_tokens (version INTEGER PRIMARY KEY AUTOINCREMENT, jti TEXT UNIQUE NOT NULL, expires_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_expires_at ON revoked_tokens (expires_at)",
+]
+
+# MySQL-only syntax the auth service uses, in SQLite terms; DATETIMEs are kept as unix seconds
+_TRANSLATIONS = [
+    (re.compile(r"\bINSERT IGNORE\b", re.I), "INSERT OR IGNORE"),
+    (re.compile(r"\bINTERVAL\s+(\d+)\s+DAY\b", re.I), r"(\1 * 86400)"),
+    (re.compile(r"^(\s*DELETE\b.*?)\s+LIMIT\s+\d+\s*$", re.I | re.S), r"\1"),
+    (re.compile(r"%s"), "?"),
+]
+
+
+def translate(query: str) -> str:
+    for pattern, replacement in _TRANSLATIONS:
+        query = pattern.sub(replacement, query)
+    return query
+
+
+class MySQLStandIn:
+    """
+    A MySQLdb module stand-in. Statements are serialized with one lock, which
+    SQLite does anyway for writers; the simulated latency is spent outside it
+    so it overlaps between connections as a real server's would.
+    """
+
+    def __init__(self, name: str = "loadtest_auth", connect_latency: float = 0.0, query_latency: float = 0.0):
+        self.uri = f"file:{name}?mode=memory&cache=shared"
+        self.connect_latency = connect_latency
+        self.query_latency = query_latency
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.queries = 0
+        # A shared in-memory database disappears with its last connection
+        self._keeper = self._open()
+        for statement in SCHEMA:
+            self._keeper.execute(statement)
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False, isolation_level=None)
+        conn.create_function("NOW", 0, time.time)
+        conn.create_function("FROM_UNIXTIME", 1, lambda seconds: seconds)
+        conn.create_function("UNIX_TIMESTAMP", 1, lambda seconds: seconds)
+        return conn
+
+    def seed_users(self, users: list[tuple[str, str]]):
+        with self.lock:
+            self._keeper.executemany("INSERT OR IGNORE INTO users (email, password) VALUES (?, ?)", users)
+
+    def connect(self, **kwargs) -> "_Connection":
+        with self.lock:
+            self.connects += 1
+        if self.connect_latency:
+            time.sleep(self.connect_latency)
+        return _Connection(self, self._open())
+
+    def module(self) -> types.ModuleType:
+        """Something to install as sys.modules["MySQLdb"]"""
+        module = types.ModuleType("MySQLdb")
+        module.connect = self.connect
+        module.OperationalError = sqlite3.OperationalError
+        module.Error = sqlite3.Error
+        return module
+
+
+class _Connection:
+    def __init__(self, db: MySQLStandIn, conn: sqlite3.Connection):
+        self._db = db
+        self._conn = conn
+
+    def cursor(self) -> "_Cursor":
+        return _Cursor(self._db, self._conn.cursor())
+
+    def close(self):
+        self._conn.close()
+
+
+class _Cursor:
+    def __init__(self, db: MySQLStandIn, cursor: sqlite3.Cursor):
+        self._db = db
+        self._cursor = cursor
+        self._rows: list = []
+
+    def execute(self, query: str, args=()):
+        if self._db.query_latency:
+            time.sleep(self._db.query_latency)
+        with self._db.lock:
+            self._db.queries += 1
+            self._cursor.execute(translate(query), args)
+            self._rows = self._cursor.fetchall() if self._cursor.description else []
+        return len(self._rows) or self._cursor.rowcount
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        self._cursor.close()
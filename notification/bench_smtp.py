@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Notification throughput benchmark against the local SMTP sink.
+
+Compares opening a fresh session per message (what notify used to do) with
+reusing pooled sessions. Latency is added to the handshake and to every SMTP
+command to stand in for the network round trips and TLS setup of a real
+server:
+
+    python3 bench_smtp.py --messages 500 --connect-ms 40 --command-ms 5
+"""
+import argparse, time
+from email.message import EmailMessage
+
+from smtp_sink import SMTPSink
+from send.session import SMTPSessionPool
+
+
+def run(label, sink, messages, **pool_kwargs):
+    pool = SMTPSessionPool("bench@example.com", "secret", host="127.0.0.1", port=sink.port,
+                           starttls=False, **pool_kwargs)
+    start = time.perf_counter()
+    for i in range(messages):
+        msg = EmailMessage()
+        msg.set_content(f"Your MP3 file (ID: bench-{i}) is now ready for download!")
+        msg["Subject"] = "MP3 Download Ready"
+        msg["From"] = "bench@example.com"
+        msg["To"] = f"user{i}@example.com"
+        pool.send(msg, "bench@example.com", f"user{i}@example.com")
+    elapsed = time.perf_counter() - start
+    pool.close()
+
+    print(f"{label:<28} {messages / elapsed:>8.1f} msg/s   "
+          f"{elapsed / messages * 1000:7.2f} ms/msg   {pool.opened} sessions opened")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--connect-ms", type=float, default=40, help="simulated TCP + TLS handshake")
+    parser.add_argument("--command-ms", type=float, default=5, help="simulated round trip per SMTP command")
+    parser.add_argument("--max-messages", type=int, default=100, help="messages per pooled session")
+    args = parser.parse_args()
+
+    sink = SMTPSink(connect_latency=args.connect_ms / 1000, command_latency=args.command_ms / 1000).start()
+    print(f"{args.messages} messages, connect {args.connect_ms}ms, command {args.command_ms}ms\n")
+    try:
+        run("session per message", sink, args.messages, max_messages=1)
+        run(f"reused (recycle every {args.max_messages})", sink, args.messages, max_messages=args.max_messages)
+    finally:
+        sink.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,20 @@
-import pika, sys, os, time, json
-import logging
-from send import email
+import pika, sys, os, time, functools
+from send import transport
+import tracing, metrics, logsetup, messages
+from dispatch import ConcurrentDispatcher
+from digest import DigestBatcher, DIGEST_WINDOW_SECONDS, DIGEST_MAX_ITEMS
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+logger = logsetup.configure("notification")
+
+# Channels every completion event is delivered over, loaded in main()
+transports = [transport.EmailTransport()]
 
 def wait_for_rabbitmq(host, max_retries=30, delay=2):
     """Wait for RabbitMQ to be available with retries"""
     for attempt in range(max_retries):
         try:
-            logger.info(f"Attempting to connect to RabbitMQ at {host} (attempt {attempt + 1}/{max_retries})")
+            logger.info("Attempting to connect to RabbitMQ at %s (attempt %s/%s)", host, attempt + 1, max_retries)
             connection = pika.BlockingConnection(
                 pika.ConnectionParameters(
                     host=host,
@@ -25,9 +26,9 @@ def wait_for_rabbitmq(host, max_retries=30, delay=2):
             logger.info("Successfully connected to RabbitMQ")
             return True
         except Exception as e:
-            logger.warning(f"Failed to connect to RabbitMQ: {e}")
+            logger.warning("Failed to connect to RabbitMQ: %s", e)
             if attempt < max_retries - 1:
-                logger.info(f"Retrying in {delay} seconds...")
+                logger.info("Retrying in %s seconds...", delay)
                 time.sleep(delay)
             else:
                 logger.error("Max retries reached. RabbitMQ is not available.")
@@ -38,72 +39,116 @@ def setup_queue(channel, queue_name):
     """Setup queue with proper error handling"""
     try:
         channel.queue_declare(queue=queue_name, durable=True)
-        logger.info(f"Queue '{queue_name}' declared successfully")
+        logger.info("Queue '%s' declared successfully", queue_name)
         return True
     except Exception as e:
-        logger.error(f"Failed to declare queue '{queue_name}': {e}")
+        logger.error("Failed to declare queue '%s': %s", queue_name, e)
         return False
 
+def parse(body, properties=None):
+    """Decode and validate a message; None if it can never be processed"""
+    logger.debug("Received message (%d bytes)", len(body))
+
+    # Decoded exactly once; v1 "username" messages come back with "user_email" set
+    try:
+        message_data = messages.decode(
+            body,
+            properties.content_type if properties else None,
+            require=("mp3_fid", "user_email"),
+        )
+        logger.debug("Parsed message for job %s", message_data.get("job_id"))
+    except messages.MessageError as e:
+        logger.error("Invalid message: %s", e)
+        return None
+
+    tracing.record_queued(message_data.get("trace_id"), message_data, queue=os.environ.get("MP3_QUEUE", "mp3"))
+    metrics.observe_queue_wait(message_data)
+    return message_data
+
+def process(body, properties=None):
+    """
+    Validate a message and deliver its notification over every transport.
+
+    Returns (ack, requeue): whether the delivery succeeded and, if not,
+    whether it is worth delivering again.
+    """
+    message_data = parse(body, properties)
+    if message_data is None:
+        return False, False
+
+    receiver = message_data["user_email"]
+    try:
+        err = transport.deliver(transports, receiver, [message_data])
+        if err:
+            logger.error("Notification failed: %s", err)
+            return False, True
+        logger.info("Notification sent successfully")
+        return True, False
+    except Exception as e:
+        logger.error("Exception during notification: %s", e)
+        return False, True
+
 def callback(ch, method, properties, body):
     """Process incoming messages with proper error handling"""
     try:
-        logger.info(f"Received message: {body}")
-
-        # Validate message format
-        try:
-            message_data = json.loads(body)
-            logger.info(f"Parsed message: {message_data}")
-        except json.JSONDecodeError as e:
-            logger.error(f"Invalid JSON message: {e}")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-            return
-
-        # Validate required fields - handle both username and user_email
-        if 'mp3_fid' not in message_data:
-            logger.error("Missing required field 'mp3_fid' in message")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-            return
-
-        # Check for either username or user_email
-        if 'username' not in message_data and 'user_email' not in message_data:
-            logger.error("Missing email field - neither 'username' nor 'user_email' found in message")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-            return
-
-        # Attempt to send email notification
-        try:
-            err = email.notify(body)
-            if err:
-                logger.error(f"Email notification failed: {err}")
-                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-            else:
-                logger.info("Email notification sent successfully")
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-        except Exception as e:
-            logger.error(f"Exception during email notification: {e}")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-
+        ack, requeue = process(body, properties)
+        if ack:
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+        else:
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=requeue)
     except Exception as e:
-        logger.error(f"Unexpected error in callback: {e}")
+        logger.error("Unexpected error in callback: %s", e)
         try:
             ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
         except:
             logger.error("Failed to nack message")
 
+def prefetch_count(concurrency):
+    """Deliveries the channel may hold unacked for the consumer() of this concurrency"""
+    # Digests hold deliveries unacked while a batch is open, so they need room for at least one full batch
+    digest = DIGEST_WINDOW_SECONDS > 0
+    if not digest and concurrency == 1:
+        return 1
+    default_prefetch = max(concurrency * 2, DIGEST_MAX_ITEMS * 2) if digest else concurrency * 2
+    return max(concurrency, int(os.environ.get("NOTIFY_PREFETCH", str(default_prefetch))))
+
+def consumer(connection, channel, concurrency):
+    """
+    The on_message callback for the configured mode, and the dispatcher behind
+    it (None for the one-at-a-time callback), to be shut down before the
+    connection closes.
+    """
+    if DIGEST_WINDOW_SECONDS > 0:
+        dispatcher = DigestBatcher(connection, channel, parse, functools.partial(transport.deliver, transports),
+                                   workers=concurrency)
+        logger.info("Digest mode: %ss window, up to %s files per email", DIGEST_WINDOW_SECONDS, DIGEST_MAX_ITEMS)
+        return dispatcher.on_message, dispatcher
+    if concurrency > 1:
+        dispatcher = ConcurrentDispatcher(connection, channel, process, concurrency)
+        logger.info("Concurrent mode: %s senders", concurrency)
+        return dispatcher.on_message, dispatcher
+    return callback, None
+
 def main():
     # Log startup information
     logger.info("Starting notification service...")
-    logger.info(f"Python version: {sys.version}")
-    logger.info(f"Environment variables:")
-    logger.info(f"  MP3_QUEUE: {os.environ.get('MP3_QUEUE', 'mp3')}")
-    logger.info(f"  GMAIL_ADDRESS: {os.environ.get('GMAIL_ADDRESS', 'Not set')}")
-    logger.info(f"  GMAIL_PASSWORD: {'Set' if os.environ.get('GMAIL_PASSWORD') else 'Not set'}")
+    logger.info("Python version: %s", sys.version)
+    logger.info("Environment variables:")
+    logger.info("  MP3_QUEUE: %s", os.environ.get('MP3_QUEUE', 'mp3'))
+    logger.info("  GMAIL_ADDRESS: %s", os.environ.get('GMAIL_ADDRESS', 'Not set'))
+    logger.info("  GMAIL_PASSWORD: %s", 'Set' if os.environ.get('GMAIL_PASSWORD') else 'Not set')
+    logger.info("  NOTIFY_TRANSPORTS: %s", transport.NOTIFY_TRANSPORTS)
+
+    transports[:] = transport.load()
 
     rabbitmq_host = os.environ.get("RABBITMQ_HOST", "rabbitmq")
     queue_name = os.environ.get("MP3_QUEUE", "mp3")
+    # Emails sent in parallel; 1 keeps the original one-at-a-time consumer
+    concurrency = max(1, int(os.environ.get("NOTIFY_CONCURRENCY", "1")))
+    prefetch = prefetch_count(concurrency)
 
-    logger.info(f"Configured RabbitMQ host: {rabbitmq_host}")
-    logger.info(f"Configured queue name: {queue_name}")
+    logger.info("Configured RabbitMQ host: %s", rabbitmq_host)
+    logger.info("Configured queue name: %s", queue_name)
 
     # Wait for RabbitMQ to be available
     if not wait_for_rabbitmq(rabbitmq_host):
@@ -112,6 +157,7 @@ def main():
 
     connection = None
     channel = None
+    dispatcher = None
 
     try:
         # Establish connection
@@ -128,22 +174,27 @@ def main():
         channel = connection.channel()
         logger.info("RabbitMQ connection established")
 
+        metrics.serve(rabbitmq_host, [queue_name])
+        logger.info("Metrics served on :%s/metrics", metrics.METRICS_PORT)
+
         # Setup queue
         if not setup_queue(channel, queue_name):
             logger.error("Failed to setup queue. Exiting.")
             sys.exit(1)
 
         # Configure QoS
-        channel.basic_qos(prefetch_count=1)
-        logger.info("QoS configured: prefetch_count=1")
+        channel.basic_qos(prefetch_count=prefetch)
+        logger.info("QoS configured: prefetch_count=%s", prefetch)
 
         # Setup consumer
+        on_message, dispatcher = consumer(connection, channel, concurrency)
+
         channel.basic_consume(
             queue=queue_name,
-            on_message_callback=callback
+            on_message_callback=on_message
         )
 
-        logger.info(f"Waiting for messages on queue '{queue_name}'. To exit press CTRL+C")
+        logger.info("Waiting for messages on queue '%s'. To exit press CTRL+C", queue_name)
 
         # Start consuming
         try:
@@ -151,15 +202,20 @@ def main():
         except KeyboardInterrupt:
             logger.info("Received keyboard interrupt. Stopping consumer...")
             channel.stop_consuming()
+            if dispatcher:
+                dispatcher.shutdown()
+            for t in transports:
+                t.close()
+            tracing.flush()
 
     except pika.exceptions.AMQPConnectionError as e:
-        logger.error(f"AMQP Connection Error: {e}")
+        logger.error("AMQP Connection Error: %s", e)
         sys.exit(1)
     except pika.exceptions.AMQPChannelError as e:
-        logger.error(f"AMQP Channel Error: {e}")
+        logger.error("AMQP Channel Error: %s", e)
         sys.exit(1)
     except Exception as e:
-        logger.error(f"Unexpected error in main: {e}")
+        logger.error("Unexpected error in main: %s", e)
         sys.exit(1)
     finally:
         # Cleanup
@@ -171,7 +227,7 @@ def main():
                 connection.close()
                 logger.info("Connection closed")
         except Exception as e:
-            logger.error(f"Error during cleanup: {e}")
+            logger.error("Error during cleanup: %s", e)
 
 if __name__ == "__main__":
     try:
@@ -180,5 +236,5 @@ if __name__ == "__main__":
         logger.info("Service interrupted by user")
         sys.exit(0)
     except Exception as e:
-        logger.error(f"Fatal error: {e}")
+        logger.error("Fatal error: %s", e)
         sys.exit(1)
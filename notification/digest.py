@@ -0,0 +1,129 @@
+import functools, logging, os
+from concurrent.futures import ThreadPoolExecutor
+from dispatch import AckTracker
+
+logger = logging.getLogger(__name__)
+
+# Completion events for one user are collected for this long before a digest goes out; 0 disables digests
+DIGEST_WINDOW_SECONDS = float(os.environ.get("DIGEST_WINDOW_SECONDS", "0"))
+# A digest is sent early once it lists this many files
+DIGEST_MAX_ITEMS = int(os.environ.get("DIGEST_MAX_ITEMS", "50"))
+# A failed digest is held this long before its messages are requeued, doubling per consecutive failure
+DIGEST_RETRY_DELAY_SECONDS = float(os.environ.get("DIGEST_RETRY_DELAY_SECONDS", "5"))
+DIGEST_RETRY_MAX_DELAY_SECONDS = float(os.environ.get("DIGEST_RETRY_MAX_DELAY_SECONDS", "300"))
+
+
+class _Batch:
+    __slots__ = ("receiver", "tags", "events", "timer")
+
+    def __init__(self, receiver):
+        self.receiver = receiver
+        self.tags = []
+        self.events = []
+        self.timer = None
+
+
+class DigestBatcher:
+    """
+    Groups completion events per recipient and delivers each group at once,
+    as a single digest email.
+
+    Deliveries stay unacked while their batch is open; they are acked only once
+    the digest has been delivered, or nacked for redelivery if it could not be.
+    Failed deliveries are held for a backoff delay before they are requeued, so
+    a mail server that stays down does not turn into a redelivery loop; while
+    they are held they fill the prefetch window, which pauses consumption.
+    Collection and settling happen on the connection thread, the SMTP exchange
+    on a small sender pool.
+    """
+
+    def __init__(self, connection, channel, parse, send_digest, window=DIGEST_WINDOW_SECONDS,
+                 max_items=DIGEST_MAX_ITEMS, workers=1, retry_delay=DIGEST_RETRY_DELAY_SECONDS,
+                 max_retry_delay=DIGEST_RETRY_MAX_DELAY_SECONDS):
+        self.connection = connection
+        self.tracker = AckTracker(channel)
+        self.parse = parse
+        self.send_digest = send_digest
+        self.window = window
+        self.max_items = max(max_items, 1)
+        self.executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="digest")
+        self.batches: dict[str, _Batch] = {}
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.failures = 0
+
+    def on_message(self, ch, method, properties, body):
+        tag = method.delivery_tag
+        self.tracker.track(tag)
+
+        message_data = self.parse(body, properties)
+        if message_data is None:
+            self.tracker.settle(tag, False, requeue=False)
+            return
+
+        receiver = message_data.get("user_email")
+        if not receiver or not message_data.get("mp3_fid"):
+            self.tracker.settle(tag, False, requeue=False)
+            return
+
+        key = receiver.lower()
+        batch = self.batches.get(key)
+        if batch is None:
+            batch = self.batches[key] = _Batch(receiver)
+            batch.timer = self.connection.call_later(self.window, functools.partial(self.flush, key, True))
+
+        batch.tags.append(tag)
+        batch.events.append(message_data)
+        if len(batch.tags) >= self.max_items:
+            self.flush(key)
+
+    def flush(self, key: str, timed_out: bool = False):
+        batch = self.batches.pop(key, None)
+        if batch is None:
+            return
+        if not timed_out:
+            self.connection.remove_timeout(batch.timer)
+
+        logger.info("Flushing digest for %s: %s message(s)", batch.receiver, len(batch.tags))
+        self.executor.submit(self._send, batch)
+
+    def _send(self, batch: _Batch):
+        receiver = batch.receiver
+        try:
+            # A redelivered message must not list the same file twice
+            events = list({e["mp3_fid"]: e for e in batch.events}.values())
+            err = self.send_digest(receiver, events)
+        except Exception as e:
+            err = f"Unexpected error sending digest: {e}"
+        if err:
+            logger.error("Digest for %s failed, requeueing %s message(s): %s", receiver, len(batch.tags), err)
+
+        try:
+            self.connection.add_callback_threadsafe(functools.partial(self._settle, batch.tags, not err))
+        except Exception as e:
+            # The connection is gone; the broker will redeliver the messages
+            logger.error("Could not settle digest for %s: %s", receiver, e)
+
+    def _settle(self, tags: list, delivered: bool):
+        if not delivered:
+            self.failures += 1
+            delay = min(self.retry_delay * 2 ** (self.failures - 1), self.max_retry_delay)
+            logger.info("Requeueing %s message(s) in %.1fs", len(tags), delay)
+            self.connection.call_later(delay, functools.partial(self._requeue, tags))
+            return
+
+        self.failures = 0
+        for tag in tags:
+            self.tracker.settle(tag, True)
+
+    def _requeue(self, tags: list):
+        for tag in tags:
+            self.tracker.settle(tag, False, requeue=True)
+
+    def shutdown(self):
+        """Send every open batch now and settle them before the connection closes"""
+        for key in list(self.batches):
+            self.flush(key)
+        self.executor.shutdown(wait=True)
+        if self.connection.is_open:
+            self.connection.process_data_events(time_limit=0)
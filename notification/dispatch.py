@@ -0,0 +1,91 @@
+import functools, logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class AckTracker:
+    """
+    Settles deliveries in the order they were received.
+
+    Outcomes may arrive in any order; they are held until every earlier
+    delivery has settled, and then runs of acks are sent as a single
+    basic_ack(multiple=True). Must only be used from the connection thread.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.pending: OrderedDict[int, tuple[bool, bool] | None] = OrderedDict()
+
+    def track(self, tag: int):
+        self.pending[tag] = None
+
+    def settle(self, tag: int, ack: bool, requeue: bool = False):
+        if tag not in self.pending:
+            return
+        self.pending[tag] = (ack, requeue)
+        self.flush()
+
+    def flush(self):
+        last_ack = None
+        while self.pending:
+            tag, outcome = next(iter(self.pending.items()))
+            if outcome is None:
+                break
+            del self.pending[tag]
+
+            ack, requeue = outcome
+            if ack:
+                last_ack = tag
+                continue
+
+            if last_ack is not None:
+                self.channel.basic_ack(delivery_tag=last_ack, multiple=True)
+                last_ack = None
+            self.channel.basic_nack(delivery_tag=tag, requeue=requeue)
+
+        if last_ack is not None:
+            self.channel.basic_ack(delivery_tag=last_ack, multiple=True)
+
+
+class ConcurrentDispatcher:
+    """
+    Runs a blocking handler for each delivery on a bounded thread pool.
+
+    pika's BlockingConnection is not thread safe, so workers never touch the
+    channel: each outcome is handed back to the connection thread with
+    add_callback_threadsafe and settled there through an AckTracker. The
+    number of deliveries in flight is bounded by the channel's prefetch.
+    """
+
+    def __init__(self, connection, channel, handler, workers: int):
+        self.connection = connection
+        self.tracker = AckTracker(channel)
+        self.handler = handler
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="notify")
+
+    def on_message(self, ch, method, properties, body):
+        self.tracker.track(method.delivery_tag)
+        self.executor.submit(self._work, method.delivery_tag, body, properties)
+
+    def _work(self, tag: int, body, properties):
+        try:
+            ack, requeue = self.handler(body, properties)
+        except Exception as e:
+            logger.error("Unexpected error handling delivery %s: %s", tag, e)
+            ack, requeue = False, True
+
+        try:
+            self.connection.add_callback_threadsafe(
+                functools.partial(self.tracker.settle, tag, ack, requeue)
+            )
+        except Exception as e:
+            # The connection is gone; the broker will redeliver the message
+            logger.error("Could not settle delivery %s: %s", tag, e)
+
+    def shutdown(self):
+        """Let in-flight deliveries finish and settle them before the connection closes"""
+        self.executor.shutdown(wait=True)
+        if self.connection.is_open:
+            self.connection.process_data_events(time_limit=0)
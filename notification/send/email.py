@@ -1,8 +1,10 @@
-import smtplib, os, json
+import smtplib, os
 import logging
 from email.message import EmailMessage
 import socket
-import ssl
+import ssl, time
+from send import session
+import metrics, messages
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -23,25 +25,28 @@ def validate_email_config():
 def notify(message):
     """Send email notification with comprehensive error handling"""
     try:
-        logger.info("Starting email notification process")
+        logger.debug("Starting email notification process")
 
         # Validate email configuration
         config_valid, config_message = validate_email_config()
         if not config_valid:
-            logger.warning(f"Email configuration issue: {config_message}")
+            logger.warning("Email configuration issue: %s", config_message)
             logger.info("Skipping email notification due to configuration issues")
             return None  # Don't fail the message processing for config issues
 
-        # Parse message
-        try:
-            if isinstance(message, bytes):
-                message = message.decode('utf-8')
-            message_data = json.loads(message)
-            logger.info(f"Parsed message data: {message_data}")
-        except (json.JSONDecodeError, UnicodeDecodeError) as e:
-            error_msg = f"Failed to parse message: {e}"
-            logger.error(error_msg)
-            return error_msg
+        # Callers that already decoded the message pass the dict, so it is not parsed twice
+        if isinstance(message, dict):
+            message_data = message
+        else:
+            try:
+                if isinstance(message, str):
+                    message = message.encode('utf-8')
+                message_data = messages.decode(message)
+                logger.debug("Parsed message for job %s", message_data.get("job_id"))
+            except messages.MessageError as e:
+                error_msg = f"Failed to parse message: {e}"
+                logger.error(error_msg)
+                return error_msg
 
         # Extract required fields
         try:
@@ -59,93 +64,104 @@ def notify(message):
             logger.error(error_msg)
             return error_msg
 
-        # Get email credentials
-        sender_address = os.environ.get("GMAIL_ADDRESS")
-        sender_password = os.environ.get("GMAIL_PASSWORD")
-
-        logger.info(f"Sending notification to {receiver_address} for mp3_fid: {mp3_fid}")
-
-        # Create email message
-        try:
-            msg = EmailMessage()
-            msg.set_content(f"Your MP3 file (ID: {mp3_fid}) is now ready for download!")
-            msg["Subject"] = "MP3 Download Ready"
-            msg["From"] = sender_address
-            msg["To"] = receiver_address
-            logger.info("Email message created successfully")
-        except Exception as e:
-            error_msg = f"Failed to create email message: {e}"
-            logger.error(error_msg)
-            return error_msg
-
-        # Send email
-        session = None
-        try:
-            # Create SMTP session with timeout
-            logger.info("Connecting to Gmail SMTP server...")
-            session = smtplib.SMTP("smtp.gmail.com", 587, timeout=30)
-
-            # Enable TLS encryption
-            logger.info("Starting TLS encryption...")
-            session.starttls()
+        logger.info("Sending notification to %s for mp3_fid: %s", receiver_address, mp3_fid)
+        return send(receiver_address, "MP3 Download Ready", f"Your MP3 file (ID: {mp3_fid}) is now ready for download!")
 
-            # Login to Gmail
-            logger.info("Logging in to Gmail...")
-            session.login(sender_address, sender_password)
+    except Exception as e:
+        error_msg = f"Unexpected error in notify function: {e}"
+        logger.error(error_msg)
+        return error_msg
 
-            # Send email
-            logger.info("Sending email...")
-            session.send_message(msg, sender_address, receiver_address)
+def notify_digest(receiver_address, mp3_fids):
+    """Send one email covering several completed conversions for the same user"""
+    try:
+        config_valid, config_message = validate_email_config()
+        if not config_valid:
+            logger.warning("Email configuration issue: %s", config_message)
+            logger.info("Skipping digest notification due to configuration issues")
+            return None
+
+        if len(mp3_fids) == 1:
+            return send(receiver_address, "MP3 Download Ready", f"Your MP3 file (ID: {mp3_fids[0]}) is now ready for download!")
+
+        logger.info("Sending digest to %s for %s files", receiver_address, len(mp3_fids))
+        lines = "\n".join(f"  - {fid}" for fid in mp3_fids)
+        return send(
+            receiver_address,
+            f"{len(mp3_fids)} MP3 Downloads Ready",
+            f"Your MP3 files are now ready for download:\n\n{lines}\n",
+        )
+    except Exception as e:
+        error_msg = f"Unexpected error in notify_digest function: {e}"
+        logger.error(error_msg)
+        return error_msg
 
-            logger.info(f"Email sent successfully to {receiver_address}")
-            return None  # Success
+def send(receiver_address, subject, content):
+    """Send one email; returns an error message or None"""
+    # Get email credentials
+    sender_address = os.environ.get("GMAIL_ADDRESS")
+    sender_password = os.environ.get("GMAIL_PASSWORD")
 
-        except smtplib.SMTPAuthenticationError as e:
-            error_msg = f"SMTP Authentication failed: {e}. Check Gmail credentials and app password."
-            logger.error(error_msg)
-            return error_msg
-        except smtplib.SMTPRecipientsRefused as e:
-            error_msg = f"Recipient refused: {e}. Invalid recipient email address."
-            logger.error(error_msg)
-            return error_msg
-        except smtplib.SMTPServerDisconnected as e:
-            error_msg = f"SMTP server disconnected: {e}"
-            logger.error(error_msg)
-            return error_msg
-        except smtplib.SMTPException as e:
-            error_msg = f"SMTP error occurred: {e}"
-            logger.error(error_msg)
-            return error_msg
-        except socket.timeout as e:
-            error_msg = f"Connection timeout: {e}"
-            logger.error(error_msg)
-            return error_msg
-        except socket.gaierror as e:
-            error_msg = f"DNS resolution failed: {e}"
-            logger.error(error_msg)
-            return error_msg
-        except ConnectionRefusedError as e:
-            error_msg = f"Connection refused: {e}"
-            logger.error(error_msg)
-            return error_msg
-        except ssl.SSLError as e:
-            error_msg = f"SSL error: {e}"
-            logger.error(error_msg)
-            return error_msg
-        except Exception as e:
-            error_msg = f"Unexpected error during email sending: {e}"
-            logger.error(error_msg)
-            return error_msg
-        finally:
-            # Always close the session
-            if session:
-                try:
-                    session.quit()
-                    logger.info("SMTP session closed")
-                except Exception as e:
-                    logger.warning(f"Error closing SMTP session: {e}")
+    # Create email message
+    try:
+        msg = EmailMessage()
+        msg.set_content(content)
+        msg["Subject"] = subject
+        msg["From"] = sender_address
+        msg["To"] = receiver_address
+        logger.debug("Email message created successfully")
+    except Exception as e:
+        error_msg = f"Failed to create email message: {e}"
+        logger.error(error_msg)
+        return error_msg
 
+    # Send email over a pooled, already authenticated session when there is one
+    started = time.perf_counter()
+    try:
+        logger.debug("Sending email...")
+        try:
+            session.get_pool(sender_address, sender_password).send(msg, sender_address, receiver_address)
+        except Exception:
+            metrics.SMTP_SEND_SECONDS.labels("error").observe(time.perf_counter() - started)
+            raise
+        metrics.SMTP_SEND_SECONDS.labels("ok").observe(time.perf_counter() - started)
+        logger.info("Email sent successfully to %s", receiver_address)
+        return None  # Success
+
+    except smtplib.SMTPAuthenticationError as e:
+        error_msg = f"SMTP Authentication failed: {e}. Check Gmail credentials and app password."
+        logger.error(error_msg)
+        return error_msg
+    except smtplib.SMTPRecipientsRefused as e:
+        error_msg = f"Recipient refused: {e}. Invalid recipient email address."
+        logger.error(error_msg)
+        return error_msg
+    except smtplib.SMTPServerDisconnected as e:
+        error_msg = f"SMTP server disconnected: {e}"
+        logger.error(error_msg)
+        return error_msg
+    except smtplib.SMTPException as e:
+        error_msg = f"SMTP error occurred: {e}"
+        logger.error(error_msg)
+        return error_msg
+    except socket.timeout as e:
+        error_msg = f"Connection timeout: {e}"
+        logger.error(error_msg)
+        return error_msg
+    except socket.gaierror as e:
+        error_msg = f"DNS resolution failed: {e}"
+        logger.error(error_msg)
+        return error_msg
+    except ConnectionRefusedError as e:
+        error_msg = f"Connection refused: {e}"
+        logger.error(error_msg)
+        return error_msg
+    except ssl.SSLError as e:
+        error_msg = f"SSL error: {e}"
+        logger.error(error_msg)
+        return error_msg
     except Exception as e:
-        error_msg = f"Unexpected error in notify function: {e}"
+        error_msg = f"Unexpected error during email sending: {e}"
         logger.error(error_msg)
         return error_msg
+
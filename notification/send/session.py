@@ -0,0 +1,149 @@
+import os, queue, smtplib, threading, time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "true").lower() == "true"
+SMTP_TIMEOUT = float(os.environ.get("SMTP_TIMEOUT", "30"))
+# Authenticated sessions kept open; one per concurrent sender is enough
+SMTP_POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE", os.environ.get("NOTIFY_CONCURRENCY", "1")))
+# Sessions are closed and reopened after this many messages
+SMTP_MAX_MESSAGES = int(os.environ.get("SMTP_MAX_MESSAGES_PER_SESSION", "100"))
+# Sessions idle for longer than this are checked with NOOP before reuse
+SMTP_NOOP_AFTER = float(os.environ.get("SMTP_NOOP_AFTER", "30"))
+
+
+class _Session:
+    __slots__ = ("smtp", "messages", "last_used")
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.messages = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPSessionPool:
+    """
+    Keeps authenticated SMTP sessions open across messages.
+
+    A session is only opened (connect, STARTTLS, login) when no idle one is
+    available. Idle sessions are probed with NOOP before reuse, replaced when
+    the server has dropped them, and recycled after `max_messages` so no
+    session lives long enough to hit the server's own limits.
+    """
+
+    def __init__(self, user, password, host=SMTP_HOST, port=SMTP_PORT, starttls=SMTP_STARTTLS,
+                 size=SMTP_POOL_SIZE, max_messages=SMTP_MAX_MESSAGES, noop_after=SMTP_NOOP_AFTER,
+                 timeout=SMTP_TIMEOUT):
+        self.user = user
+        self.password = password
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.max_messages = max(max_messages, 1)
+        self.noop_after = noop_after
+        self.timeout = timeout
+        self.opened = 0
+        self._slots = threading.BoundedSemaphore(max(size, 1))
+        self._idle = queue.LifoQueue()
+
+    def send(self, msg, from_addr, to_addrs):
+        """Send one message, reconnecting once if a reused session turns out to be dead"""
+        reused = False
+        try:
+            with self.session() as s:
+                reused = s.messages > 0
+                s.smtp.send_message(msg, from_addr, to_addrs)
+                s.messages += 1
+        except smtplib.SMTPServerDisconnected:
+            if not reused:
+                raise
+            logger.info("SMTP session was dropped by the server, reconnecting")
+            with self.session() as s:
+                s.smtp.send_message(msg, from_addr, to_addrs)
+                s.messages += 1
+
+    @contextmanager
+    def session(self):
+        self._slots.acquire()
+        s = None
+        try:
+            s = self._checkout()
+            yield s
+        except Exception:
+            # A failed exchange leaves the session in an unknown state
+            if s:
+                self._discard(s)
+                s = None
+            raise
+        finally:
+            if s:
+                if s.messages >= self.max_messages:
+                    self._discard(s)
+                else:
+                    s.last_used = time.monotonic()
+                    self._idle.put(s)
+            self._slots.release()
+
+    def _checkout(self) -> _Session:
+        while True:
+            try:
+                s = self._idle.get_nowait()
+            except queue.Empty:
+                return self._open()
+
+            if time.monotonic() - s.last_used > self.noop_after and not self._alive(s):
+                self._discard(s)
+                continue
+            return s
+
+    def _open(self) -> _Session:
+        logger.info("Connecting to SMTP server %s:%s...", self.host, self.port)
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.user:
+                smtp.login(self.user, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self.opened += 1
+        return _Session(smtp)
+
+    def _alive(self, s: _Session) -> bool:
+        try:
+            return s.smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _discard(self, s: _Session):
+        try:
+            s.smtp.quit()
+        except Exception:
+            s.smtp.close()
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(user, password) -> SMTPSessionPool:
+    """The process-wide session pool, created on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None or (_pool.user, _pool.password) != (user, password):
+            if _pool:
+                _pool.close()
+            _pool = SMTPSessionPool(user, password)
+        return _pool
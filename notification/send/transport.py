@@ -0,0 +1,75 @@
+import abc, os, time
+import logging
+from send import email
+import tracing, metrics
+
+logger = logging.getLogger(__name__)
+
+# Comma separated channels completion events are delivered over
+NOTIFY_TRANSPORTS = os.environ.get("NOTIFY_TRANSPORTS", "email")
+
+
+class Transport(abc.ABC):
+    """
+    A channel completion events are delivered over.
+
+    deliver() receives every pending event for one recipient and returns an
+    error message or None. A message is only acked once every `required`
+    transport has delivered it; failures of optional transports are logged.
+    """
+    name = "transport"
+    required = True
+
+    @abc.abstractmethod
+    def deliver(self, receiver, events):
+        ...
+
+    def close(self):
+        pass
+
+
+class EmailTransport(Transport):
+    name = "email"
+
+    def deliver(self, receiver, events):
+        return email.notify_digest(receiver, [e["mp3_fid"] for e in events])
+
+
+def load(names=NOTIFY_TRANSPORTS):
+    transports = []
+    for name in (n.strip() for n in names.split(",")):
+        if name == "email":
+            transports.append(EmailTransport())
+        elif name == "webhook":
+            # Only pull in pymongo / requests when webhooks are actually enabled
+            from send import webhook
+            transports.append(webhook.WebhookTransport(webhook.WebhookRegistry.from_env()))
+        elif name:
+            raise ValueError(f"unknown notification transport '{name}'")
+    return transports
+
+
+def deliver(transports, receiver, events):
+    """Deliver over every transport; returns the first required transport's error, if any"""
+    err = None
+    for t in transports:
+        start = time.time()
+        try:
+            terr = t.deliver(receiver, events)
+        except Exception as e:
+            terr = f"Unexpected error in {t.name} transport: {e}"
+
+        # One send span per traced event, so digests show up in every trace they cover
+        end = time.time()
+        metrics.DELIVERY_SECONDS.labels(t.name).observe(end - start)
+        metrics.DELIVERIES.labels(t.name, "error" if terr else "ok").inc()
+        for e in events:
+            attrs = {"transport": t.name, "batch": len(events), **({"error": terr} if terr else {})}
+            tracing.record(e.get("trace_id"), "send", start, end, **attrs)
+        if not terr:
+            continue
+        if t.required:
+            err = err or terr
+        else:
+            logger.warning("Optional %s delivery to %s failed: %s", t.name, receiver, terr)
+    return err
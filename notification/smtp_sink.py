@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+A local SMTP stand-in that accepts and discards mail.
+
+It speaks just enough SMTP for smtplib (EHLO, AUTH PLAIN/LOGIN, MAIL, RCPT,
+DATA, NOOP, RSET, QUIT) and can add latency to the connection handshake and
+to every command, so benchmarks see realistic round-trip costs without
+touching a real mail server. Run it standalone for local development:
+
+    python3 smtp_sink.py --port 2525
+    SMTP_HOST=127.0.0.1 SMTP_PORT=2525 SMTP_STARTTLS=false python3 consumer.py
+"""
+import argparse, socketserver, threading, time
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, connect_latency=0.0, command_latency=0.0):
+        super().__init__((host, port), _Handler)
+        self.connect_latency = connect_latency
+        self.command_latency = command_latency
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+        self.recipients: list[str] = []
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> "SMTPSink":
+        threading.Thread(target=self.serve_forever, name="smtp-sink", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, line: str):
+        if self.server.command_latency:
+            time.sleep(self.server.command_latency)
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        if server.connect_latency:
+            time.sleep(server.connect_latency)
+        self.reply("220 sink ESMTP ready")
+
+        rcpts = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.decode(errors="replace").strip()
+            verb = cmd.split(" ", 1)[0].upper()
+
+            if verb in ("EHLO", "HELO"):
+                self.wfile.write(b"250-sink\r\n250-AUTH PLAIN LOGIN\r\n250-8BITMIME\r\n")
+                self.reply("250 SMTPUTF8")
+            elif verb == "AUTH":
+                parts = cmd.split()
+                if parts[1].upper() == "LOGIN":
+                    for prompt in ("VXNlcm5hbWU6", "UGFzc3dvcmQ6"):
+                        self.reply(f"334 {prompt}")
+                        self.rfile.readline()
+                elif len(parts) == 2:
+                    self.reply("334 ")
+                    self.rfile.readline()
+                self.reply("235 2.7.0 Authentication successful")
+            elif verb == "MAIL":
+                rcpts = []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                rcpts.append(cmd.split(":", 1)[-1].strip(" <>"))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                with server.lock:
+                    server.messages += 1
+                    server.recipients.extend(rcpts)
+                self.reply("250 OK queued")
+            elif verb in ("NOOP", "RSET"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local SMTP sink")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--connect-ms", type=float, default=0)
+    parser.add_argument("--command-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    sink = SMTPSink(args.host, args.port, args.connect_ms / 1000, args.command_ms / 1000)
+    print(f" [*] SMTP sink listening on {args.host}:{sink.port}")
+    try:
+        sink.serve_forever()
+    except KeyboardInterrupt:
+        print(f" [*] {sink.messages} messages over {sink.connections} connections")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Ordered acks of the concurrent dispatcher, and the digest's retry backoff"""
+from dispatch import AckTracker
+from digest import DigestBatcher
+
+
+class FakeChannel:
+    def __init__(self):
+        self.calls = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.calls.append(("ack", delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        self.calls.append(("nack", delivery_tag, requeue))
+
+
+class FakeConnection:
+    is_open = True
+
+    def __init__(self):
+        self.timers = []
+
+    def call_later(self, delay, callback):
+        self.timers.append((delay, callback))
+        return len(self.timers)
+
+    def remove_timeout(self, timer):
+        pass
+
+    def add_callback_threadsafe(self, callback):
+        callback()
+
+    def process_data_events(self, time_limit=0):
+        pass
+
+
+class Method:
+    def __init__(self, delivery_tag):
+        self.delivery_tag = delivery_tag
+
+
+def test_acks_wait_for_earlier_deliveries():
+    channel = FakeChannel()
+    tracker = AckTracker(channel)
+    for tag in (1, 2, 3):
+        tracker.track(tag)
+
+    tracker.settle(3, True)
+    tracker.settle(2, True)
+    assert channel.calls == []
+
+    tracker.settle(1, True)
+    assert channel.calls == [("ack", 3, True)]
+
+
+def test_nack_splits_runs_of_acks():
+    channel = FakeChannel()
+    tracker = AckTracker(channel)
+    for tag in (1, 2, 3, 4):
+        tracker.track(tag)
+
+    tracker.settle(4, True)
+    tracker.settle(2, False, requeue=True)
+    tracker.settle(3, True)
+    tracker.settle(1, True)
+    assert channel.calls == [("ack", 1, True), ("nack", 2, True), ("ack", 4, True)]
+
+
+def test_unknown_and_repeated_settles_are_ignored():
+    channel = FakeChannel()
+    tracker = AckTracker(channel)
+    tracker.track(1)
+    tracker.settle(1, True)
+    tracker.settle(1, False)
+    tracker.settle(7, True)
+    assert channel.calls == [("ack", 1, True)]
+
+
+def test_failed_digest_is_requeued_after_a_growing_delay():
+    channel, connection = FakeChannel(), FakeConnection()
+    batcher = DigestBatcher(
+        connection, channel, lambda body, properties: {"user_email": "a@example.com", "mp3_fid": body},
+        lambda receiver, events: "smtp down", window=60, max_items=2, retry_delay=5, max_retry_delay=8,
+    )
+
+    delays = []
+    for first in (1, 3, 5):
+        batcher.on_message(channel, Method(first), None, f"fid{first}")
+        batcher.on_message(channel, Method(first + 1), None, f"fid{first + 1}")
+        # The batch is full and sent at once; wait for the sender pool to settle it
+        batcher.executor.submit(lambda: None).result()
+        assert channel.calls == []
+        delay, requeue = connection.timers[-1]
+        delays.append(delay)
+        requeue()
+        assert channel.calls == [("nack", first, True), ("nack", first + 1, True)]
+        channel.calls.clear()
+
+    assert delays == [5, 8, 8]
+    batcher.executor.shutdown()
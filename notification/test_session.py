@@ -0,0 +1,81 @@
+"""SMTP session reuse (send/session.py), against the local sink"""
+import socket
+from email.message import EmailMessage
+import pytest
+from send.session import SMTPSessionPool
+from smtp_sink import SMTPSink
+
+
+@pytest.fixture
+def sink():
+    sink = SMTPSink().start()
+    yield sink
+    sink.stop()
+
+
+@pytest.fixture
+def pool(sink):
+    pools = []
+
+    def make(**kwargs):
+        pools.append(SMTPSessionPool("user", "secret", host="127.0.0.1", port=sink.port, starttls=False,
+                                     size=1, timeout=5, **kwargs))
+        return pools[-1]
+    yield make
+    for p in pools:
+        p.close()
+
+
+def message(to="b@example.com"):
+    msg = EmailMessage()
+    msg["Subject"], msg["From"], msg["To"] = "MP3 Download", "a@example.com", to
+    msg.set_content("ready")
+    return msg
+
+
+def test_messages_share_one_session(sink, pool):
+    smtp = pool()
+    for i in range(5):
+        smtp.send(message(f"{i}@example.com"), "a@example.com", [f"{i}@example.com"])
+    assert smtp.opened == 1
+    assert sink.connections == 1
+    assert sink.recipients == [f"{i}@example.com" for i in range(5)]
+
+
+def test_sessions_are_recycled_after_max_messages(sink, pool):
+    smtp = pool(max_messages=2)
+    for _ in range(5):
+        smtp.send(message(), "a@example.com", ["b@example.com"])
+    assert smtp.opened == 3
+    assert sink.messages == 5
+
+
+def test_a_dropped_session_is_replaced(sink, pool):
+    smtp = pool(noop_after=3600)
+    smtp.send(message(), "a@example.com", ["b@example.com"])
+    # The server hangs up while the session sits idle, too recently used to be probed
+    idle = smtp._idle.queue[0]
+    idle.smtp.sock.shutdown(socket.SHUT_RDWR)
+
+    smtp.send(message(), "a@example.com", ["b@example.com"])
+    assert smtp.opened == 2
+    assert sink.messages == 2
+
+
+def test_idle_sessions_are_probed_before_reuse(sink, pool):
+    smtp = pool(noop_after=0)
+    smtp.send(message(), "a@example.com", ["b@example.com"])
+    smtp._idle.queue[0].smtp.sock.shutdown(socket.SHUT_RDWR)
+
+    smtp.send(message(), "a@example.com", ["b@example.com"])
+    # The NOOP found the session dead, so the message went out on a new one at first try
+    assert smtp.opened == 2
+    assert sink.messages == 2
+
+
+def test_a_fresh_session_failing_is_not_retried(sink, pool):
+    smtp = pool()
+    sink.stop()
+    with pytest.raises(OSError):
+        smtp.send(message(), "a@example.com", ["b@example.com"])
+    assert smtp.opened == 0
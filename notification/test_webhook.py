@@ -0,0 +1,108 @@
+"""Webhook deliveries only ever reach public addresses, and are signed"""
+import hashlib, hmac, socket, threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import pytest
+from send import webhook
+
+MESSAGE = {"job_id": "j1", "video_fid": "v1", "mp3_fid": "m1"}
+
+
+class Endpoint(BaseHTTPRequestHandler):
+    status = 200
+    received: list = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.received.append((dict(self.headers), body))
+        self.send_response(self.status)
+        self.send_header("Location", "http://127.0.0.1:1/")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def endpoint():
+    Endpoint.status, Endpoint.received = 200, []
+    server = HTTPServer(("127.0.0.1", 0), Endpoint)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_address[1]
+    server.shutdown()
+
+
+@pytest.fixture
+def resolve(monkeypatch):
+    """Answers DNS lookups from a list of addresses per host, the last one repeating"""
+    answers: dict[str, list[str]] = {}
+    real = socket.getaddrinfo
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        if host not in answers:
+            return real(host, port, *args, **kwargs)
+        queue = answers[host]
+        address = queue.pop(0) if len(queue) > 1 else queue[0]
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port))]
+    monkeypatch.setattr(webhook.socket, "getaddrinfo", getaddrinfo)
+    return answers
+
+
+class Registry:
+    def __init__(self, url):
+        self.hooks = [{"id": "h1", "url": url, "secret": "s3cret"}]
+
+    def for_owner(self, owner):
+        return self.hooks
+
+
+@pytest.fixture
+def transport():
+    made = []
+
+    def make(url):
+        made.append(webhook.WebhookTransport(Registry(url), linger=0, retries=0, timeout=2, deliver_timeout=5))
+        return made[-1]
+    yield make
+    for t in made:
+        t.close()
+
+
+@pytest.mark.parametrize("address", ["127.0.0.1", "10.0.0.5", "169.254.169.254", "::1", "fd00::1", "224.0.0.1"])
+def test_internal_addresses_are_refused(resolve, address):
+    resolve["hook.example"] = [address]
+    assert webhook.url_error("https://hook.example/cb") is not None
+
+
+def test_public_addresses_are_allowed(resolve):
+    resolve["hook.example"] = ["93.184.216.34"]
+    assert webhook.url_error("https://hook.example/cb") is None
+
+
+def test_dns_rebound_after_the_check_is_not_followed(resolve, endpoint, transport):
+    # Public when checked, loopback by the time the connection is made
+    resolve["hook.example"] = ["93.184.216.34", "127.0.0.1"]
+    err = transport(f"http://hook.example:{endpoint}/cb").deliver("a@example.com", [MESSAGE])
+    assert "unreachable" in err
+    assert Endpoint.received == []
+
+
+def test_connection_goes_to_the_checked_address_with_the_original_host(resolve, endpoint, transport, monkeypatch):
+    # Loopback stands in for a public address here
+    monkeypatch.setattr(webhook, "_allowed", lambda address: True)
+    resolve["hook.example"] = ["127.0.0.1"]
+    assert transport(f"http://hook.example:{endpoint}/cb").deliver("a@example.com", [MESSAGE]) is None
+
+    (headers, body), = Endpoint.received
+    assert headers["Host"] == f"hook.example:{endpoint}"
+    expected = hmac.new(b"s3cret", headers["X-Webhook-Timestamp"].encode() + b"." + body, hashlib.sha256).hexdigest()
+    assert headers["X-Webhook-Signature"] == f"sha256={expected}"
+
+
+def test_redirects_are_not_followed(resolve, endpoint, transport, monkeypatch):
+    monkeypatch.setattr(webhook, "_allowed", lambda address: True)
+    resolve["hook.example"] = ["127.0.0.1"]
+    Endpoint.status = 302
+    err = transport(f"http://hook.example:{endpoint}/cb").deliver("a@example.com", [MESSAGE])
+    assert "answered 302" in err
+    assert len(Endpoint.received) == 1
@@ -0,0 +1,144 @@
+"""
+Pipeline tracing.
+
+A trace ID is minted when a video is uploaded and travels with the job in the
+queue message body and in the AMQP headers. Every service records the spans
+it is responsible for under that ID and exports them as JSON lines, either to
+a local file or in batches to an HTTP collector, from a background thread so
+the request or delivery being traced never waits on the export.
+
+This module is copied verbatim into each service; keep the copies in sync.
+"""
+import json, os, queue, threading, time, uuid
+import logging
+import urllib.request
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# "file:/path/spans.jsonl", "http(s)://collector/...", or empty to disable tracing
+TRACE_EXPORT = os.environ.get("TRACE_EXPORT", "")
+TRACE_SERVICE = os.environ.get("TRACE_SERVICE", "unknown")
+# Spans dropped rather than queued once this many are waiting for export
+TRACE_QUEUE_SIZE = int(os.environ.get("TRACE_QUEUE_SIZE", "10000"))
+
+HEADER = "x-trace-id"
+ENQUEUED_HEADER = "x-enqueued-at"
+
+
+def new_id() -> str:
+    return uuid.uuid4().hex
+
+
+def trace_id(message: dict, properties=None) -> str | None:
+    """The trace ID of a queue message, from its body or else its AMQP headers"""
+    tid = message.get("trace_id")
+    if not tid and properties is not None:
+        tid = (properties.headers or {}).get(HEADER) or properties.correlation_id
+    return tid
+
+
+def stamp(message: dict) -> dict:
+    """Mark a message as enqueued now; returns the AMQP headers to publish it with"""
+    message["enqueued_at"] = time.time()
+    return {HEADER: message.get("trace_id"), ENQUEUED_HEADER: message["enqueued_at"]}
+
+
+class _Exporter:
+    def __init__(self, target: str, maxsize: int):
+        self.target = target
+        self.queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def emit(self, span: dict):
+        # gunicorn forks after import, so the export thread is started lazily per worker
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    threading.Thread(target=self._run, name="trace-export", daemon=True).start()
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < 500:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.warning("Could not export %s span(s) to %s: %s", len(batch), self.target, e)
+
+    def _write(self, batch: list[dict]):
+        if self.target.startswith("file:"):
+            with open(self.target[len("file:"):], "a") as f:
+                f.writelines(json.dumps(s, separators=(",", ":")) + "\n" for s in batch)
+            return
+
+        req = urllib.request.Request(
+            self.target,
+            data=json.dumps(batch).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        urllib.request.urlopen(req, timeout=5).close()
+
+    def flush(self, timeout: float = 5):
+        deadline = time.monotonic() + timeout
+        while not self.queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+
+exporter = _Exporter(TRACE_EXPORT, TRACE_QUEUE_SIZE) if TRACE_EXPORT else None
+
+
+def record(tid: str | None, name: str, start: float, end: float, **attrs):
+    """Record a span whose wall-clock start and end were measured elsewhere, e.g. time spent queued"""
+    if exporter is None or not tid:
+        return
+    exporter.emit({
+        "trace_id": tid,
+        "service": TRACE_SERVICE,
+        "span": name,
+        "start": round(start, 6),
+        "duration": round(max(end - start, 0.0), 6),
+        **({"attrs": attrs} if attrs else {}),
+    })
+
+
+def record_queued(tid: str | None, message: dict, **attrs):
+    """Record the 'dequeue' span: how long a message waited between publish and delivery"""
+    enqueued_at = message.get("enqueued_at")
+    if enqueued_at:
+        record(tid, "dequeue", enqueued_at, time.time(), **attrs)
+
+
+@contextmanager
+def span(tid: str | None, name: str, **attrs):
+    """Time the enclosed block; exceptions are recorded on the span and re-raised"""
+    if exporter is None or not tid:
+        yield attrs
+        return
+
+    start = time.time()
+    t0 = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record(tid, name, start, start + time.perf_counter() - t0, **attrs)
+
+
+def flush(timeout: float = 5):
+    if exporter is not None:
+        exporter.flush(timeout)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Per-stage latency report from exported pipeline spans.
+
+Reads the JSON-lines span files written by the gateway, converter and
+notification services (TRACE_EXPORT=file:...), and prints latency percentiles
+for every stage plus the end-to-end time from upload to the last notification:
+
+    python3 trace_report.py gateway.jsonl converter.jsonl notification.jsonl
+    python3 trace_report.py spans/*.jsonl --trace 3f2a...   # one job's timeline
+
+Queue wait ("dequeue") is measured across hosts, so it includes their clock skew.
+"""
+import argparse, json, sys
+from collections import defaultdict
+
+# Pipeline order, used to sort the report; unknown stages are listed after these
+STAGES = ["upload", "enqueue", "dequeue", "fetch", "encode", "store", "publish", "send"]
+PERCENTILES = (50, 90, 95, 99)
+
+
+def load(paths):
+    spans = []
+    for path in paths:
+        with open(path) as f:
+            for n, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    spans.append(json.loads(line))
+                except json.JSONDecodeError:
+                    print(f"{path}:{n}: skipping malformed span", file=sys.stderr)
+    return spans
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    k = max(0, min(len(values) - 1, round(p / 100 * len(values) + 0.5) - 1))
+    return values[k]
+
+
+def fmt(seconds):
+    if seconds >= 60:
+        return f"{seconds / 60:.1f}m"
+    if seconds >= 1:
+        return f"{seconds:.2f}s"
+    return f"{seconds * 1000:.1f}ms"
+
+
+def stage_key(item):
+    (service, name), _ = item
+    return (STAGES.index(name) if name in STAGES else len(STAGES), name, service)
+
+
+def report(spans):
+    stages = defaultdict(list)
+    errors = defaultdict(int)
+    traces = defaultdict(list)
+    for s in spans:
+        stages[(s["service"], s["span"])].append(s["duration"])
+        if "error" in s.get("attrs", {}):
+            errors[(s["service"], s["span"])] += 1
+        traces[s["trace_id"]].append(s)
+
+    header = f"{'service':<14}{'stage':<10}{'count':>8}{'errors':>8}" + "".join(f"{'p' + str(p):>10}" for p in PERCENTILES) + f"{'max':>10}"
+    print(header)
+    print("-" * len(header))
+    for (service, name), durations in sorted(stages.items(), key=stage_key):
+        durations.sort()
+        print(f"{service:<14}{name:<10}{len(durations):>8}{errors[(service, name)]:>8}"
+              + "".join(f"{fmt(percentile(durations, p)):>10}" for p in PERCENTILES)
+              + f"{fmt(durations[-1]):>10}")
+
+    # End to end only for traces that made it from the gateway to a notification
+    totals = sorted(
+        max(s["start"] + s["duration"] for s in ts) - min(s["start"] for s in ts)
+        for ts in traces.values()
+        if {"upload", "send"} <= {s["span"] for s in ts}
+    )
+    print(f"\n{len(traces)} trace(s), {len(totals)} complete")
+    if totals:
+        print("end to end  " + "  ".join(f"p{p} {fmt(percentile(totals, p))}" for p in PERCENTILES)
+              + f"  max {fmt(totals[-1])}")
+
+
+def timeline(spans, trace_id):
+    ts = sorted((s for s in spans if s["trace_id"] == trace_id), key=lambda s: s["start"])
+    if not ts:
+        print(f"No spans for trace {trace_id}")
+        return
+    t0 = ts[0]["start"]
+    for s in ts:
+        attrs = " ".join(f"{k}={v}" for k, v in s.get("attrs", {}).items())
+        print(f"+{fmt(s['start'] - t0):>9}  {s['service']:<14}{s['span']:<10}{fmt(s['duration']):>10}  {attrs}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="span files exported by the services")
+    parser.add_argument("--trace", help="print the timeline of one trace instead of the summary")
+    args = parser.parse_args()
+
+    spans = load(args.files)
+    if args.trace:
+        timeline(spans, args.trace)
+    else:
+        report(spans)
+
+
+if __name__ == "__main__":
+    main()